@@ -3,6 +3,10 @@ from PIL import Image
 import torch
 import requests
 
+from image_context import open_rgb
+from inference_batcher import infer
+from model_registry import registry, resolve_weights
+
 class MultiModelClassifier:
     def __init__(self, model_name="resnet50", weights="DEFAULT", device=None, class_file=None):
         """
@@ -16,16 +20,21 @@ class MultiModelClassifier:
         """
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.model_name = model_name
+        self.weights_name = weights
 
-        # 加载模型和权重
-        self.model, self.weights = self._load_model_and_weights(model_name, weights)
-        self.model = self.model.to(self.device).eval()
-
-        # 预处理函数
+        # 这里只解析权重和预处理函数，模型在首次推理时才由注册表加载
+        # （推理进程池可用时模型只在推理进程中加载，当前进程不占用模型内存）
+        self.weights = resolve_weights(model_name, weights)
         self.preprocess = self.weights.transforms()
 
-        # 加载类别标签（需确保与模型输出一致）
-        self.categories = self._load_classes(class_file)
+        # 加载类别标签（需确保与模型输出一致），同样由注册表缓存
+        self.categories = registry.get_labels(class_file, loader=lambda: self._load_classes(class_file))
+
+    @property
+    def model(self):
+        """当前进程中的模型（按需从进程级模型注册表加载，同一进程只加载一次）"""
+        entry = registry.get(self.model_name, self.weights_name, self.device, loader=self._load_model_and_weights)
+        return entry.model
 
     def _load_model_and_weights(self, model_name, weights):
         """动态加载模型和权重（修复驼峰命名问题）"""
@@ -113,14 +122,20 @@ class MultiModelClassifier:
         return categories
 
     def predict(self, image_path, top_k=5):
-        """执行预测"""
-        image = Image.open(image_path).convert("RGB")
-        input_tensor = self.preprocess(image).unsqueeze(0).to(self.device)
-
-        with torch.no_grad():
-            output = self.model(input_tensor)
-
-        probs = torch.nn.functional.softmax(output[0], dim=0)
-        top_probs, top_indices = torch.topk(probs, top_k)
-
-        return [(self.categories[i], float(p)) for i, p in zip(top_indices, top_probs)]
\ No newline at end of file
+        """执行预测（image_path 也可以是已解码的 ImageContext）"""
+        image = open_rgb(image_path, min_side=self.preprocess.resize_size[0])
+        input_tensor = self.preprocess(image).unsqueeze(0)
+        return self.predict_batch_tensor(input_tensor, top_k)[0]
+
+    def predict_batch(self, image_paths, top_k=5):
+        """批量预测，一次前向推理处理多张图片"""
+        input_tensor = torch.stack([
+            self.preprocess(open_rgb(path, min_side=self.preprocess.resize_size[0])) for path in image_paths
+        ])
+        return self.predict_batch_tensor(input_tensor, top_k)
+
+    def predict_batch_tensor(self, input_tensor, top_k=5):
+        """对预处理后的批次 (N, C, H, W) 推理（经由微批推理服务）"""
+        batch_results = infer(self.model_name, self.weights_name, self.device, input_tensor, top_k,
+                              loader=self._load_model_and_weights)
+        return [[(self.categories[i], float(p)) for i, p in top_results] for top_results in batch_results]
\ No newline at end of file
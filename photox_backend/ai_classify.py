@@ -2,11 +2,25 @@ import requests
 import base64
 from PIL import Image
 import io
+import os
+
+from http_client import client
+from image_context import ImageContext
+from vlm_cache import cache
+
+# VLM 接口地址和模型（接口地址可通过环境变量指向本地替身服务）
+VLM_API_URL = os.getenv("PHOTOX_VLM_API_URL", "https://api.qnaigc.com/v1/chat/completions")
+VLM_MODEL = "qwen2.5-vl-7b-instruct"
+# 分类提示词版本：修改提示词或类别表后需要递增，使旧的缓存结果失效
+PROMPT_VERSION = "1"
 
 
 def process_image(image_path, max_size=2048, quality=85):
-    """图片预处理核心函数"""
+    """图片预处理核心函数（image_path 也可以是已解码的 ImageContext）"""
     try:
+        if isinstance(image_path, ImageContext):
+            return image_path.jpeg_bytes(max_size, quality)
+
         # 读取并转换图片格式
         img = Image.open(image_path)
         if img.mode != 'RGB':
@@ -30,6 +44,14 @@ def process_image(image_path, max_size=2048, quality=85):
 
 
 def image_classification(image_path, api_key):
+    """带缓存的分类入口：感知哈希相同的图片直接复用之前的分类结果，不再调用接口"""
+    return cache.get_or_call(
+        image_path, VLM_MODEL, PROMPT_VERSION,
+        lambda: _request_classification(image_path, api_key)
+    )
+
+
+def _request_classification(image_path, api_key):
     # 1. 预处理图片
     image_bytes = process_image(image_path)
     if not image_bytes:
@@ -41,7 +63,7 @@ def image_classification(image_path, api_key):
 
     # 3. 构建请求载荷（保持分类提示不变）
     payload = {
-        "model": "qwen2.5-vl-7b-instruct",
+        "model": VLM_MODEL,
         "messages": [
             {
                 "role": "system",
@@ -83,8 +105,10 @@ def image_classification(image_path, api_key):
     }
 
     try:
-        response = requests.post(
-            "https://api.qnaigc.com/v1/chat/completions",
+        # 经由共享的出站客户端：复用连接、并发限制和熔断
+        # 分类请求按次计费，不重试（重试会重复计费，也会超出 classify 阶段的超时时间）
+        response = client.post(
+            VLM_API_URL,
             json=payload,
             headers=headers,
             timeout=15
@@ -1,6 +1,8 @@
 from image_classifier import ImageClassifier
 from torchvision import models
 from MultiModelClassifier import MultiModelClassifier
+from image_context import ImageContext
+import inference_client
 import logging
 import traceback
 import os
@@ -37,57 +39,91 @@ def get_generic_category(label):
     return '其他'
 
 
+def _remote_predict(images, model_type):
+    """
+    配置了远程推理节点（PHOTOX_INFERENCE_NODES）时交给推理节点
+    :return: 每张图片的 [(标签, 概率), ...]；未配置或所有节点都不可用时返回 None，由调用方在本机推理
+    """
+    if not inference_client.enabled():
+        return None
+    try:
+        return inference_client.get_client().predict_many(images, model_type)
+    except Exception as e:
+        logger.error(f"远程推理失败，改为本机推理: {str(e)}")
+        return None
+
+
 def ai_image(image_path, model_type="resnet50"):
     """
     对图片进行分类并返回标签列表和通用类别
-    :param image_path: 图片路径
+    :param image_path: 图片路径，或已解码的 ImageContext
     :param model_type: 模型类型（可选："resnet50" 或 "inception_v3"）
     :return: (tags, category) 元组
     """
+    tags, category, _ = ai_image_with_scores(image_path, model_type)
+    return tags, category
+
+
+def ai_image_with_scores(image_path, model_type="resnet50"):
+    """
+    与 ai_image 相同，额外返回每个标签的置信度
+    :return: (tags, category, scores) 元组，scores 与 tags 一一对应，使用默认标签时为 [None]
+    """
     try:
-        # 检查文件是否存在
-        if not os.path.exists(image_path):
-            logger.error(f"AI分析失败：图片文件不存在: {image_path}")
-            return ["未分类"], "其他"
-            
-        logger.info(f"开始AI分析图片: {image_path}")
-        logger.info(f"使用模型: {model_type}")
-        
-        # 检查文件大小
-        file_size = os.path.getsize(image_path)
-        if file_size == 0:
-            logger.error(f"AI分析失败：图片文件为空: {image_path}")
-            return ["未分类"], "其他"
-        logger.info(f"图片大小: {file_size} 字节")
+        if isinstance(image_path, ImageContext):
+            # 已解码的图片无需再检查文件
+            logger.info(f"开始AI分析图片: {image_path.format} {image_path.size}")
+            logger.info(f"使用模型: {model_type}")
+        else:
+            # 检查文件是否存在
+            if not os.path.exists(image_path):
+                logger.error(f"AI分析失败：图片文件不存在: {image_path}")
+                return ["未分类"], "其他", [None]
+
+            logger.info(f"开始AI分析图片: {image_path}")
+            logger.info(f"使用模型: {model_type}")
+
+            # 检查文件大小
+            file_size = os.path.getsize(image_path)
+            if file_size == 0:
+                logger.error(f"AI分析失败：图片文件为空: {image_path}")
+                return ["未分类"], "其他", [None]
+            logger.info(f"图片大小: {file_size} 字节")
             
-        # 初始化分类器
-        try:
-            if model_type == "inception_v3":
-                classifier = MultiModelClassifier(model_name="inception_v3", weights="DEFAULT")
-                logger.info("成功初始化inception_v3分类器")
-            else:
-                classifier = ImageClassifier()  # 默认使用 resnet50
-                logger.info("成功初始化resnet50分类器")
-        except Exception as e:
-            logger.error(f"初始化分类器失败: {str(e)}")
-            logger.error(traceback.format_exc())
-            return ["未分类"], "其他"
-
-        # 预测结果
-        try:
-            results = classifier.predict(image_path)
-            logger.info(f"预测完成，获得 {len(results)} 个结果")
-        except Exception as e:
-            logger.error(f"预测图片失败: {str(e)}")
-            logger.error(traceback.format_exc())
-            return ["未分类"], "其他"
+        remote_results = _remote_predict([image_path], model_type)
+        if remote_results is not None:
+            results = remote_results[0]
+            logger.info(f"远程推理完成，获得 {len(results)} 个结果")
+        else:
+            # 初始化分类器
+            try:
+                if model_type == "inception_v3":
+                    classifier = MultiModelClassifier(model_name="inception_v3", weights="DEFAULT")
+                    logger.info("成功初始化inception_v3分类器")
+                else:
+                    classifier = ImageClassifier()  # 默认使用 resnet50
+                    logger.info("成功初始化resnet50分类器")
+            except Exception as e:
+                logger.error(f"初始化分类器失败: {str(e)}")
+                logger.error(traceback.format_exc())
+                return ["未分类"], "其他", [None]
+
+            # 预测结果
+            try:
+                results = classifier.predict(image_path)
+                logger.info(f"预测完成，获得 {len(results)} 个结果")
+            except Exception as e:
+                logger.error(f"预测图片失败: {str(e)}")
+                logger.error(traceback.format_exc())
+                return ["未分类"], "其他", [None]
 
         # 提取标签列表和类别
         if not results:
             logger.warning("预测结果为空")
-            return ["未分类"], "其他"
+            return ["未分类"], "其他", [None]
             
         tags = [label for label, _ in results]
+        scores = [float(score) for _, score in results]
         
         tags = clean_tags(tags)
         logger.info(f"提取的标签: {tags}")
@@ -95,12 +131,58 @@ def ai_image(image_path, model_type="resnet50"):
         category = get_generic_category(tags[0]) if tags else '其他'
         logger.info(f"确定的通用类别: {category}")
 
-        return tags, category
+        return tags, category, scores
     except Exception as e:
         logger.error(f"AI图像分析过程中发生异常: {str(e)}")
         logger.error(traceback.format_exc())
         # 返回默认值
-        return ["未分类"], "其他"
+        return ["未分类"], "其他", [None]
+
+
+def _predict_batch_local(images, model_type):
+    """在本机批量推理，失败时返回 None"""
+    try:
+        if model_type == "inception_v3":
+            classifier = MultiModelClassifier(model_name="inception_v3", weights="DEFAULT")
+        else:
+            classifier = ImageClassifier()
+        batch_results = classifier.predict_batch(images)
+        logger.info(f"批量预测完成，共 {len(batch_results)} 张图片")
+        return batch_results
+    except Exception as e:
+        logger.error(f"批量预测图片失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        return None
+
+
+def ai_image_batch(images, model_type="resnet50"):
+    """
+    批量分析多张图片，所有图片的预处理结果合并为批次推理（配置了远程推理节点时分散到各节点）
+    :param images: 图片路径或 ImageContext 列表
+    :return: 与输入一一对应的 (tags, category) 列表，失败时整批返回默认值
+    """
+    return [(tags, category) for tags, category, _ in ai_image_batch_with_scores(images, model_type)]
+
+
+def ai_image_batch_with_scores(images, model_type="resnet50"):
+    """与 ai_image_batch 相同，每项额外返回标签置信度：(tags, category, scores)，使用默认标签的项 scores 为 [None]"""
+    if not images:
+        return []
+    batch_results = _remote_predict(images, model_type)
+    if batch_results is not None:
+        logger.info(f"远程批量推理完成，共 {len(batch_results)} 张图片")
+    else:
+        batch_results = _predict_batch_local(images, model_type)
+        if batch_results is None:
+            return [(["未分类"], "其他", [None]) for _ in images]
+
+    outputs = []
+    for results in batch_results:
+        tags = clean_tags([label for label, _ in results]) if results else ["未分类"]
+        scores = [float(score) for _, score in results] if results else [None]
+        category = get_generic_category(tags[0]) if results else '其他'
+        outputs.append((tags, category, scores))
+    return outputs
 
 
 # 使用示例
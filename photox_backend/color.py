@@ -1,10 +1,238 @@
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
 from colorthief import ColorThief
+from image_context import ImageContext
 # import matplotlib.pyplot as plt
 
+# 提取主色调使用的缩小图最长边（主色调对分辨率不敏感）
+COLOR_MAX_SIDE = 512
+# 主色调提取引擎：numpy（向量化的 MMCQ，默认）或 colorthief（原始的纯 Python 实现）
+PALETTE_ENGINE = os.getenv("PHOTOX_PALETTE_ENGINE", "numpy")
+
+# 以下常量与 ColorThief 的 MMCQ（改进的中位切分量化）保持一致，保证两者结果可比
+SIGBITS = 5
+RSHIFT = 8 - SIGBITS
+HISTO_SIDE = 1 << SIGBITS
+MAX_ITERATION = 1000
+FRACT_BY_POPULATIONS = 0.75
+
+
+class _DecodedColorThief(ColorThief):
+    """直接使用已解码的图片，避免 ColorThief 再次打开并解码文件"""
+    def __init__(self, image):
+        self.image = image
+
+
+def _load_scaled(source):
+    """打开并缩小图片：ImageContext 复用已解码的像素，路径只按 JPEG draft 缩小解码"""
+    if isinstance(source, ImageContext):
+        return source.scaled(max_side=COLOR_MAX_SIDE)
+    if isinstance(source, Image.Image):
+        img = source
+    else:
+        img = Image.open(source)
+        img.draft('RGB', (COLOR_MAX_SIDE, COLOR_MAX_SIDE))
+    if max(img.size) > COLOR_MAX_SIDE:
+        img = img.copy()
+        img.thumbnail((COLOR_MAX_SIDE, COLOR_MAX_SIDE), Image.Resampling.BILINEAR)
+    return img
+
+
+def _histogram_indexes(img, quality):
+    """与 ColorThief 相同的采样规则：每 quality 个像素取一个，跳过透明和接近白色的像素"""
+    pixels = np.asarray(img.convert('RGBA')).reshape(-1, 4)[::quality]
+    r, g, b, a = pixels[:, 0], pixels[:, 1], pixels[:, 2], pixels[:, 3]
+    valid = (a >= 125) & ~((r > 250) & (g > 250) & (b > 250))
+    r, g, b = r[valid] >> RSHIFT, g[valid] >> RSHIFT, b[valid] >> RSHIFT
+    return (r.astype(np.int64) << (2 * SIGBITS)) | (g.astype(np.int64) << SIGBITS) | b
+
+
+class _VBox:
+    """量化颜色空间中的长方体，像素数、体积和平均色按需计算并缓存"""
+    __slots__ = ('bounds', 'histo', '_count', '_avg')
+
+    def __init__(self, bounds, histo):
+        # bounds: [r1, r2, g1, g2, b1, b2]（闭区间）
+        self.bounds = list(bounds)
+        self.histo = histo
+        self._count = None
+        self._avg = None
+
+    def _slice(self):
+        r1, r2, g1, g2, b1, b2 = self.bounds
+        return self.histo[r1:r2 + 1, g1:g2 + 1, b1:b2 + 1]
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = int(self._slice().sum())
+        return self._count
+
+    @property
+    def volume(self):
+        r1, r2, g1, g2, b1, b2 = self.bounds
+        return (r2 - r1 + 1) * (g2 - g1 + 1) * (b2 - b1 + 1)
+
+    @property
+    def avg(self):
+        if self._avg is None:
+            mult = 1 << RSHIFT
+            box = self._slice()
+            total = box.sum()
+            if total:
+                avg = []
+                for axis, start in enumerate(self.bounds[::2]):
+                    other_axes = tuple(i for i in range(3) if i != axis)
+                    weights = (np.arange(start, start + box.shape[axis]) + 0.5) * mult
+                    avg.append(int(float((box.sum(axis=other_axes) * weights).sum()) / total))
+            else:
+                avg = [int(mult * (low + high + 1) / 2) for low, high in zip(self.bounds[::2], self.bounds[1::2])]
+            self._avg = tuple(avg)
+        return self._avg
+
+
+def _median_cut(vbox):
+    """沿最长的边切分长方体（逐行对应 ColorThief 的 median_cut_apply）"""
+    if not vbox.count:
+        return None, None
+    if vbox.count == 1:
+        return _VBox(vbox.bounds, vbox.histo), None
+
+    widths = [vbox.bounds[1] - vbox.bounds[0], vbox.bounds[3] - vbox.bounds[2], vbox.bounds[5] - vbox.bounds[4]]
+    # 宽度相同时按 r、g、b 的顺序优先
+    axis = widths.index(max(widths))
+    other_axes = tuple(i for i in range(3) if i != axis)
+    dim1, dim2 = vbox.bounds[2 * axis], vbox.bounds[2 * axis + 1]
+    partial = np.cumsum(vbox._slice().sum(axis=other_axes)).tolist()
+    total = partial[-1]
+
+    def partialsum(i):
+        return partial[i - dim1] if dim1 <= i <= dim2 else 0
+
+    def lookaheadsum(i):
+        return total - partial[i - dim1] if dim1 <= i <= dim2 else None
+
+    for i in range(dim1, dim2 + 1):
+        if partialsum(i) > total / 2:
+            left = i - dim1
+            right = dim2 - i
+            if left <= right:
+                d2 = min(dim2 - 1, int(i + right / 2))
+            else:
+                d2 = max(dim1, int(i - 1 - left / 2))
+            # 避免切出空的长方体
+            while not partialsum(d2):
+                d2 += 1
+            count2 = lookaheadsum(d2)
+            while not count2 and partialsum(d2 - 1):
+                d2 -= 1
+                count2 = lookaheadsum(d2)
+            vbox1 = _VBox(vbox.bounds, vbox.histo)
+            vbox2 = _VBox(vbox.bounds, vbox.histo)
+            vbox1.bounds[2 * axis + 1] = d2
+            vbox2.bounds[2 * axis] = d2 + 1
+            return vbox1, vbox2
+    return None, None
+
+
+def _iterate(boxes, sort_key, target):
+    """反复切分排序键最大的长方体，直到颜色数达到 target"""
+    n_color = 1
+    n_iter = 0
+    while n_iter < MAX_ITERATION:
+        boxes.sort(key=sort_key)
+        vbox = boxes.pop()
+        if not vbox.count:
+            boxes.append(vbox)
+            n_iter += 1
+            continue
+        vbox1, vbox2 = _median_cut(vbox)
+        if not vbox1:
+            raise RuntimeError("vbox1 not defined; shouldn't happen!")
+        boxes.append(vbox1)
+        if vbox2:
+            boxes.append(vbox2)
+            n_color += 1
+        if n_color >= target:
+            return
+        n_iter += 1
+
+
+def _quantize(histo, color_count):
+    """在 32x32x32 的颜色直方图上执行 MMCQ，返回按 像素数 x 体积 降序排列的调色板"""
+    if color_count < 2 or color_count > 256:
+        raise ValueError('Wrong number of max colors when quantize.')
+    # 初始长方体：包含所有像素的最小范围
+    bounds = []
+    for axis in range(3):
+        other_axes = tuple(i for i in range(3) if i != axis)
+        present = np.nonzero(histo.sum(axis=other_axes))[0]
+        bounds += [int(present[0]), int(present[-1])]
+    boxes = [_VBox(bounds, histo)]
+
+    # 先按像素数切分，再按 像素数 x 体积 切分
+    _iterate(boxes, lambda box: box.count, FRACT_BY_POPULATIONS * color_count)
+    boxes.sort(key=lambda box: box.count)
+    boxes = boxes[::-1]
+    count_volume = lambda box: box.count * box.volume
+    _iterate(boxes, count_volume, color_count - len(boxes))
+    boxes.sort(key=count_volume)
+    return [box.avg for box in reversed(boxes)]
+
+
+def extract_palettes(images, num_colors=5, quality=10):
+    """
+    批量提取主色调：所有图片的颜色直方图在一次 bincount 中完成
+    :param images: 图片路径、ImageContext 或 PIL 图片的列表
+    :return: 与输入一一对应的 [(r, g, b), ...] 列表；没有有效像素的图片返回空列表
+    """
+    indexes = [_histogram_indexes(_load_scaled(image), quality) for image in images]
+    if not indexes:
+        return []
+    bins = HISTO_SIDE ** 3
+    offsets = np.concatenate([
+        index + position * bins for position, index in enumerate(indexes)
+    ])
+    histos = np.bincount(offsets, minlength=bins * len(indexes)).reshape(
+        len(indexes), HISTO_SIDE, HISTO_SIDE, HISTO_SIDE
+    )
+    return [_quantize(histo, num_colors) if histo.any() else [] for histo in histos]
+
+
 def extract_colors_with_colorthief(image_path, num_colors=5):
-    color_thief = ColorThief(image_path)
-    palette = color_thief.get_palette(color_count=num_colors)
-    return palette
+    if PALETTE_ENGINE == "colorthief":
+        if isinstance(image_path, ImageContext):
+            color_thief = _DecodedColorThief(image_path.scaled(max_side=COLOR_MAX_SIDE))
+        else:
+            color_thief = ColorThief(image_path)
+        return color_thief.get_palette(color_count=num_colors)
+    return extract_palettes([image_path], num_colors)[0]
+
+# sRGB（D65）→ CIE XYZ 的转换矩阵和参考白点
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def rgb_to_lab(colors):
+    """
+    sRGB（0-255）转 CIE Lab，Lab 空间中的欧氏距离（ΔE76）接近人眼感知的色差
+    :param colors: 形状为 (..., 3) 的数组或嵌套列表
+    :return: 同形状的 float64 数组
+    """
+    rgb = np.asarray(colors, dtype=np.float64) / 255.0
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    fx, fy, fz = f[..., 0], f[..., 1], f[..., 2]
+    return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], axis=-1)
 
 # def show_colors(colors):
 #     fig, ax = plt.subplots(1, len(colors), figsize=(10, 2))
@@ -13,7 +241,31 @@ def extract_colors_with_colorthief(image_path, num_colors=5):
 #         ax[i].axis('off')
 #     plt.show()
 
+
+def _benchmark(image_paths, num_colors=5, repeat=3):
+    """对比 ColorThief（原图）、ColorThief（缩小图）和 numpy 引擎的耗时与结果"""
+    def timed(func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    for image_path in image_paths:
+        print(f"{image_path}: {Image.open(image_path).size}")
+        t_full, p_full = timed(lambda: ColorThief(image_path).get_palette(color_count=num_colors))
+        t_small, p_small = timed(lambda: _DecodedColorThief(_load_scaled(image_path)).get_palette(color_count=num_colors))
+        t_numpy, p_numpy = timed(lambda: extract_palettes([image_path], num_colors)[0])
+        print(f"  colorthief 原图   {t_full * 1000:8.1f} ms  {p_full}")
+        print(f"  colorthief 缩小图 {t_small * 1000:8.1f} ms  {p_small}")
+        print(f"  numpy 引擎        {t_numpy * 1000:8.1f} ms  {p_numpy}  (与缩小图结果一致: {p_numpy == p_small})")
+
+    t_batch, _ = timed(lambda: extract_palettes(image_paths, num_colors))
+    print(f"批量提取 {len(image_paths)} 张: {t_batch * 1000:.1f} ms")
+
+
 if __name__ == "__main__":
-    image_path = "abc.jpg"
-    colors = extract_colors_with_colorthief(image_path, num_colors=2)
-    show_colors(colors)
\ No newline at end of file
+    # 用法: python color.py a.jpg b.jpg ...
+    _benchmark(sys.argv[1:] or ["abc.jpg"], num_colors=2)
@@ -0,0 +1,393 @@
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import requests
+from PIL import Image as PILImage
+from qiniu import Auth, urlsafe_base64_decode
+
+logger = logging.getLogger(__name__)
+
+# 本地开发用的七牛云替身：实现表单上传、分片上传 v2（含上传策略的大小/类型/insertOnly 限制和回调）、
+# stat/chgm/delete、文件下载和 imageView2 缩略图，对象保存在本地目录中。配合以下环境变量使用：
+#   PHOTOX_QINIU_UP_HOST=http://127.0.0.1:9000
+#   PHOTOX_QINIU_RS_HOST=http://127.0.0.1:9000
+#   PHOTOX_QINIU_PUBLIC_URL=http://127.0.0.1:9000
+_META_PREFIX = "x-qn-meta-"
+
+
+def _entry(encoded):
+    """解析 EncodedEntryURI（bucket:key 的 URL 安全 Base64）"""
+    bucket, _, key = urlsafe_base64_decode(encoded).decode("utf-8").partition(":")
+    return bucket, key
+
+
+class ObjectStore:
+    """对象保存在 root/<bucket>/<key>，MIME 和自定义元数据保存在同名的 .meta.json 中"""
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        # 进行中的分片上传：uploadId → {bucket, key, parts: {partNo: (etag, 分片数据)}}
+        self.uploads = {}
+        self.requests = {}
+
+    def _path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"非法的 key: {key}")
+        return path
+
+    def put(self, bucket, key, data, mime_type=None, metadata=None):
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        info = {
+            "fsize": len(data),
+            "hash": hashlib.sha1(data).hexdigest(),
+            "mimeType": mime_type or mimetypes.guess_type(key)[0] or "application/octet-stream",
+            "putTime": int(time.time() * 10 ** 7),
+            "x-qn-meta": {name[len(_META_PREFIX):]: value for name, value in (metadata or {}).items()},
+        }
+        with open(f"{path}.meta.json", "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+        return {"hash": info["hash"], "key": key}
+
+    def stat(self, bucket, key):
+        path = self._path(bucket, key)
+        if not os.path.exists(path):
+            return None
+        with open(f"{path}.meta.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def change_meta(self, bucket, key, mime_type=None, metadata=None):
+        info = self.stat(bucket, key)
+        if info is None:
+            return None
+        if mime_type:
+            info["mimeType"] = mime_type
+        info["x-qn-meta"].update({name[len(_META_PREFIX):]: value for name, value in (metadata or {}).items()})
+        with open(f"{self._path(bucket, key)}.meta.json", "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+        return info
+
+    def delete(self, bucket, key):
+        path = self._path(bucket, key)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        os.remove(f"{path}.meta.json")
+        return True
+
+    def read(self, key):
+        """按公开地址读取：在所有存储空间中查找该 key"""
+        for bucket in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            info = self.stat(bucket, key)
+            if info is not None:
+                with open(self._path(bucket, key), "rb") as f:
+                    return f.read(), info
+        return None, None
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+class FakeQiniuHandler(BaseHTTPRequestHandler):
+    server_version = "FakeQiniu/1.0"
+    protocol_version = "HTTP/1.1"
+
+    # ---------------------------------------------------------------- 上传
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        segments = [unquote(s) for s in path.strip("/").split("/")]
+        body = self._body()
+        if path == "/":
+            self._form_upload(body)
+        elif segments[0] == "buckets" and len(segments) == 5 and segments[4] == "uploads":
+            self._init_parts(segments[1], segments[3])
+        elif segments[0] == "buckets" and len(segments) == 6:
+            self._complete_parts(segments[1], segments[3], segments[5], body)
+        elif segments[0] in ("stat", "chgm", "delete") and len(segments) >= 2:
+            self._manage(segments)
+        else:
+            self._send(404, {"error": "no such api"})
+
+    def do_PUT(self):
+        segments = [unquote(s) for s in urlparse(self.path).path.strip("/").split("/")]
+        body = self._body()
+        if segments[0] == "buckets" and len(segments) == 7:
+            self._upload_part(segments[1], segments[3], segments[5], int(segments[6]), body)
+        else:
+            self._send(404, {"error": "no such api"})
+
+    def do_DELETE(self):
+        segments = [unquote(s) for s in urlparse(self.path).path.strip("/").split("/")]
+        if segments[0] == "buckets" and len(segments) == 6:
+            self.server.store.uploads.pop(segments[5], None)
+            self._send(200, {})
+        else:
+            self._send(404, {"error": "no such api"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        key = unquote(url.path.lstrip("/"))
+        data, info = self.server.store.read(key)
+        if data is None:
+            self._send(404, {"error": "no such file or directory"})
+            return
+        mime_type = info["mimeType"]
+        if url.query.startswith("imageView2/"):
+            self.server.store.count("image_view")
+            data, mime_type = self._image_view(data, url.query)
+        else:
+            self.server.store.count("get")
+        self.send_response(200)
+        self.send_header("Content-Type", mime_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in info["x-qn-meta"].items():
+            self.send_header(f"{_META_PREFIX}{name}", value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _image_view(data, query):
+        """imageView2/2/w/<宽>/h/<高>[/format/<格式>][/q/<质量>]：限定宽高缩放（不放大）"""
+        segments = query.split("/")[2:]
+        options = dict(zip(segments[::2], segments[1::2]))
+        img = PILImage.open(io.BytesIO(data))
+        img.thumbnail((int(options.get("w", img.width)), int(options.get("h", img.height))))
+        fmt = options.get("format", "jpg").lower()
+        output = io.BytesIO()
+        if fmt in ("jpg", "jpeg"):
+            img.convert("RGB").save(output, format="JPEG", quality=int(options.get("q", 85)))
+            return output.getvalue(), "image/jpeg"
+        img.save(output, format=fmt.upper())
+        return output.getvalue(), f"image/{fmt}"
+
+    def _form_upload(self, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1") + body
+        )
+        fields, file_data, file_type = {}, None, None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                file_data = part.get_payload(decode=True)
+                file_type = part.get_content_type()
+            else:
+                fields[name] = part.get_content()
+        policy = self._check_token(fields.get("token", ""), fields.get("key"))
+        if policy is None:
+            return
+        if file_data is None:
+            self._send(400, {"error": "file is empty"})
+            return
+        metadata = {name: value for name, value in fields.items() if name.startswith(_META_PREFIX)}
+        mime_type = None if file_type == "application/octet-stream" else file_type
+        self.server.store.count("form")
+        self._finish_upload(policy, fields["key"], file_data, mime_type, metadata)
+
+    def _init_parts(self, bucket, encoded_key):
+        key = urlsafe_base64_decode(encoded_key).decode("utf-8")
+        policy = self._check_token(self._up_token(), key)
+        if policy is None:
+            return
+        if policy.get("insertOnly") and self.server.store.stat(policy["bucket"], key) is not None:
+            self._send(614, {"error": "file exists"})
+            return
+        upload_id = uuid.uuid4().hex
+        self.server.store.uploads[upload_id] = {"bucket": bucket, "key": key, "parts": {}}
+        self.server.store.count("init_parts")
+        self._send(200, {"uploadId": upload_id, "expireAt": int(time.time()) + 7 * 24 * 3600})
+
+    def _upload_part(self, bucket, encoded_key, upload_id, part_no, body):
+        upload = self.server.store.uploads.get(upload_id)
+        if upload is None:
+            self._send(612, {"error": "no such uploadId"})
+            return
+        if self._check_token(self._up_token(), upload["key"]) is None:
+            return
+        md5 = hashlib.md5(body).hexdigest()
+        if self.headers.get("Content-MD5") not in (None, md5):
+            self._send(406, {"error": "md5 mismatch"})
+            return
+        etag = hashlib.sha1(body).hexdigest()
+        with self.server.store.lock:
+            upload["parts"][part_no] = (etag, body)
+        self.server.store.count("upload_part")
+        self._send(200, {"etag": etag, "md5": md5})
+
+    def _complete_parts(self, bucket, encoded_key, upload_id, body):
+        upload = self.server.store.uploads.get(upload_id)
+        if upload is None:
+            self._send(612, {"error": "no such uploadId"})
+            return
+        policy = self._check_token(self._up_token(), upload["key"])
+        if policy is None:
+            return
+        request = json.loads(body or b"{}")
+        data = []
+        for part in request.get("parts", []):
+            etag, chunk = upload["parts"].get(part["partNumber"], (None, None))
+            if etag != part["etag"]:
+                self._send(400, {"error": f"invalid part {part['partNumber']}"})
+                return
+            data.append(chunk)
+        self.server.store.uploads.pop(upload_id, None)
+        self.server.store.count("complete_parts")
+        self._finish_upload(policy, upload["key"], b"".join(data), request.get("mimeType"), request.get("metadata"))
+
+    def _finish_upload(self, policy, key, data, mime_type, metadata):
+        """按上传策略检查大小、类型和 insertOnly，保存对象，再按 returnBody 或回调返回结果"""
+        store = self.server.store
+        if policy.get("fsizeLimit") and len(data) > policy["fsizeLimit"]:
+            self._send(413, {"error": "file too large"})
+            return
+        mime_type = mime_type or mimetypes.guess_type(key)[0] or "application/octet-stream"
+        mime_limit = policy.get("mimeLimit")
+        if mime_limit and not any(
+            mime_type == allowed or (allowed.endswith("/*") and mime_type.startswith(allowed[:-1]))
+            for allowed in mime_limit.split(";")
+        ):
+            self._send(403, {"error": "limited mimeType: this file type is forbidden to upload"})
+            return
+        if policy.get("insertOnly") and store.stat(policy["bucket"], key) is not None:
+            self._send(614, {"error": "file exists"})
+            return
+
+        result = store.put(policy["bucket"], key, data, mime_type, metadata)
+        variables = {"key": key, "etag": result["hash"], "fsize": len(data), "mimeType": mime_type, "bucket": policy["bucket"]}
+        if policy.get("callbackUrl") and self.server.secret_key:
+            self._callback(policy, variables)
+        elif policy.get("returnBody"):
+            self._send(200, json.loads(self._render(policy["returnBody"], variables)))
+        else:
+            self._send(200, result)
+
+    @staticmethod
+    def _render(template, variables):
+        for name, value in variables.items():
+            template = template.replace(f"$({name})", str(value))
+        return template
+
+    def _callback(self, policy, variables):
+        """用 QBox 签名回调业务服务器，回调的响应原样返回给客户端"""
+        body = self._render(policy.get("callbackBody", ""), variables)
+        content_type = policy.get("callbackBodyType", "application/x-www-form-urlencoded")
+        url = policy["callbackUrl"]
+        token = Auth(self.server.access_key, self.server.secret_key).token_of_request(url, body, content_type)
+        self.server.store.count("callback")
+        try:
+            response = requests.post(url, data=body.encode("utf-8"), timeout=5, headers={
+                "Content-Type": content_type, "Authorization": f"QBox {token}",
+            })
+        except requests.RequestException as e:
+            self._send(579, {"error": f"callback failed: {str(e)}"})
+            return
+        if response.status_code != 200:
+            self._send(579, {"error": f"callback failed: {response.status_code} {response.text}"})
+            return
+        self._send(200, response.json())
+
+    # ---------------------------------------------------------------- 管理接口
+
+    def _manage(self, segments):
+        if not self.headers.get("Authorization", "").startswith(("QBox ", "Qiniu ")):
+            self._send(401, {"error": "bad token"})
+            return
+        command, (bucket, key) = segments[0], _entry(segments[1])
+        store = self.server.store
+        store.count(command)
+        if command == "stat":
+            info = store.stat(bucket, key)
+            self._send(200 if info else 612, info or {"error": "no such file or directory"})
+        elif command == "chgm":
+            # /chgm/<entry>/mime/<mime>/x-qn-meta-<name>/<value>/...
+            options = dict(zip(segments[2::2], (urlsafe_base64_decode(v).decode("utf-8") for v in segments[3::2])))
+            mime_type = options.pop("mime", None)
+            info = store.change_meta(bucket, key, mime_type, options)
+            self._send(200 if info else 612, {} if info else {"error": "no such file or directory"})
+        else:
+            deleted = store.delete(bucket, key)
+            self._send(200 if deleted else 612, {} if deleted else {"error": "no such file or directory"})
+
+    # ---------------------------------------------------------------- 工具方法
+
+    def _up_token(self):
+        authorization = self.headers.get("Authorization", "")
+        return authorization[len("UpToken "):] if authorization.startswith("UpToken ") else ""
+
+    def _check_token(self, token, key):
+        """校验上传凭证的签名、过期时间和 scope，通过时返回上传策略（bucket 为存储空间名）"""
+        try:
+            access_key, sign, encoded_policy = token.split(":")
+            policy = json.loads(urlsafe_base64_decode(encoded_policy))
+        except ValueError:
+            self._send(401, {"error": "bad token"})
+            return None
+        secret_key = self.server.secret_key
+        if secret_key and Auth(access_key, secret_key).token(encoded_policy) != f"{access_key}:{sign}":
+            self._send(401, {"error": "bad token"})
+            return None
+        if policy.get("deadline", 0) < time.time():
+            self._send(401, {"error": "expired token"})
+            return None
+        bucket, _, scope_key = policy["scope"].partition(":")
+        if scope_key and scope_key != key:
+            self._send(403, {"error": "key doesn't match with scope"})
+            return None
+        policy["bucket"] = bucket
+        return policy
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        # SDK 只把带请求 ID 的 200 响应当作七牛云的成功响应
+        self.send_header("X-Reqid", uuid.uuid4().hex)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class FakeQiniuServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root, access_key=None, secret_key=None):
+        super().__init__(address, FakeQiniuHandler)
+        self.store = ObjectStore(root)
+        # 用于校验上传凭证和签名回调请求；secret_key 为空时不校验凭证签名，也不执行回调
+        self.access_key = access_key
+        self.secret_key = secret_key
+
+
+def serve(host="127.0.0.1", port=9000, root=None, access_key=None, secret_key=None):
+    """启动七牛云替身（阻塞）"""
+    root = os.path.abspath(root or os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_qiniu_data"))
+    os.makedirs(root, exist_ok=True)
+    server = FakeQiniuServer((host, port), root, access_key, secret_key)
+    logger.info(f"七牛云替身已启动: http://{host}:{port}，数据目录 {root}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
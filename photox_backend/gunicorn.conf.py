@@ -0,0 +1,39 @@
+# gunicorn.conf.py
+# 用法: gunicorn -c gunicorn.conf.py image_repo_backend.wsgi:application
+# 设置 PHOTOX_PRELOAD_MODELS（如 resnet50,inception_v3）后，master 进程在 fork 之前加载一次模型权重，
+# 权重以 mmap 方式映射到 PHOTOX_MODEL_CACHE_DIR 下的文件，各个 worker 共享同一份内存页；
+# 每个 worker 启动后先完成推理后端转换并预热，再开始接收请求；配置了 PHOTOX_INFERENCE_SOCKET（推理进程池）时不预加载
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+# 首个请求之前 worker 需要完成模型预热
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# 配置了独立推理进程池的 socket 时由推理进程池持有模型，web worker 不再预加载，避免同一份权重常驻两处
+_inference_pool_configured = (
+    bool(os.getenv("PHOTOX_INFERENCE_SOCKET", "").strip())
+    and os.getenv("PHOTOX_INFERENCE_POOL", "auto").lower() != "off"
+)
+# 预加载模型时应用也在 master 中导入，worker 直接继承已导入的 Django / torch
+preload_app = bool(os.getenv("PHOTOX_PRELOAD_MODELS", "").strip()) and not _inference_pool_configured
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from model_registry import PRELOAD_MODELS, registry
+
+    registry.preload(PRELOAD_MODELS)
+    server.log.info(f"模型已在 fork 之前预加载: {', '.join(PRELOAD_MODELS)}")
+
+
+def post_worker_init(worker):
+    if not preload_app:
+        return
+    from model_registry import PRELOAD_MODELS, registry
+
+    try:
+        registry.warm_up(PRELOAD_MODELS)
+    except Exception as e:
+        # 预热失败不影响 worker 启动，模型会在首次请求时重新加载
+        worker.log.error(f"模型预热失败: {str(e)}")
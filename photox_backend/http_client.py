@@ -0,0 +1,209 @@
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 出站 HTTP 配置（环境变量）
+# 每个上游主机同时进行的请求数上限，以及排队等待的最长时间（秒），超时直接失败，不让慢上游占满所有 worker
+MAX_CONCURRENCY = int(os.getenv("PHOTOX_HTTP_MAX_CONCURRENCY", "16"))
+ACQUIRE_TIMEOUT = float(os.getenv("PHOTOX_HTTP_ACQUIRE_TIMEOUT", "5"))
+# 幂等请求的重试次数和退避时间（秒），实际等待时间在 [0, min(上限, 基数 * 2^n)] 内随机
+RETRIES = int(os.getenv("PHOTOX_HTTP_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("PHOTOX_HTTP_BACKOFF_BASE", "0.2"))
+BACKOFF_MAX = float(os.getenv("PHOTOX_HTTP_BACKOFF_MAX", "5"))
+# 熔断：连续失败次数达到阈值后打开，经过 reset 秒后放行一个试探请求
+BREAKER_THRESHOLD = int(os.getenv("PHOTOX_HTTP_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET = float(os.getenv("PHOTOX_HTTP_BREAKER_RESET", "30"))
+
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# 视为上游故障（可重试、计入熔断）的状态码
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 每个主机保留的延迟样本数（用于计算分位数）
+_LATENCY_SAMPLES = 1000
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """上游主机熔断中，或并发请求已满且排队超时"""
+
+
+class _HostState:
+    """单个上游主机的并发限制、熔断状态和延迟统计"""
+
+    def __init__(self, host):
+        self.host = host
+        self.semaphore = threading.BoundedSemaphore(MAX_CONCURRENCY)
+        self.lock = threading.Lock()
+        # 连续失败次数；熔断打开的时间（None 表示关闭）；半开状态下是否已有试探请求
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.latencies = deque(maxlen=_LATENCY_SAMPLES)
+
+    def admit(self):
+        """熔断关闭时放行；打开且未到重置时间时拒绝；到时间后只放行一个试探请求"""
+        with self.lock:
+            if self.opened_at is not None:
+                if self.probing or time.monotonic() - self.opened_at < BREAKER_RESET:
+                    self.rejected += 1
+                    raise UpstreamUnavailable(f"上游 {self.host} 熔断中")
+                self.probing = True
+            self.in_flight += 1
+
+    def record(self, latency, ok):
+        with self.lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.latencies.append(latency)
+            if ok:
+                if self.opened_at is not None:
+                    logger.info(f"上游 {self.host} 恢复，熔断关闭")
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.errors += 1
+                self.failures += 1
+                if self.probing or (self.opened_at is None and self.failures >= BREAKER_THRESHOLD):
+                    logger.error(f"上游 {self.host} 连续失败 {self.failures} 次，熔断 {BREAKER_RESET} 秒")
+                    self.opened_at = time.monotonic()
+            self.probing = False
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            if self.opened_at is None:
+                circuit = "closed"
+            elif self.probing or time.monotonic() - self.opened_at >= BREAKER_RESET:
+                circuit = "half_open"
+            else:
+                circuit = "open"
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "in_flight": self.in_flight,
+                "circuit": circuit,
+                "latency_ms": _latency_summary(latencies),
+            }
+
+
+def _latency_summary(latencies):
+    if not latencies:
+        return {}
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+    return {
+        "avg": round(sum(latencies) / len(latencies) * 1000, 1),
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "samples": len(latencies),
+    }
+
+
+class HttpClient:
+    """
+    进程内共享的出站 HTTP 客户端：按主机复用 keep-alive 连接池，限制每个主机的并发数，
+    幂等请求在连接失败、超时或 429/5xx 时按随机退避重试，连续失败的主机熔断一段时间
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._session = None
+        self._pid = None
+
+    def _get_session(self):
+        # 连接池不能跨进程共享，fork 之后按进程号重新创建
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=32, pool_maxsize=MAX_CONCURRENCY, max_retries=0)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+                self._pid = os.getpid()
+            return self._session
+
+    def _host_state(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = _HostState(host)
+            return state
+
+    def request(self, method, url, idempotent=None, retries=None, timeout=10, **kwargs):
+        """
+        发送请求，参数与 requests.request 相同
+        :param idempotent: 是否可以安全重试，默认按请求方法判断（POST 默认不重试）
+        :param retries: 重试次数，默认 PHOTOX_HTTP_RETRIES
+        :raises UpstreamUnavailable: 熔断中或排队超时（requests.RequestException 的子类）
+        """
+        state = self._host_state(urlsplit(url).netloc)
+        if idempotent is None:
+            idempotent = method.upper() in _IDEMPOTENT_METHODS
+        attempts = 1 + ((RETRIES if retries is None else retries) if idempotent else 0)
+
+        for attempt in range(attempts):
+            if attempt:
+                with state.lock:
+                    state.retries += 1
+                time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+            if not state.semaphore.acquire(timeout=ACQUIRE_TIMEOUT):
+                with state.lock:
+                    state.rejected += 1
+                raise UpstreamUnavailable(f"上游 {state.host} 并发请求已满（{MAX_CONCURRENCY}），排队超时")
+            try:
+                state.admit()
+                start = time.monotonic()
+                try:
+                    response = self._get_session().request(method, url, timeout=timeout, **kwargs)
+                except requests.RequestException:
+                    state.record(time.monotonic() - start, ok=False)
+                    if attempt == attempts - 1:
+                        raise
+                    continue
+                except BaseException:
+                    # 其他异常（编码错误、KeyboardInterrupt 等）也要计数，否则半开状态的试探标记不会清除
+                    state.record(time.monotonic() - start, ok=False)
+                    raise
+                ok = response.status_code not in _RETRY_STATUSES
+                state.record(time.monotonic() - start, ok)
+                if ok or attempt == attempts - 1:
+                    return response
+                logger.info(f"上游 {state.host} 返回 {response.status_code}，准备重试")
+                # 丢弃的响应归还连接后再重试
+                response.close()
+            finally:
+                state.semaphore.release()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def metrics(self):
+        """各上游主机的请求数、错误数、熔断状态和延迟分位数（毫秒），仅统计当前进程"""
+        with self._lock:
+            hosts = list(self._hosts.values())
+        return {state.host: state.snapshot() for state in hosts}
+
+
+# 进程级单例
+client = HttpClient()
@@ -5,14 +5,23 @@ import numpy as np
 import requests
 from io import BytesIO
 
+from image_context import open_rgb
+from inference_batcher import infer
+from model_registry import DEFAULT_CLASS_FILE, registry, resolve_weights
+
 
 
 class ImageClassifier:
     def __init__(self):
 
-    # 加载模型（使用新版 API）
-     self.model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)  # 或 IMAGENET1K_V2
-     self.model.eval()
+    # 只解析预处理函数，模型在首次推理时才由注册表加载（推理进程池可用时当前进程不加载模型）
+     self.preprocess = resolve_weights("resnet50", "DEFAULT").transforms()  # 或 IMAGENET1K_V2
+     self.categories = registry.get_labels(DEFAULT_CLASS_FILE)
+
+    @property
+    def model(self):
+        """当前进程中的模型（从进程级模型注册表获取，同一进程只加载一次）"""
+        return registry.get("resnet50", "DEFAULT").model
 
 
     def predict(self,image_name):
@@ -27,34 +36,34 @@ class ImageClassifier:
         #     image = Image.open(image_name).convert("RGB")
 
         # 图像预处理（自动匹配权重对应的预处理）
-        preprocess = models.ResNet50_Weights.DEFAULT.transforms()
-        image = Image.open(image_name).convert("RGB")
-        input_tensor = preprocess(image).unsqueeze(0)
-
-        # 推理
-
-        with torch.no_grad():
-             output = self.model(input_tensor)
+        image = open_rgb(image_name, min_side=self.preprocess.resize_size[0])
+        input_tensor = self.preprocess(image).unsqueeze(0)
 
-        # 解析结果
-        probabilities = torch.nn.functional.softmax(output[0], dim=0)
-        top_probs, top_indices = torch.topk(probabilities, 5)
+        # 推理（交给微批推理服务，与并发请求合并成一个批次）
+        top_results = infer("resnet50", "DEFAULT", "cpu", input_tensor, 5)[0]
 
-        # 转换为Python数值
-        top_probs = top_probs.cpu().numpy()
-        top_indices = top_indices.cpu().numpy()
-
-        # 加载正确的类别文件
-        with open("imagenet_classes.txt", "r") as f:
-            categories = [s.strip() for s in f.readlines()]
+        # 类别标签由注册表缓存
+        categories = self.categories
 
         # 验证类别数量
         assert len(categories) == 1000, "类别文件必须包含 1000 个类别"
         # 生成结果列表
         results = [
             (categories[idx], float(prob))
-            for idx, prob in zip(top_indices, top_probs)
+            for idx, prob in top_results
         ]
 
         return results
 
+    def predict_batch(self, image_names, top_k=5):
+        """批量预测，一次前向推理处理多张图片"""
+        input_tensor = torch.stack([
+            self.preprocess(open_rgb(image_name, min_side=self.preprocess.resize_size[0]))
+            for image_name in image_names
+        ])
+        batch_results = infer("resnet50", "DEFAULT", "cpu", input_tensor, top_k)
+        return [
+            [(self.categories[idx], float(prob)) for idx, prob in top_results]
+            for top_results in batch_results
+        ]
+
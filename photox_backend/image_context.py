@@ -0,0 +1,147 @@
+import io
+import threading
+
+from PIL import Image
+
+# 解码时需要保留的最大边长：VLM 分类需要 2048，其余阶段都比它小
+DECODE_MAX_SIDE = 2048
+
+
+class ImageContext:
+    """
+    单张上传图片的共享上下文：像素只解码一次（JPEG 借助 draft 在解码阶段直接缩小），
+    各分析阶段再从解码结果按需生成自己需要的缩小图，结果会被缓存
+    创建时即打开文件读取文件头，解码后文件句柄随之释放；只用于校验格式、不进入分析的上下文
+    （去重命中、异步任务）需要调用 close() 或用 with 语句管理
+    """
+
+    def __init__(self, source, decode_max_side=DECODE_MAX_SIDE, data=None):
+        """
+        :param source: 本地文件路径或二进制文件对象
+        :param data: 图片的原始字节（内存中的上传），供上传到七牛云时直接使用
+        """
+        self.source = source
+        # 原始数据的位置：本地路径或内存字节，二者其一
+        self.path = source if isinstance(source, str) else None
+        self.data = data
+        self.decode_max_side = decode_max_side
+        # 只读取文件头，校验格式并获取原始尺寸
+        self._file = Image.open(source)
+        self.format = self._file.format
+        self.size = self._file.size
+        self._decoded = None
+        self._scaled = {}
+        self._jpeg = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        """关闭尚未解码的图片文件句柄，已解码的像素和缓存的缩小图不受影响"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @classmethod
+    def from_bytes(cls, data, **kwargs):
+        return cls(io.BytesIO(data), data=data, **kwargs)
+
+    @classmethod
+    def from_uploaded_file(cls, uploaded_file, **kwargs):
+        """从 Django 上传文件创建：已落盘的文件直接使用其临时文件路径，内存中的文件直接使用其缓冲区"""
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            return cls(uploaded_file.temporary_file_path(), **kwargs)
+        if isinstance(uploaded_file.file, io.BytesIO):
+            return cls.from_bytes(uploaded_file.file.getvalue(), **kwargs)
+        uploaded_file.seek(0)
+        data = uploaded_file.read()
+        uploaded_file.seek(0)
+        return cls.from_bytes(data, **kwargs)
+
+    @property
+    def image(self):
+        """解码后的 RGB 图片（最长边不小于 decode_max_side 时按 JPEG draft 缩小解码）"""
+        with self._lock:
+            if self._decoded is None:
+                self._decoded = self._decode()
+            return self._decoded
+
+    def _decode(self):
+        if self._file is None:
+            raise ValueError("图片文件已关闭")
+        source = img = self._file
+        width, height = img.size
+        if img.format == 'JPEG' and max(width, height) > self.decode_max_side:
+            ratio = self.decode_max_side / max(width, height)
+            # draft 只会选择不小于请求尺寸的缩放比例（1/2、1/4、1/8）
+            img.draft('RGB', (int(width * ratio), int(height * ratio)))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.load()
+        if source is not img:
+            # convert 返回了新图片，原图片的文件句柄不会自动关闭
+            source.close()
+        self._file = None
+        return img
+
+    def scaled(self, max_side=None, min_side=None):
+        """
+        获取缩小后的 RGB 图片（不会放大）
+        :param max_side: 最长边上限
+        :param min_side: 最短边缩放到该值（用于分类模型的预处理）
+        """
+        key = (max_side, min_side)
+        with self._lock:
+            cached = self._scaled.get(key)
+        if cached is not None:
+            return cached
+
+        img = self.image
+        width, height = img.size
+        ratio = 1.0
+        if max_side:
+            ratio = min(ratio, max_side / max(width, height))
+        if min_side:
+            ratio = min(ratio, min_side / min(width, height))
+        if ratio < 1.0:
+            new_size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+            img = img.resize(new_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+        with self._lock:
+            return self._scaled.setdefault(key, img)
+
+    def jpeg_bytes(self, max_size=2048, quality=85):
+        """保持比例缩小并重新编码为 JPEG（供 VLM 接口使用）"""
+        key = (max_size, quality)
+        with self._lock:
+            cached = self._jpeg.get(key)
+        if cached is not None:
+            return cached
+
+        img = self.image
+        width, height = img.size
+        if max(width, height) > max_size:
+            ratio = max_size / max(width, height)
+            new_size = (int(width * ratio), int(height * ratio))
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+        byte_arr = io.BytesIO()
+        img.save(byte_arr, format='JPEG', quality=quality, optimize=True)
+        data = byte_arr.getvalue()
+        with self._lock:
+            return self._jpeg.setdefault(key, data)
+
+
+def open_rgb(source, min_side=None):
+    """
+    供分类器使用：传入 ImageContext 时复用已解码的像素，传入路径时按原方式打开
+    :param min_side: 分类模型预处理所需的最短边
+    """
+    if isinstance(source, ImageContext):
+        return source.scaled(min_side=min_side)
+    return Image.open(source).convert("RGB")
@@ -231,6 +231,51 @@ QINIU_SECRET_KEY = os.getenv('QINIU_SECRET_KEY', 'uNj2QCpEElzFF4ZkFkvjrBrDITB9Zp
 QINIU_BUCKET_NAME = os.getenv('QINIU_BUCKET_NAME', 'photoxw')
 # QINIU_BUCKET_URL = os.getenv('QINIU_BUCKET_URL', 'http://sv81ux7sp.hn-bkt.clouddn.com')
 
+# 图片分类大模型 (VLM) 的 API Key
+VLM_API_KEY = os.getenv('VLM_API_KEY', 'sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301')
+
+# 异步上传配置
+UPLOAD_STAGING_DIR = os.getenv('UPLOAD_STAGING_DIR', '/tmp/photox_staging')  # 异步任务的图片暂存目录
+UPLOAD_JOB_WORKERS = int(os.getenv('UPLOAD_JOB_WORKERS', '2'))  # 每个进程的后台任务线程数
+UPLOAD_MEMORY_THRESHOLD = int(os.getenv('UPLOAD_MEMORY_THRESHOLD', str(16 * 1024 * 1024)))  # 小于该大小的上传只保存在内存中
+BATCH_UPLOAD_MAX_FILES = int(os.getenv('BATCH_UPLOAD_MAX_FILES', '50'))  # 批量上传单次请求的最大文件数（不能超过 DATA_UPLOAD_MAX_NUMBER_FILES）
+
+# 分块上传：建议的分块大小、单个分块上限、文件大小上限（字节），以及会话过期时间（小时）
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.getenv('CHUNKED_UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_CHUNK = int(os.getenv('CHUNKED_UPLOAD_MAX_CHUNK', str(16 * 1024 * 1024)))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', str(512 * 1024 * 1024)))
+CHUNKED_UPLOAD_EXPIRE_HOURS = int(os.getenv('CHUNKED_UPLOAD_EXPIRE_HOURS', '24'))
+
+# 客户端直传七牛云：上传凭证有效期（秒）、文件大小上限（字节）、上传完成回调地址（留空时由客户端调用 finalize），
+# 以及分析时从七牛云取回的缩略图最长边
+DIRECT_UPLOAD_TOKEN_EXPIRES = int(os.getenv('DIRECT_UPLOAD_TOKEN_EXPIRES', '3600'))
+DIRECT_UPLOAD_MAX_SIZE = int(os.getenv('DIRECT_UPLOAD_MAX_SIZE', str(512 * 1024 * 1024)))
+DIRECT_UPLOAD_CALLBACK_URL = os.getenv('DIRECT_UPLOAD_CALLBACK_URL', '')
+DIRECT_UPLOAD_ANALYSIS_SIDE = int(os.getenv('DIRECT_UPLOAD_ANALYSIS_SIDE', '1600'))
+
+# 图片列表游标分页（pagination=cursor）附带的总数（with_total=true）在非 MySQL 数据库上的缓存时间（秒）
+IMAGE_LIST_TOTAL_CACHE_SECONDS = int(os.getenv('IMAGE_LIST_TOTAL_CACHE_SECONDS', '60'))
+
+# 按颜色找图的进程内索引：整份重建的间隔（秒，期间只增量读取新图片）和最多缓存的用户数
+COLOR_INDEX_REFRESH_SECONDS = int(os.getenv('COLOR_INDEX_REFRESH_SECONDS', '300'))
+COLOR_INDEX_MAX_USERS = int(os.getenv('COLOR_INDEX_MAX_USERS', '256'))
+
+# 上传各阶段并发执行的线程数和超时时间（秒，从阶段提交时开始计算）
+UPLOAD_STAGE_WORKERS = int(os.getenv('UPLOAD_STAGE_WORKERS', '16'))
+UPLOAD_STAGE_TIMEOUTS = {
+    'colors': 10,
+    'classify': 20,  # VLM 接口本身 15 秒超时，计费请求不重试
+    'tags': 30,
+    'upload': 60,
+    'variants': 60,
+    'fetch': 30,  # 直传图片从七牛云取回缩略图
+}
+
+# 衍生图（缩略图）配置：最长边尺寸（逗号分隔）、格式（webp/jpeg）和压缩质量
+IMAGE_VARIANT_SIZES = [int(size) for size in os.getenv('IMAGE_VARIANT_SIZES', '256,768,1600').split(',') if size.strip()]
+IMAGE_VARIANT_FORMAT = os.getenv('IMAGE_VARIANT_FORMAT', 'webp')
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', '80'))
+
 # 如果需要使用 .env 文件，确保在项目根目录创建 .env 文件并写入类似内容:
 # DJANGO_SECRET_KEY=your_strong_secret_key
 # JWT_SECRET_KEY=your_other_strong_secret_key
@@ -0,0 +1,211 @@
+# images/chunked.py
+# 可续传的分块上传：分块按偏移写入预分配的暂存文件并记录已接收区间，
+# 全部到齐后校验整个文件，再交给上传流水线（同步或异步任务）
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from image_context import ImageContext
+from .jobs import submit_staged_job
+from .models import ChunkedUpload
+from .pipeline import analyze_and_upload, find_duplicate, make_object_key, save_image
+
+logger = logging.getLogger(__name__)
+
+# 从请求体读取分块时每次读取的字节数
+_READ_SIZE = 64 * 1024
+# 校验前暂存分块时保留在内存中的上限，超过后落到暂存目录的临时文件
+_SPOOL_SIZE = 1024 * 1024
+
+
+class ChunkError(Exception):
+    """分块上传请求不合法（偏移越界、校验和不匹配、会话状态不对等）"""
+
+
+def merge_range(ranges, start, end):
+    """把 [start, end) 合并进已排序的区间列表"""
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def missing_ranges(ranges, total_size):
+    """尚未接收的区间"""
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < total_size:
+        missing.append([position, total_size])
+    return missing
+
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _staging_dir():
+    directory = os.path.join(settings.UPLOAD_STAGING_DIR, 'chunked')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def purge_expired():
+    """删除长时间没有新分块的上传会话及其暂存文件"""
+    expire_before = timezone.now() - timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRE_HOURS)
+    expired = ChunkedUpload.objects.filter(status=ChunkedUpload.STATUS_UPLOADING, updated_at__lt=expire_before)
+    for upload in expired:
+        _remove_file(upload.file_path)
+        upload.delete()
+        logger.info(f"已清理过期的分块上传: {upload.id}")
+
+
+def create_upload(user, file_name, total_size, title='', is_public=False, checksum=''):
+    """创建上传会话，并按文件大小预分配暂存文件"""
+    purge_expired()
+    upload_id = uuid.uuid4()
+    safe_filename = os.path.basename(file_name).replace(' ', '_')
+    file_path = os.path.join(_staging_dir(), f"{upload_id.hex}_{safe_filename}")
+    with open(file_path, 'wb') as f:
+        f.truncate(total_size)
+    return ChunkedUpload.objects.create(
+        id=upload_id,
+        user=user,
+        file_name=file_name,
+        total_size=total_size,
+        checksum=checksum.lower(),
+        file_path=file_path,
+        title=title,
+        is_public=is_public,
+    )
+
+
+def write_chunk(upload, offset, length, stream, expected_sha256):
+    """
+    从请求体流式读取一个分块，校验通过后写入暂存文件的 offset 处并记录已接收区间
+    先读到临时缓冲区再校验：校验和不匹配的重传不会覆盖已接收的数据，客户端重传该分块即可
+    :return: 更新后的上传会话
+    """
+    if upload.status != ChunkedUpload.STATUS_UPLOADING:
+        raise ChunkError("上传会话已结束，不能继续上传分块")
+    if offset < 0 or length <= 0 or offset + length > upload.total_size:
+        raise ChunkError(f"分块超出文件范围: offset={offset}, length={length}, total_size={upload.total_size}")
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK:
+        raise ChunkError(f"分块过大，单个分块不能超过 {settings.CHUNKED_UPLOAD_MAX_CHUNK} 字节")
+
+    hasher = hashlib.sha256()
+    remaining = length
+    with tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE, dir=_staging_dir()) as buffer:
+        while remaining:
+            data = stream.read(min(_READ_SIZE, remaining))
+            if not data:
+                raise ChunkError("分块数据不完整")
+            hasher.update(data)
+            buffer.write(data)
+            remaining -= len(data)
+        if hasher.hexdigest() != expected_sha256.lower():
+            raise ChunkError("分块校验和不匹配，请重新上传该分块")
+
+        buffer.seek(0)
+        with open(upload.file_path, 'r+b') as f:
+            f.seek(offset)
+            shutil.copyfileobj(buffer, f, _READ_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # 并发上传的多个分块在这里串行合并区间
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().get(id=upload.id)
+        if upload.status != ChunkedUpload.STATUS_UPLOADING:
+            raise ChunkError("上传会话已结束，不能继续上传分块")
+        upload.received = merge_range(upload.received, offset, offset + length)
+        upload.save(update_fields=['received', 'updated_at'])
+    return upload
+
+
+def abort_upload(upload):
+    _remove_file(upload.file_path)
+    upload.delete()
+
+
+def finalize_upload(upload, run_async=False):
+    """
+    所有分块到齐后校验整个文件并进入上传流水线
+    :param run_async: True 时交给后台任务处理，暂存文件的所有权随之转移给任务
+    :return: (image, job)，同步模式返回图片，异步模式返回任务
+    """
+    # 抢占会话，避免重复的 finalize 请求把同一个文件处理两次
+    claimed = ChunkedUpload.objects.filter(id=upload.id, status=ChunkedUpload.STATUS_UPLOADING).update(
+        status=ChunkedUpload.STATUS_PROCESSING, updated_at=timezone.now()
+    )
+    if not claimed:
+        raise ChunkError("上传会话不在上传中状态")
+    upload.refresh_from_db()
+
+    completed = False
+    try:
+        if not upload.is_complete:
+            raise ChunkError("文件尚未上传完整")
+        content_hash = file_sha256(upload.file_path)
+        if upload.checksum and content_hash != upload.checksum:
+            # 已接收的数据有误，需要重新上传整个文件
+            upload.received = []
+            upload.save(update_fields=['received', 'updated_at'])
+            raise ChunkError("文件校验和不匹配，请重新上传")
+        try:
+            image_context = ImageContext(upload.file_path)
+        except Exception:
+            raise ChunkError("请上传一张有效的图片。您所上传的文件不是图片或者是已损坏的图片。")
+
+        key = make_object_key(upload.file_name)
+        if run_async:
+            # 后台任务重新打开暂存文件，这里的上下文只用于校验格式
+            image_context.close()
+            job = submit_staged_job(upload.user, upload.file_path, key, upload.title, upload.is_public, content_hash)
+            upload.status = ChunkedUpload.STATUS_COMPLETED
+            upload.job = job
+            upload.save(update_fields=['status', 'job', 'updated_at'])
+            completed = True
+            return None, job
+
+        analysis = find_duplicate(content_hash)
+        if analysis is None:
+            analysis = analyze_and_upload(image_context, key)
+        else:
+            image_context.close()
+        image = save_image(upload.user, upload.title, upload.is_public, analysis, content_hash=content_hash)
+        upload.status = ChunkedUpload.STATUS_COMPLETED
+        upload.image = image
+        upload.save(update_fields=['status', 'image', 'updated_at'])
+        completed = True
+        _remove_file(upload.file_path)
+        return image, None
+    finally:
+        if not completed:
+            # 处理失败时恢复为上传中，客户端可以补传分块后再次 finalize
+            ChunkedUpload.objects.filter(id=upload.id).update(
+                status=ChunkedUpload.STATUS_UPLOADING, updated_at=timezone.now()
+            )
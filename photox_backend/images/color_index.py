@@ -0,0 +1,226 @@
+# images/color_index.py
+# 按颜色找图：Image.colors 中的主色调转换到 CIE Lab 后放在进程内的 NumPy 索引里，
+# 每个用户和公开图片各一份，首次查询时从数据库加载
+# 更新方式：
+#   - 本进程保存/删除图片时由 signals 即时更新
+#   - 每次查询前读取 id 大于已加载最大 id 的新图片（其他 worker 进程上传的、bulk_create 写入的）
+#   - 超过 COLOR_INDEX_REFRESH_SECONDS 后整份重建，兜底其他进程的删除、公开状态修改和 bulk_update
+# 查询结果还会按可见范围重新过滤，索引短暂过期不会泄露私有图片
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from color import rgb_to_lab
+from .models import Image
+
+logger = logging.getLogger(__name__)
+
+PUBLIC = 'public'
+
+
+def _palette_lab(colors):
+    """把 Image.colors（[[r, g, b], ...]）转为 (k, 3) 的 Lab 数组，格式不对时返回 None"""
+    try:
+        rgb = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+    except (TypeError, ValueError):
+        return None
+    if not len(rgb):
+        return None
+    return rgb_to_lab(np.clip(rgb, 0, 255)).astype(np.float32)
+
+
+class _Scope:
+    """
+    一个可见范围内的调色板索引：所有主色调按图片连续存放在 colors 中，
+    starts[i] 是第 i 张图片第一个颜色的位置，用 np.minimum.reduceat 按图片求最小距离；
+    删除只把 alive 置为 False，死行过多时再压缩
+    """
+
+    def __init__(self, filters):
+        self.filters = filters
+        self._reset()
+
+    def _reset(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.starts = np.empty(0, dtype=np.int64)
+        self.colors = np.empty((0, 3), dtype=np.float32)
+        self.positions = {}
+        # 等待拼接进数组的图片 {id: Lab 数组}
+        self.pending = {}
+        self.max_id = 0
+        self.loaded_at = 0.0
+
+    def load(self):
+        self._reset()
+        self._fetch(Image.objects.filter(**self.filters))
+        self.loaded_at = time.monotonic()
+
+    def fetch_new(self):
+        self._fetch(Image.objects.filter(id__gt=self.max_id, **self.filters))
+
+    def _fetch(self, queryset):
+        for image_id, colors in queryset.order_by('id').values_list('id', 'colors').iterator(chunk_size=5000):
+            self.add(image_id, colors)
+            self.max_id = max(self.max_id, image_id)
+
+    def add(self, image_id, colors):
+        self.remove(image_id)
+        lab = _palette_lab(colors)
+        if lab is not None:
+            self.pending[image_id] = lab
+
+    def remove(self, image_id):
+        position = self.positions.pop(image_id, None)
+        if position is not None:
+            self.alive[position] = False
+        self.pending.pop(image_id, None)
+
+    def _flush(self):
+        """把待加入的图片一次性拼接到数组末尾；死行超过一半时先压缩"""
+        if len(self.ids) - len(self.positions) > len(self.ids) // 2:
+            lengths = np.diff(np.append(self.starts, len(self.colors)))
+            self.colors = self.colors[np.repeat(self.alive, lengths)]
+            lengths = lengths[self.alive]
+            self.ids = self.ids[self.alive]
+            self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64) if len(lengths) else lengths
+            self.alive = np.ones(len(self.ids), dtype=bool)
+            self.positions = {int(image_id): position for position, image_id in enumerate(self.ids)}
+        if not self.pending:
+            return
+
+        new_ids = list(self.pending)
+        new_labs = list(self.pending.values())
+        offsets = np.cumsum([0] + [len(lab) for lab in new_labs[:-1]]) + len(self.colors)
+        for position, image_id in enumerate(new_ids, start=len(self.ids)):
+            self.positions[image_id] = position
+        self.ids = np.concatenate([self.ids, np.asarray(new_ids, dtype=np.int64)])
+        self.alive = np.concatenate([self.alive, np.ones(len(new_ids), dtype=bool)])
+        self.starts = np.concatenate([self.starts, offsets.astype(np.int64)])
+        self.colors = np.concatenate([self.colors] + new_labs)
+        self.pending = {}
+
+    def nearest(self, query_lab, limit, max_distance=None):
+        """
+        对每个查询颜色取图片调色板中最近的颜色，距离（ΔE）取平均，返回最接近的图片
+        :return: [(图片 id, 平均距离), ...]，距离从小到大
+        """
+        self._flush()
+        if not self.positions:
+            return []
+        total = np.zeros(len(self.ids), dtype=np.float32)
+        for color in query_lab:
+            distances = np.sqrt(((self.colors - color) ** 2).sum(axis=1))
+            total += np.minimum.reduceat(distances, self.starts)
+        total /= len(query_lab)
+        total[~self.alive] = np.inf
+        if max_distance is not None:
+            total[total > max_distance] = np.inf
+
+        count = min(limit, int(np.isfinite(total).sum()))
+        if not count:
+            return []
+        top = np.argpartition(total, count - 1)[:count]
+        top = top[np.argsort(total[top], kind='stable')]
+        return [(int(self.ids[i]), float(total[i])) for i in top]
+
+
+class ColorIndex:
+    """
+    进程内的颜色索引：公开图片一份，用户各一份（最近使用的 COLOR_INDEX_MAX_USERS 个）
+    首次加载和定期重建在全局锁之外从数据库读取，完成后再换入；读取期间的增删记录下来，换入时重放
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scopes = OrderedDict()
+        # 每个范围一把加载锁，同一范围只由一个线程读取数据库
+        self._load_locks = {}
+        # 正在加载的范围 → 加载期间的变更 [(图片 id, 颜色或 None), ...]，None 表示移除
+        self._changes = {}
+
+    def _scope(self, key):
+        with self._lock:
+            scope = self._scopes.get(key)
+            if scope is not None:
+                self._scopes.move_to_end(key)
+                if time.monotonic() - scope.loaded_at <= settings.COLOR_INDEX_REFRESH_SECONDS:
+                    # 按 id 读取新行，通常为空，在锁内执行避免与删除信号交错
+                    scope.fetch_new()
+                    return scope
+        return self._load(key)
+
+    def _load(self, key):
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                scope = self._scopes.get(key)
+                if scope is not None and time.monotonic() - scope.loaded_at <= settings.COLOR_INDEX_REFRESH_SECONDS:
+                    # 等待期间其他线程已经加载完成
+                    return scope
+                self._changes[key] = []
+
+            scope = _Scope({'is_public': True} if key == PUBLIC else {'user_id': key})
+            try:
+                scope.load()
+            except Exception:
+                with self._lock:
+                    self._changes.pop(key, None)
+                raise
+
+            with self._lock:
+                for image_id, colors in self._changes.pop(key, []):
+                    if colors is None:
+                        scope.remove(image_id)
+                    else:
+                        scope.add(image_id, colors)
+                self._scopes[key] = scope
+                self._scopes.move_to_end(key)
+                users = [k for k in self._scopes if k != PUBLIC]
+                if len(users) > settings.COLOR_INDEX_MAX_USERS:
+                    del self._scopes[users[0]]
+                    self._load_locks.pop(users[0], None)
+            return scope
+
+    def nearest(self, key, rgb_colors, limit, max_distance=None):
+        """
+        :param key: PUBLIC 或用户 id
+        :param rgb_colors: 查询颜色 [(r, g, b), ...]
+        """
+        query_lab = rgb_to_lab(np.asarray(rgb_colors, dtype=np.float64).reshape(-1, 3)).astype(np.float32)
+        scope = self._scope(key)
+        with self._lock:
+            return scope.nearest(query_lab, limit, max_distance)
+
+    def update(self, image):
+        """图片新增或修改后更新已加载的索引（未加载的范围在首次查询时从数据库读取）"""
+        with self._lock:
+            for key, scope in self._scopes.items():
+                if (key == PUBLIC and image.is_public) or key == image.user_id:
+                    scope.add(image.id, image.colors)
+                else:
+                    scope.remove(image.id)
+            for key, changes in self._changes.items():
+                visible = (key == PUBLIC and image.is_public) or key == image.user_id
+                changes.append((image.id, image.colors if visible else None))
+
+    def remove(self, image_id):
+        with self._lock:
+            for scope in self._scopes.values():
+                scope.remove(image_id)
+            for changes in self._changes.values():
+                changes.append((image_id, None))
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+            self._load_locks.clear()
+
+
+# 进程级单例
+color_index = ColorIndex()
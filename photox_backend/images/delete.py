@@ -2,6 +2,8 @@
 from django.conf import settings
 import qiniu
 
+from save import qiniu_regions
+
 
 def delete_image_from_cloud(image_url):
     # 获取图片的文件名或路径部分
@@ -14,7 +16,7 @@ def delete_image_from_cloud(image_url):
 
     # 创建七牛云认证对象
     q = qiniu.Auth(access_key, secret_key)
-    bucket = qiniu.BucketManager(q)
+    bucket = qiniu.BucketManager(q, regions=qiniu_regions())
 
     # 删除图片
     ret, info = bucket.delete(bucket_name, file_name)
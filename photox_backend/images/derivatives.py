@@ -0,0 +1,63 @@
+# images/derivatives.py
+# 衍生图（缩略图）生成：从已解码的图片按配置的尺寸生成 WebP/JPEG，上传到原图旁边
+import io
+import logging
+import os
+
+from django.conf import settings
+
+from save import public_url, upload_data
+
+logger = logging.getLogger(__name__)
+
+# 输出格式对应的 Pillow 格式名和扩展名
+_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+
+def variant_key(key, size, fmt=None):
+    """衍生图的存储路径：与原图同目录，如 images/123_a.jpg → images/123_a_256w.webp"""
+    _, extension = _FORMATS[fmt or settings.IMAGE_VARIANT_FORMAT]
+    base, _ = os.path.splitext(key)
+    return f"{base}_{size}w.{extension}"
+
+
+def render_variants(image_context, sizes=None, fmt=None, quality=None):
+    """
+    按尺寸生成衍生图，原图不够大的尺寸跳过（前端回退到原图）
+    :return: {尺寸: 编码后的字节}
+    """
+    sizes = sizes or settings.IMAGE_VARIANT_SIZES
+    pil_format, _ = _FORMATS[fmt or settings.IMAGE_VARIANT_FORMAT]
+    quality = quality or settings.IMAGE_VARIANT_QUALITY
+    original_side = max(image_context.size)
+
+    rendered = {}
+    for size in sorted(sizes):
+        if size >= original_side:
+            continue
+        img = image_context.scaled(max_side=size)
+        byte_arr = io.BytesIO()
+        img.save(byte_arr, format=pil_format, quality=quality)
+        rendered[size] = byte_arr.getvalue()
+    return rendered
+
+
+def generate_variants(access_key, secret_key, bucket_name, image_context, key):
+    """
+    生成并上传衍生图，单个尺寸失败只记录日志
+    :return: {"256": url, ...}（JSON 的键为字符串）
+    """
+    variants = {}
+    for size, data in render_variants(image_context).items():
+        size_key = variant_key(key, size)
+        try:
+            if upload_data(access_key, secret_key, bucket_name, data, size_key):
+                variants[str(size)] = public_url(size_key)
+            else:
+                logger.error(f"衍生图上传失败: {size_key}")
+        except Exception as e:
+            logger.error(f"衍生图上传失败: {size_key} - {str(e)}")
+    return variants
@@ -0,0 +1,127 @@
+# images/direct.py
+# 客户端直传七牛云：服务端只签发限定 key 的上传凭证，图片字节不经过 Django；
+# 上传完成后由七牛云回调（配置了 DIRECT_UPLOAD_CALLBACK_URL 时）或客户端调用 finalize，
+# 再从七牛云取回缩略图分析并入库
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from save import QINIU_CLIENT_UP_HOST, client_upload_token, stat_object, verify_callback
+from .jobs import submit_stored_job
+from .models import DirectUpload
+from .pipeline import analyze_stored, make_object_key, save_image
+
+logger = logging.getLogger(__name__)
+
+
+class DirectUploadError(Exception):
+    """直传请求不合法（会话状态不对、对象尚未上传、不是图片、回调签名无效等）"""
+
+
+def _credentials():
+    return settings.QINIU_ACCESS_KEY, settings.QINIU_SECRET_KEY, settings.QINIU_BUCKET_NAME
+
+
+def create_direct_upload(user, file_name, title='', is_public=False):
+    """
+    创建直传会话并签发上传凭证（凭证只在这里返回一次，不保存）
+    :return: (会话, 客户端上传所需的参数)
+    """
+    key = make_object_key(file_name)
+    upload = DirectUpload.objects.create(user=user, file_name=file_name, key=key, title=title, is_public=is_public)
+
+    callback_url = settings.DIRECT_UPLOAD_CALLBACK_URL or None
+    # $(...) 是七牛云的魔法变量，回调时替换为实际值
+    callback_body = (
+        f'{{"upload_id":"{upload.id}","key":"$(key)","etag":"$(etag)",'
+        f'"fsize":$(fsize),"mime_type":"$(mimeType)"}}'
+    )
+    token = client_upload_token(
+        *_credentials(), key, settings.DIRECT_UPLOAD_TOKEN_EXPIRES, settings.DIRECT_UPLOAD_MAX_SIZE,
+        callback_url=callback_url, callback_body=callback_body,
+    )
+    return upload, {
+        'token': token,
+        'key': key,
+        'upload_host': QINIU_CLIENT_UP_HOST,
+        'expires_in': settings.DIRECT_UPLOAD_TOKEN_EXPIRES,
+        'max_size': settings.DIRECT_UPLOAD_MAX_SIZE,
+        'callback': callback_url is not None,
+    }
+
+
+def finalize_direct_upload(upload, run_async=False, stored=None):
+    """
+    图片已直传到七牛云后分析并入库
+    :param run_async: True 时交给后台任务处理
+    :param stored: 回调中携带的对象信息（mimeType 等），为 None 时向七牛云查询
+    :return: (image, job)，同步模式返回图片，异步模式返回任务
+    """
+    # 抢占会话，避免回调和客户端的 finalize 请求把同一张图片处理两次
+    claimed = DirectUpload.objects.filter(id=upload.id, status=DirectUpload.STATUS_PENDING).update(
+        status=DirectUpload.STATUS_PROCESSING, updated_at=timezone.now()
+    )
+    if not claimed:
+        raise DirectUploadError("直传会话不在等待上传状态")
+    upload.refresh_from_db()
+
+    completed = False
+    try:
+        if stored is None:
+            stored = stat_object(*_credentials(), upload.key)
+            if stored is None:
+                raise DirectUploadError("文件尚未上传到七牛云")
+        if not stored.get('mimeType', '').startswith('image/'):
+            raise DirectUploadError("请上传一张有效的图片。您所上传的文件不是图片或者是已损坏的图片。")
+
+        if run_async:
+            job = submit_stored_job(upload.user, upload.key, upload.title, upload.is_public)
+            upload.status = DirectUpload.STATUS_COMPLETED
+            upload.job = job
+            upload.save(update_fields=['status', 'job', 'updated_at'])
+            completed = True
+            return None, job
+
+        analysis = analyze_stored(upload.key)
+        image = save_image(upload.user, upload.title, upload.is_public, analysis)
+        upload.status = DirectUpload.STATUS_COMPLETED
+        upload.image = image
+        upload.save(update_fields=['status', 'image', 'updated_at'])
+        completed = True
+        return image, None
+    finally:
+        if not completed:
+            # 处理失败时恢复为等待上传，客户端可以重新上传或再次 finalize
+            DirectUpload.objects.filter(id=upload.id).update(
+                status=DirectUpload.STATUS_PENDING, updated_at=timezone.now()
+            )
+
+
+def handle_callback(authorization, url, body, content_type, payload):
+    """
+    处理七牛云的上传完成回调：校验签名后提交后台分析任务（七牛云要求回调在数秒内返回）
+    重复的回调直接返回之前的任务
+    :return: 会话
+    """
+    if not authorization or not verify_callback(
+        settings.QINIU_ACCESS_KEY, settings.QINIU_SECRET_KEY, authorization, url, body, content_type
+    ):
+        raise DirectUploadError("回调签名无效")
+    try:
+        upload = DirectUpload.objects.select_related('user').get(id=payload.get('upload_id'), key=payload.get('key'))
+    except (DirectUpload.DoesNotExist, ValidationError, ValueError):
+        raise DirectUploadError("直传会话不存在")
+
+    if upload.status == DirectUpload.STATUS_PENDING:
+        try:
+            finalize_direct_upload(upload, run_async=True, stored={'mimeType': payload.get('mime_type', '')})
+        except DirectUploadError:
+            upload.refresh_from_db()
+            # 客户端的 finalize 请求抢先处理时不算失败
+            if upload.status == DirectUpload.STATUS_PENDING:
+                raise
+        upload.refresh_from_db()
+    logger.info(f"七牛云回调: 直传会话 {upload.id}，任务 {upload.job_id}")
+    return upload
@@ -0,0 +1,205 @@
+# images/jobs.py
+# 异步上传任务：请求线程只负责把图片落盘并登记任务，分析与上传交给后台线程池
+import logging
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ChunkedUpload, UploadJob
+from .pipeline import (
+    STAGES, STORED_STAGES, UploadPipelineError, analyze_and_upload, analyze_stored, find_duplicate, save_image
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """进程内共享的后台线程池（按需创建）"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.UPLOAD_JOB_WORKERS,
+                thread_name_prefix='upload-job'
+            )
+        return _executor
+
+
+def stage_upload(image_file):
+    """
+    将上传的文件写入暂存目录并 fsync，保证返回 202 之前数据已落盘
+    :return: 暂存文件的绝对路径
+    """
+    staging_dir = settings.UPLOAD_STAGING_DIR
+    os.makedirs(staging_dir, exist_ok=True)
+    safe_filename = os.path.basename(image_file.name).replace(' ', '_')
+    path = os.path.join(staging_dir, f"{uuid.uuid4().hex}_{safe_filename}")
+    with open(path, 'wb') as f:
+        for chunk in image_file.chunks():
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return path
+
+
+def submit_upload_job(user, image_file, file_name, title, is_public, content_hash=''):
+    """暂存文件、创建任务记录并提交到后台线程池"""
+    file_path = stage_upload(image_file)
+    logger.info(f"图片已暂存到: {file_path}")
+    return submit_staged_job(user, file_path, file_name, title, is_public, content_hash)
+
+
+def submit_staged_job(user, file_path, file_name, title, is_public, content_hash=''):
+    """为已经落盘的文件创建任务记录并提交到后台线程池，任务结束后删除该文件"""
+    job = UploadJob.objects.create(
+        user=user,
+        file_path=file_path,
+        file_name=file_name,
+        title=title,
+        is_public=is_public,
+        content_hash=content_hash,
+        stages={stage: 'pending' for stage in STAGES}
+    )
+    get_executor().submit(run_upload_job, job.id)
+    logger.info(f"异步上传任务已提交: {job.id}")
+    return job
+
+
+def submit_stored_job(user, key, title, is_public):
+    """为客户端已直传到七牛云的图片创建分析任务（没有暂存文件）"""
+    job = UploadJob.objects.create(
+        user=user,
+        file_path='',
+        file_name=key,
+        title=title,
+        is_public=is_public,
+        stages={stage: 'pending' for stage in STORED_STAGES}
+    )
+    get_executor().submit(run_upload_job, job.id)
+    logger.info(f"直传图片分析任务已提交: {job.id}")
+    return job
+
+
+def run_upload_job(job_id):
+    """后台线程中执行上传任务，逐阶段更新任务状态"""
+    close_old_connections()
+    try:
+        job = UploadJob.objects.select_related('user').get(id=job_id)
+        stages = dict(job.stages)
+
+        def on_stage(stage, state):
+            stages[stage] = state
+            _update_job(job_id, stages=stages)
+
+        _update_job(job_id, status=UploadJob.STATUS_RUNNING)
+        try:
+            # 排队期间可能已有相同内容的图片处理完成，此时直接复用
+            analysis = find_duplicate(job.content_hash)
+            if analysis is None and not job.file_path:
+                analysis = analyze_stored(job.file_name, on_stage=on_stage)
+            elif analysis is None:
+                analysis = analyze_and_upload(job.file_path, job.file_name, on_stage=on_stage)
+            else:
+                stages = {stage: 'skipped' for stage in stages}
+                _update_job(job_id, stages=stages)
+            image = save_image(job.user, job.title, job.is_public, analysis, content_hash=job.content_hash)
+        except UploadPipelineError as e:
+            _fail_job(job_id, str(e))
+            return
+        except Exception as e:
+            logger.error(f"异步上传任务 {job_id} 发生异常: {str(e)}")
+            logger.error(traceback.format_exc())
+            _fail_job(job_id, f"服务器内部错误: {str(e)}")
+            return
+
+        _update_job(job_id, status=UploadJob.STATUS_SUCCEEDED, image=image)
+        logger.info(f"异步上传任务完成: {job_id}，图片ID: {image.id}")
+    finally:
+        _cleanup_staged_file(job_id)
+        close_old_connections()
+
+
+def recover_stale_jobs(older_than, resubmit=True):
+    """
+    找出进程重启或重新部署时丢失的任务：任务只保存在进程内的线程池队列中，
+    状态停留在排队中/处理中且超过 older_than 没有更新的任务不会再有进程执行
+    暂存文件还在的任务重置为排队中，由调用方重新执行；暂存文件已丢失或 resubmit=False 的任务标记为失败
+    :param older_than: timedelta，任务最后一次更新距今超过该时长才视为丢失
+    :return: 需要重新执行的任务 ID 列表
+    """
+    cutoff = timezone.now() - older_than
+    stale = UploadJob.objects.filter(
+        status__in=[UploadJob.STATUS_PENDING, UploadJob.STATUS_RUNNING], updated_at__lt=cutoff
+    )
+    requeued = []
+    for job in stale:
+        # 按读到的状态和更新时间抢占，避免与仍在执行该任务的进程或另一个恢复进程冲突
+        claim = UploadJob.objects.filter(id=job.id, status=job.status, updated_at=job.updated_at)
+        if job.file_path and not os.path.exists(job.file_path):
+            message = "服务重启后任务中断，暂存文件已丢失，请重新上传"
+        elif not resubmit:
+            message = "服务重启后任务中断，请重新上传"
+        else:
+            if claim.update(status=UploadJob.STATUS_PENDING, stages={stage: 'pending' for stage in job.stages},
+                            error=None, updated_at=timezone.now()):
+                requeued.append(job.id)
+                logger.info(f"中断的上传任务已重新排队: {job.id}")
+            continue
+        if claim.update(status=UploadJob.STATUS_FAILED, error=message, updated_at=timezone.now()):
+            logger.error(f"中断的上传任务标记为失败: {job.id} - {message}")
+            _cleanup_staged_file(job.id)
+    return requeued
+
+
+def sweep_staged_files(older_than):
+    """
+    删除暂存目录中没有被未完成的任务或分块上传会话引用、且超过 older_than 未修改的文件
+    （进程在创建任务记录之前退出、或任务结束时没来得及删除的文件）
+    :return: 已删除的文件路径列表
+    """
+    staging_dir = settings.UPLOAD_STAGING_DIR
+    if not os.path.isdir(staging_dir):
+        return []
+    in_use = set(UploadJob.objects.filter(
+        status__in=[UploadJob.STATUS_PENDING, UploadJob.STATUS_RUNNING]
+    ).exclude(file_path='').values_list('file_path', flat=True))
+    in_use.update(ChunkedUpload.objects.filter(
+        status__in=[ChunkedUpload.STATUS_UPLOADING, ChunkedUpload.STATUS_PROCESSING]
+    ).values_list('file_path', flat=True))
+
+    cutoff = (timezone.now() - older_than).timestamp()
+    removed = []
+    for root, _, files in os.walk(staging_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if path in in_use or os.path.getmtime(path) >= cutoff:
+                continue
+            os.remove(path)
+            removed.append(path)
+            logger.info(f"已清理孤立的暂存文件: {path}")
+    return removed
+
+
+def _update_job(job_id, **fields):
+    # update() 不会触发 auto_now，这里手动刷新更新时间
+    UploadJob.objects.filter(id=job_id).update(updated_at=timezone.now(), **fields)
+
+
+def _fail_job(job_id, message):
+    logger.error(f"异步上传任务失败: {job_id} - {message}")
+    _update_job(job_id, status=UploadJob.STATUS_FAILED, error=message)
+
+
+def _cleanup_staged_file(job_id):
+    file_path = UploadJob.objects.filter(id=job_id).values_list('file_path', flat=True).first()
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
@@ -0,0 +1,71 @@
+# images/management/commands/backfill_variants.py
+# 为已有图片补生成衍生图：python manage.py backfill_variants --workers 8
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from image_context import ImageContext
+from images.derivatives import generate_variants
+from images.models import Image
+
+logger = logging.getLogger(__name__)
+
+
+def _backfill_one(image_url):
+    """下载原图、生成并上传衍生图，再更新所有引用该原图的记录（相同内容的图片共享原图）"""
+    try:
+        response = requests.get(image_url, timeout=30)
+        response.raise_for_status()
+        image_context = ImageContext.from_bytes(response.content)
+        key = urlparse(image_url).path.lstrip('/')
+        variants = generate_variants(
+            settings.QINIU_ACCESS_KEY, settings.QINIU_SECRET_KEY, settings.QINIU_BUCKET_NAME,
+            image_context, key
+        )
+        if variants:
+            Image.objects.filter(image_url=image_url).update(variants=variants)
+        return image_url, variants, None
+    except Exception as e:
+        return image_url, None, str(e)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = "为没有衍生图的已有图片生成衍生图（缩略图），多线程并行处理"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="并行处理的线程数")
+        parser.add_argument('--limit', type=int, default=0, help="最多处理的原图数量，0 表示不限制")
+        parser.add_argument('--force', action='store_true', help="重新生成已有衍生图的图片")
+
+    def handle(self, *args, **options):
+        queryset = Image.objects.all()
+        if not options['force']:
+            queryset = queryset.filter(variants={})
+        # 相同内容的图片共享同一个原图，每个原图只处理一次
+        image_urls = queryset.order_by('image_url').values_list('image_url', flat=True).distinct()
+        if options['limit']:
+            image_urls = image_urls[:options['limit']]
+        image_urls = list(image_urls)
+        self.stdout.write(f"待处理原图 {len(image_urls)} 张，线程数 {options['workers']}")
+
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = [executor.submit(_backfill_one, image_url) for image_url in image_urls]
+            for future in as_completed(futures):
+                image_url, variants, error = future.result()
+                if error or not variants:
+                    failed += 1
+                    self.stderr.write(f"处理失败: {image_url} - {error or '原图尺寸过小或上传失败'}")
+                else:
+                    done += 1
+                if (done + failed) % 100 == 0:
+                    self.stdout.write(f"进度: {done + failed}/{len(image_urls)}")
+
+        self.stdout.write(self.style.SUCCESS(f"完成：成功 {done} 张，失败 {failed} 张"))
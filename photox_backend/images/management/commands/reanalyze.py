@@ -0,0 +1,341 @@
+# images/management/commands/reanalyze.py
+# 重新分析已有图片（更换模型或修改分类提示词之后）：
+#   python manage.py reanalyze --stages tags,category --since 2024-01-01 --workers 4
+# 按 id 顺序流式读取图片，分批交给多个工作进程下载并分析，结果用 bulk_update 写回；
+# 进度记录在检查点文件中，中断后再次执行同样的命令会从上次完成的位置继续
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, time as dt_time
+from multiprocessing import get_context
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from ai_classify import image_classification
+from ai_image import ai_image_batch_with_scores
+from color import extract_colors_with_colorthief
+from image_context import ImageContext
+from images.models import Image
+from images.search import index_images
+from images.tags import replace_image_tags
+from model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# 可重新执行的阶段 → 写回的字段
+STAGE_FIELDS = {
+    'colors': 'colors',
+    'tags': 'tags',
+    'category': 'category_id',
+}
+
+
+def _fetch(image_url):
+    response = requests.get(image_url, timeout=30)
+    response.raise_for_status()
+    return response.content
+
+
+def _analyze_one(image_context, stages, api_key):
+    """在工作进程的线程中执行颜色提取和 VLM 分类（VLM 分类是网络请求，线程并发即可）"""
+    result = {}
+    if 'colors' in stages:
+        result['colors'] = extract_colors_with_colorthief(image_context, num_colors=2)
+    if 'category' in stages:
+        classified = image_classification(image_context, api_key)
+        # 分类失败时保留原有类别，不写回
+        if classified:
+            result['category_id'] = classified['category_id']
+    return result
+
+
+def analyze_batch(items, stages, api_key):
+    """
+    工作进程入口：下载一批图片并分析，标签对整批图片做一次批量推理
+    :param items: [(id, image_url), ...]
+    :return: [(id, 结果字典或 None, 错误信息或 None), ...]
+    """
+    # 相同内容的图片共享原图地址，每个地址只下载一次
+    urls = sorted({image_url for _, image_url in items})
+    contexts, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for image_url, outcome in zip(urls, executor.map(_safe_call, [_fetch] * len(urls), urls)):
+            data, error = outcome
+            if error is None:
+                try:
+                    contexts[image_url] = ImageContext.from_bytes(data)
+                except Exception as e:
+                    error = f"无法识别的图片: {str(e)}"
+            if error is not None:
+                errors[image_url] = error
+
+        analyzed = {}
+        futures = {
+            image_url: executor.submit(_analyze_one, context, stages, api_key)
+            for image_url, context in contexts.items()
+        }
+        if 'tags' in stages and contexts:
+            ordered = list(contexts.keys())
+            batch = ai_image_batch_with_scores([contexts[url] for url in ordered])
+            for image_url, (tags, _, scores) in zip(ordered, batch):
+                if scores == [None]:
+                    # 推理失败时返回的是默认标签，不能覆盖原有标签
+                    errors[image_url] = "标签推理失败"
+                    continue
+                analyzed.setdefault(image_url, {}).update(tags=tags, tag_scores=scores)
+        for image_url, future in futures.items():
+            try:
+                analyzed.setdefault(image_url, {}).update(future.result())
+            except Exception as e:
+                errors[image_url] = str(e)
+
+    return [
+        (image_id, None, errors[image_url]) if image_url in errors else (image_id, analyzed[image_url], None)
+        for image_id, image_url in items
+    ]
+
+
+def _safe_call(func, *args):
+    try:
+        return func(*args), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _init_worker(threads):
+    import torch
+
+    # 每个工作进程只用固定数量的线程，避免多个进程的 intra-op 线程抢占 CPU
+    torch.set_num_threads(threads)
+
+
+class Checkpoint:
+    """
+    检查点文件：记录已完成的最大连续 id（各批次乱序完成，只有之前的批次都完成后才前移），
+    以及本次运行的过滤条件，条件不同的检查点不能混用
+    """
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.last_id = 0
+        self.processed = 0
+        self.failed = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('signature') != self.signature:
+            raise CommandError(f"检查点 {self.path} 的过滤条件与本次不同，请使用 --restart 或 --checkpoint 指定其他文件")
+        self.last_id = state['last_id']
+        self.processed = state['processed']
+        self.failed = state['failed']
+        return True
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'signature': self.signature,
+                'last_id': self.last_id,
+                'processed': self.processed,
+                'failed': self.failed,
+                'updated_at': timezone.now().isoformat(),
+            }, f, ensure_ascii=False)
+        # 先写临时文件再改名，进程在写入过程中被杀也不会留下损坏的检查点
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    help = "重新分析已有图片的颜色、标签和类别，多进程并行，支持断点续跑"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', default='colors,tags,category',
+                            help="要重新执行的阶段，逗号分隔：colors、tags、category")
+        parser.add_argument('--user', help="只处理该用户（用户名或 id）的图片")
+        parser.add_argument('--since', help="只处理该日期（含）之后上传的图片，格式 YYYY-MM-DD")
+        parser.add_argument('--until', help="只处理该日期（含）之前上传的图片，格式 YYYY-MM-DD")
+        parser.add_argument('--category', type=int, help="只处理当前类别 id 为该值的图片")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="工作进程数")
+        parser.add_argument('--threads', type=int, default=1, help="每个工作进程的推理线程数")
+        parser.add_argument('--batch-size', type=int, default=32, help="每批图片数量（标签按批推理）")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="从数据库流式读取时每次读取的行数")
+        parser.add_argument('--limit', type=int, default=0, help="本次最多处理的图片数量，0 表示不限制")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'reanalyze.checkpoint.json'),
+                            help="检查点文件路径")
+        parser.add_argument('--restart', action='store_true', help="忽略已有检查点，从头开始")
+
+    def handle(self, *args, **options):
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGE_FIELDS)
+        if not stages or unknown:
+            raise CommandError(f"未知的阶段: {', '.join(sorted(unknown)) or '（空）'}，可选 {', '.join(STAGE_FIELDS)}")
+
+        queryset = self._filtered_queryset(options)
+        signature = {
+            'stages': sorted(stages),
+            'user': options['user'],
+            'since': options['since'],
+            'until': options['until'],
+            'category': options['category'],
+        }
+        checkpoint = Checkpoint(options['checkpoint'], signature)
+        if options['restart']:
+            checkpoint.remove()
+        elif checkpoint.load():
+            self.stdout.write(f"从检查点继续: id > {checkpoint.last_id}，已处理 {checkpoint.processed} 张")
+
+        rows = (
+            queryset.filter(id__gt=checkpoint.last_id)
+            .order_by('id')
+            .values_list('id', 'image_url')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        if 'tags' in stages:
+            # fork 之前加载一次模型权重，各工作进程共享
+            registry.preload(['resnet50'])
+        self._run(rows, stages, checkpoint, options)
+
+    def _filtered_queryset(self, options):
+        queryset = Image.objects.all()
+        if options['user']:
+            User = get_user_model()
+            lookup = {'id': int(options['user'])} if options['user'].isdigit() else {'username': options['user']}
+            try:
+                queryset = queryset.filter(user=User.objects.get(**lookup))
+            except User.DoesNotExist:
+                raise CommandError(f"用户不存在: {options['user']}")
+        if options['since']:
+            queryset = queryset.filter(created_at__gte=self._parse_date(options['since'], dt_time.min))
+        if options['until']:
+            queryset = queryset.filter(created_at__lte=self._parse_date(options['until'], dt_time.max))
+        if options['category'] is not None:
+            queryset = queryset.filter(category_id=options['category'])
+        return queryset
+
+    @staticmethod
+    def _parse_date(value, at):
+        try:
+            day = datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"日期格式应为 YYYY-MM-DD: {value}")
+        moment = datetime.combine(day, at)
+        return timezone.make_aware(moment) if settings.USE_TZ else moment
+
+    def _run(self, rows, stages, checkpoint, options):
+        fields = [STAGE_FIELDS[stage] for stage in stages]
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        limit = options['limit']
+        # 已提交但检查点尚未越过的批次：[最大 id, 是否完成]，按 id 顺序排列
+        pending = deque()
+        in_flight = {}
+        submitted = 0
+        processed = failed = 0
+        start = time.monotonic()
+
+        def _drain():
+            nonlocal processed, failed
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                marker = in_flight.pop(future)
+                ok, bad = self._write_back(future, fields, marker[2])
+                processed += ok
+                failed += bad
+                marker[1] = True
+            # 前面的批次都完成后检查点才前移
+            advanced = False
+            while pending and pending[0][1]:
+                checkpoint.last_id = pending.popleft()[0]
+                advanced = True
+            if advanced:
+                checkpoint.processed += processed
+                checkpoint.failed += failed
+                processed = failed = 0
+                checkpoint.save()
+                elapsed = time.monotonic() - start
+                self.stdout.write(
+                    f"进度: id ≤ {checkpoint.last_id}，累计处理 {checkpoint.processed} 张，失败 {checkpoint.failed} 张"
+                    f"（本次 {submitted} 张，{submitted / elapsed:.1f} 张/秒）"
+                )
+
+        # 数据库连接不能跨进程共享：fork 之前关闭，并在开始读取数据之前启动所有工作进程
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork'),
+                                 initializer=_init_worker, initargs=(max(1, options['threads']),)) as executor:
+            executor.submit(int).result()
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if limit and submitted + len(batch) >= limit:
+                    break
+                if len(batch) < batch_size:
+                    continue
+                submitted += self._submit(executor, batch, stages, pending, in_flight)
+                batch = []
+                # 控制在途批次数量，避免一次性把所有图片读入内存
+                while len(in_flight) >= 2 * workers:
+                    _drain()
+            if batch:
+                submitted += self._submit(executor, batch, stages, pending, in_flight)
+            while in_flight:
+                _drain()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：累计处理 {checkpoint.processed} 张，失败 {checkpoint.failed} 张，检查点 {checkpoint.path}"
+        ))
+
+    @staticmethod
+    def _submit(executor, batch, stages, pending, in_flight):
+        marker = [batch[-1][0], False, len(batch)]
+        pending.append(marker)
+        future = executor.submit(analyze_batch, list(batch), stages, settings.VLM_API_KEY)
+        in_flight[future] = marker
+        return len(batch)
+
+    def _write_back(self, future, fields, batch_len):
+        """把一批分析结果写回数据库，只更新成功得到结果的字段"""
+        try:
+            results = future.result()
+        except Exception as e:
+            logger.error(f"重新分析批次失败: {str(e)}")
+            self.stderr.write(f"批次处理失败（{batch_len} 张）: {str(e)}")
+            return 0, batch_len
+
+        by_fields = {}
+        tag_entries = []
+        failed = 0
+        for image_id, result, error in results:
+            if error:
+                failed += 1
+                self.stderr.write(f"图片 {image_id} 处理失败: {error}")
+                continue
+            update_fields = tuple(field for field in fields if field in result)
+            if update_fields:
+                by_fields.setdefault(update_fields, []).append(Image(id=image_id, **{f: result[f] for f in update_fields}))
+            if 'tags' in update_fields:
+                tag_entries.append((image_id, result['tags'], result.get('tag_scores')))
+        # 字段组合相同的图片一起更新（部分阶段失败的图片只更新成功的字段）
+        for update_fields, images in by_fields.items():
+            Image.objects.bulk_update(images, list(update_fields), batch_size=500)
+        # 规范化标签同步替换；bulk_update 不触发 post_save，标签或类别变化后显式更新搜索索引
+        replace_image_tags(tag_entries)
+        indexed_ids = [image.id for update_fields, images in by_fields.items()
+                       if {'tags', 'category_id'} & set(update_fields) for image in images]
+        if indexed_ids:
+            index_images(Image.objects.filter(id__in=indexed_ids).only('id', 'title', 'tags', 'category_id'))
+        return len(results) - failed, failed
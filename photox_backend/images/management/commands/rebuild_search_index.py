@@ -0,0 +1,23 @@
+# images/management/commands/rebuild_search_index.py
+# 为已有图片建立（或重建）全文检索索引：python manage.py rebuild_search_index --batch-size 1000
+# 按 id 分批写入，已有的索引行原地替换，重建过程中搜索仍可用
+from django.core.management.base import BaseCommand
+
+from images.search import rebuild
+
+
+class Command(BaseCommand):
+    help = "按图片标题、AI 标签和类别重建全文检索索引，并清理已删除图片的索引"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="每批处理的图片数量")
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+
+        def _progress(processed):
+            if processed % (batch_size * 10) == 0:
+                self.stdout.write(f"进度: {processed} 张")
+
+        processed = rebuild(batch_size=batch_size, on_batch=_progress)
+        self.stdout.write(self.style.SUCCESS(f"完成：共索引 {processed} 张图片"))
@@ -0,0 +1,39 @@
+# images/management/commands/recover_upload_jobs.py
+# 恢复重启或重新部署时中断的异步上传任务，并清理孤立的暂存文件（部署后或定时执行）：
+#   python manage.py recover_upload_jobs --older-than 30 --workers 2
+# 异步任务只保存在 web 进程的线程池队列中，进程退出后排队中/处理中的任务不会再被执行
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from images.jobs import recover_stale_jobs, run_upload_job, sweep_staged_files
+from images.models import UploadJob
+
+
+class Command(BaseCommand):
+    help = "重新执行（或标记失败）中断的异步上传任务，并删除不再被引用的暂存文件"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=30,
+                            help="任务超过多少分钟没有更新视为中断；所有 web 进程都已停止时可以设为 0")
+        parser.add_argument('--workers', type=int, default=settings.UPLOAD_JOB_WORKERS, help="重新执行任务的线程数")
+        parser.add_argument('--fail', action='store_true', help="不重新执行，直接把中断的任务标记为失败")
+
+    def handle(self, *args, **options):
+        older_than = timedelta(minutes=max(0, options['older_than']))
+        job_ids = recover_stale_jobs(older_than, resubmit=not options['fail'])
+        self.stdout.write(f"重新执行中断的任务 {len(job_ids)} 个，线程数 {options['workers']}")
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            futures = {executor.submit(run_upload_job, job_id): job_id for job_id in job_ids}
+            for future in as_completed(futures):
+                future.result()
+
+        statuses = dict(UploadJob.objects.filter(id__in=job_ids).values_list('id', 'status'))
+        succeeded = sum(1 for status in statuses.values() if status == UploadJob.STATUS_SUCCEEDED)
+        removed = sweep_staged_files(older_than)
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：成功 {succeeded} 个，失败 {len(job_ids) - succeeded} 个，清理暂存文件 {len(removed)} 个"
+        ))
@@ -0,0 +1,22 @@
+# images/management/commands/runfakeqiniu.py
+# 本地开发/离线测试用的七牛云替身：python manage.py runfakeqiniu --port 9000
+# 再设置 PHOTOX_QINIU_UP_HOST / PHOTOX_QINIU_RS_HOST / PHOTOX_QINIU_PUBLIC_URL 指向该地址
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+import fake_qiniu
+
+
+class Command(BaseCommand):
+    help = "启动本地七牛云替身，支持表单上传、分片上传、上传回调、stat/chgm/delete、文件下载和缩略图"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help="监听地址")
+        parser.add_argument('--port', type=int, default=9000, help="监听端口")
+        parser.add_argument('--root', help="对象保存目录，默认 fake_qiniu_data/")
+        parser.add_argument('--no-verify', action='store_true', help="不校验上传凭证的签名（也不执行上传回调）")
+
+    def handle(self, *args, **options):
+        secret_key = None if options['no_verify'] else settings.QINIU_SECRET_KEY
+        fake_qiniu.serve(host=options['host'], port=options['port'], root=options['root'],
+                         access_key=settings.QINIU_ACCESS_KEY, secret_key=secret_key)
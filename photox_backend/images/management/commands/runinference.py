@@ -0,0 +1,33 @@
+# images/management/commands/runinference.py
+# 独立推理进程池：python manage.py runinference --processes 2 --threads 4
+# web worker 通过 Unix socket 提交预处理后的张量（经由共享内存），模型只在推理进程中加载
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+import inference_pool
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "启动独立的推理进程池，持有模型并使用固定的 CPU 线程数，web worker 可用时自动把推理交给它"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=inference_pool.SOCKET_PATH, help="监听的 Unix socket 路径")
+        parser.add_argument('--processes', type=int, default=inference_pool.PROCESSES, help="推理进程数")
+        parser.add_argument('--threads', type=int, default=inference_pool.THREADS,
+                            help="所有推理进程合计使用的 CPU 线程数")
+        parser.add_argument('--models', default='resnet50', help="启动时加载并预热的模型，逗号分隔")
+
+    def handle(self, *args, **options):
+        model_names = [name.strip() for name in options['models'].split(',') if name.strip()]
+        try:
+            inference_pool.serve(
+                socket_path=options['socket'],
+                processes=options['processes'],
+                threads=options['threads'],
+                model_names=model_names,
+            )
+        except RuntimeError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,19 @@
+# images/management/commands/runinferenceserver.py
+# 远程推理节点：python manage.py runinferenceserver --port 8100 --models resnet50,inception_v3
+# web 节点通过 PHOTOX_INFERENCE_NODES 指向一个或多个推理节点
+from django.core.management.base import BaseCommand
+
+import inference_server
+
+
+class Command(BaseCommand):
+    help = "启动远程推理 HTTP 服务，接收图片字节或预处理后的张量，返回 top-k 标签"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0', help="监听地址")
+        parser.add_argument('--port', type=int, default=8100, help="监听端口")
+        parser.add_argument('--models', default='resnet50', help="启动时加载并预热的模型，逗号分隔")
+
+    def handle(self, *args, **options):
+        model_names = [name.strip() for name in options['models'].split(',') if name.strip()]
+        inference_server.serve(host=options['host'], port=options['port'], model_names=model_names)
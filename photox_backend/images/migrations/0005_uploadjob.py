@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('images', '0004_image_category_id_image_colors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_path', models.CharField(max_length=1024, verbose_name='暂存路径')),
+                ('file_name', models.CharField(max_length=1024, verbose_name='存储路径')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='标题')),
+                ('is_public', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', '排队中'), ('running', '处理中'), ('succeeded', '已完成'), ('failed', '失败')], default='pending', max_length=16, verbose_name='任务状态')),
+                ('stages', models.JSONField(default=dict, verbose_name='阶段状态')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='错误信息')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload_jobs', to='images.image', verbose_name='生成的图片')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_jobs', to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+            ],
+            options={
+                'verbose_name': '上传任务',
+                'verbose_name_plural': '上传任务',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
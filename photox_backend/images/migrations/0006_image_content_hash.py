@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0005_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='内容哈希'),
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='内容哈希'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('images', '0006_image_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255, verbose_name='文件名')),
+                ('total_size', models.BigIntegerField(verbose_name='文件大小')),
+                ('checksum', models.CharField(blank=True, default='', max_length=64, verbose_name='文件校验和')),
+                ('file_path', models.CharField(max_length=1024, verbose_name='暂存路径')),
+                ('received', models.JSONField(default=list, verbose_name='已接收区间')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='标题')),
+                ('is_public', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('processing', '处理中'), ('completed', '已完成')], default='uploading', max_length=16, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chunked_uploads', to='images.image', verbose_name='生成的图片')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='chunked_uploads', to='images.uploadjob', verbose_name='异步任务')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunked_uploads', to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+            ],
+            options={
+                'verbose_name': '分块上传',
+                'verbose_name_plural': '分块上传',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
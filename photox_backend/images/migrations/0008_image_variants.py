@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0007_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, verbose_name='衍生图'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('images', '0008_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255, verbose_name='文件名')),
+                ('key', models.CharField(max_length=1024, verbose_name='存储路径')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='标题')),
+                ('is_public', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', '等待上传'), ('processing', '处理中'), ('completed', '已完成')], default='pending', max_length=16, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='direct_uploads', to='images.image', verbose_name='生成的图片')),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='direct_uploads', to='images.uploadjob', verbose_name='异步任务')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='direct_uploads', to=settings.AUTH_USER_MODEL, verbose_name='所属用户')),
+            ],
+            options={
+                'verbose_name': '直传上传',
+                'verbose_name_plural': '直传上传',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
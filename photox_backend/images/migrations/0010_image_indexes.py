@@ -0,0 +1,29 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0009_directupload'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'created_at'], name='image_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'is_public', 'created_at'], name='image_user_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['is_public', 'created_at'], name='image_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'category_id', 'created_at'], name='image_user_category_idx'),
+        ),
+    ]
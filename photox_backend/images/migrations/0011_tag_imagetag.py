@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-18 11:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0010_image_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='名称')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '标签',
+                'verbose_name_plural': '标签',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImageTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('confidence', models.FloatField(blank=True, null=True, verbose_name='置信度')),
+                ('rank', models.PositiveSmallIntegerField(default=0, verbose_name='顺序')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_links', to='images.image', verbose_name='图片')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_links', to='images.tag', verbose_name='标签')),
+            ],
+            options={
+                'verbose_name': '图片标签',
+                'verbose_name_plural': '图片标签',
+                'ordering': ['rank'],
+            },
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='tag_set',
+            field=models.ManyToManyField(blank=True, related_name='images', through='images.ImageTag', to='images.tag', verbose_name='标签'),
+        ),
+        migrations.AddIndex(
+            model_name='imagetag',
+            index=models.Index(fields=['tag', 'image'], name='imagetag_tag_image_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='imagetag',
+            unique_together={('image', 'tag')},
+        ),
+    ]
@@ -0,0 +1,91 @@
+# 从 Image.tags 的原始文本回填 Tag / ImageTag：按 id 分批读取（不一次性加载全表），
+# 每批单独提交，中断后重新执行会跳过已有关联的图片
+
+import ast
+import json
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+# 迁移写入时 Tag.name 的长度
+TAG_NAME_MAX_LENGTH = 100
+
+
+# 以下为 images.tags 在编写本迁移时的规范化逻辑的固定副本，之后修改 images.tags 不影响本迁移
+
+def normalize_tag(name):
+    name = ' '.join(str(name).split()).lower()
+    return name[:TAG_NAME_MAX_LENGTH] or None
+
+
+def parse_tags(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            parsed = parse(value)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(parsed, (list, tuple)):
+            return list(parsed)
+        if isinstance(parsed, str) and parsed != value:
+            return parse_tags(parsed)
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+
+def build_links(entries, tag_model, link_model, cache):
+    normalized = []
+    for image_id, tags in entries:
+        names = []
+        for tag in parse_tags(tags):
+            name = normalize_tag(tag)
+            if name is not None and name not in names:
+                names.append(name)
+        normalized.append((image_id, names))
+
+    missing = {name for _, names in normalized for name in names if name not in cache}
+    if missing:
+        tag_model.objects.bulk_create([tag_model(name=name) for name in missing], ignore_conflicts=True)
+        cache.update(tag_model.objects.filter(name__in=missing).values_list('name', 'id'))
+    return [
+        link_model(image_id=image_id, tag_id=cache[name], confidence=None, rank=rank)
+        for image_id, names in normalized
+        for rank, name in enumerate(names)
+    ]
+
+
+def backfill_image_tags(apps, schema_editor):
+    Image = apps.get_model('images', 'Image')
+    Tag = apps.get_model('images', 'Tag')
+    ImageTag = apps.get_model('images', 'ImageTag')
+
+    cache = {}
+    last_id = 0
+    while True:
+        rows = list(
+            Image.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'tags')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        done = set(ImageTag.objects.filter(image_id__in=[image_id for image_id, _ in rows])
+                   .values_list('image_id', flat=True).distinct())
+        entries = [(image_id, tags) for image_id, tags in rows if image_id not in done]
+        with transaction.atomic():
+            links = build_links(entries, tag_model=Tag, link_model=ImageTag, cache=cache)
+            ImageTag.objects.bulk_create(links, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+    # 不包在一个大事务里，每批单独提交
+    atomic = False
+
+    dependencies = [
+        ('images', '0011_tag_imagetag'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_image_tags, migrations.RunPython.noop),
+    ]
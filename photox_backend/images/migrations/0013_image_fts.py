@@ -0,0 +1,41 @@
+# 创建全文检索索引表 images_image_fts（见 images/search.py），已有图片需执行
+#   python manage.py rebuild_search_index
+# 写入索引
+
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE images_image_fts USING fts5(content, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+    elif vendor == 'mysql':
+        # ngram 分词支持中文（词长由服务器的 ngram_token_size 决定，默认 2）
+        schema_editor.execute(
+            "CREATE TABLE images_image_fts ("
+            "image_id bigint NOT NULL PRIMARY KEY, "
+            "content longtext NOT NULL, "
+            "FULLTEXT KEY images_image_fts_content (content) WITH PARSER ngram"
+            ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        )
+    else:
+        schema_editor.execute(
+            "CREATE TABLE images_image_fts (image_id bigint NOT NULL PRIMARY KEY, content text NOT NULL)"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    schema_editor.execute("DROP TABLE images_image_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0012_backfill_image_tags'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:07
+# Tag.label 保存标签首次出现时的写法（tags_list 从标签表返回，保留原始大小写）；
+# 已有标签按 id 顺序扫描 Image.tags 的原始文本回填，每批单独提交，没有找到写法的标签返回规范化名称
+
+from importlib import import_module
+
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+TAG_LABEL_MAX_LENGTH = 100
+
+
+def backfill_tag_labels(apps, schema_editor):
+    # 使用 0012 中固定的解析和规范化逻辑，与回填 ImageTag 时一致
+    frozen = import_module('images.migrations.0012_backfill_image_tags')
+
+    Image = apps.get_model('images', 'Image')
+    Tag = apps.get_model('images', 'Tag')
+
+    missing = dict(Tag.objects.filter(label='').values_list('name', 'id'))
+    last_id = 0
+    while missing:
+        rows = list(
+            Image.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'tags')[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        labels = {}
+        for _, tags in rows:
+            for tag in frozen.parse_tags(tags):
+                name = frozen.normalize_tag(tag)
+                if name in missing and name not in labels:
+                    labels[name] = ' '.join(str(tag).split())[:TAG_LABEL_MAX_LENGTH]
+        with transaction.atomic():
+            for name, label in labels.items():
+                Tag.objects.filter(id=missing.pop(name)).update(label=label)
+
+
+class Migration(migrations.Migration):
+    # 不包在一个大事务里，每批单独提交
+    atomic = False
+
+    dependencies = [
+        ('images', '0013_image_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='label',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='显示名称'),
+        ),
+        migrations.RunPython(backfill_tag_labels, migrations.RunPython.noop),
+    ]
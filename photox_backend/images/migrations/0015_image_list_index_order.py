@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 13:20
+# 图片列表的复合索引把 is_public 移到排序字段 (created_at, id) 之后；先建新索引再删除旧索引
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0014_tag_label'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'created_at', 'id', 'is_public'], name='image_user_created_pub_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['created_at', 'id', 'is_public'], name='image_created_public_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='image',
+            name='image_user_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='image',
+            name='image_user_public_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='image',
+            name='image_public_created_idx',
+        ),
+    ]
@@ -7,6 +7,7 @@ from django.db import models
 # from users.models import CustomUser
 # 或者使用 settings.AUTH_USER_MODEL 避免循环导入
 from django.conf import settings
+import uuid
 
 
 class Image(models.Model):
@@ -21,25 +22,196 @@ class Image(models.Model):
     is_public = models.BooleanField(default=False)  # 个人图片默认私有
     colors = models.JSONField(default=list)  # 默认空
     category_id = models.IntegerField(null=True, blank=True, verbose_name="种类ID")
+    # 图片内容的 SHA-256，相同内容的图片（可能属于不同用户）共享同一个七牛云对象
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True, verbose_name="内容哈希")
+    # 衍生图（缩略图）地址，按最长边尺寸索引，如 {"256": url, "768": url}
+    variants = models.JSONField(default=dict, blank=True, verbose_name="衍生图")
+    # 规范化的标签（tags 字段保留原始文本），按标签筛选走 ImageTag 的 (tag, image) 索引
+    tag_set = models.ManyToManyField('Tag', through='ImageTag', related_name='images', blank=True, verbose_name="标签")
 
     def __str__(self):
         return self.title or f"Image {self.id}"
 
     def get_tags_as_list(self):
-        """将标签字符串转换为列表"""
-        if not self.tags:
-            return []
-        if isinstance(self.tags, list):
-            return self.tags
-        try:
-            # 尝试解析JSON
-            import json
-            return json.loads(self.tags)
-        except:
-            # 如果解析失败，按逗号分隔
-            return [tag.strip() for tag in self.tags.split(',')]
+        """
+        标签列表：按顺序读取 tag_links 关联的标签（列表等接口已预取，不再逐行解析 tags 文本），
+        返回标签首次出现时的原始写法；还没有关联的图片（标签写入失败）退回解析原始文本
+        """
+        links = getattr(self, '_prefetched_objects_cache', {}).get('tag_links')
+        if links is None:
+            links = self.tag_links.select_related('tag').order_by('rank') if self.pk else []
+        names = [link.tag.display_name for link in links]
+        if names or not self.tags:
+            return names
+        from .tags import parse_tags
+        return parse_tags(self.tags)
 
     class Meta:
         verbose_name = "图片"
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        # 按图片列表的实际查询建立复合索引：等值筛选条件在前、排序字段 (created_at, id) 在后，
+        # 过滤和排序都能走索引，无需回表排序，游标分页的 (created_at, id) 同样适用；
+        # is_public 放在排序字段之后：SQLite 把 is_public=True 生成为 WHERE "is_public"（不是等值条件），
+        # 放在最前面时用不上索引，放在末尾时按索引顺序扫描并在索引内过滤，MySQL 上同样适用
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id', 'is_public'], name='image_user_created_pub_idx'),
+            models.Index(fields=['created_at', 'id', 'is_public'], name='image_created_public_idx'),
+            models.Index(fields=['user', 'category_id', 'created_at'], name='image_user_category_idx'),
+        ]
+
+
+class Tag(models.Model):
+    """规范化的标签（小写、合并空白），名称唯一；label 保留标签首次出现时的写法，用于接口返回"""
+    name = models.CharField(max_length=100, unique=True, verbose_name="名称")
+    label = models.CharField(max_length=100, blank=True, default='', verbose_name="显示名称")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def display_name(self):
+        return self.label or self.name
+
+    class Meta:
+        verbose_name = "标签"
+        verbose_name_plural = verbose_name
+        ordering = ['name']
+
+
+class ImageTag(models.Model):
+    """图片与标签的关联，记录模型给出的置信度和标签在结果中的顺序"""
+    image = models.ForeignKey(Image, related_name='tag_links', on_delete=models.CASCADE, verbose_name="图片")
+    tag = models.ForeignKey(Tag, related_name='image_links', on_delete=models.CASCADE, verbose_name="标签")
+    # 旧数据回填和默认标签没有置信度
+    confidence = models.FloatField(null=True, blank=True, verbose_name="置信度")
+    rank = models.PositiveSmallIntegerField(default=0, verbose_name="顺序")
+
+    def __str__(self):
+        return f"{self.image_id} - {self.tag_id}"
+
+    class Meta:
+        verbose_name = "图片标签"
+        verbose_name_plural = verbose_name
+        ordering = ['rank']
+        unique_together = ('image', 'tag')
+        # 按标签查图片：(tag, image) 覆盖索引，筛选时不需要回表
+        indexes = [
+            models.Index(fields=['tag', 'image'], name='imagetag_tag_image_idx'),
+        ]
+
+
+class UploadJob(models.Model):
+    """异步上传任务：图片落盘后立即返回，分析与上传在后台执行"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '排队中'),
+        (STATUS_RUNNING, '处理中'),
+        (STATUS_SUCCEEDED, '已完成'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='upload_jobs', on_delete=models.CASCADE, verbose_name="所属用户")
+    # 暂存文件的本地路径（客户端直传的任务为空，图片已在七牛云中）和七牛云中的存储路径
+    file_path = models.CharField(max_length=1024, verbose_name="暂存路径")
+    file_name = models.CharField(max_length=1024, verbose_name="存储路径")
+    title = models.CharField(max_length=255, blank=True, verbose_name="标题")
+    is_public = models.BooleanField(default=False)
+    content_hash = models.CharField(max_length=64, blank=True, default='', verbose_name="内容哈希")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="任务状态")
+    # 各阶段状态，如 {"colors": "done", "classify": "running", ...}
+    stages = models.JSONField(default=dict, verbose_name="阶段状态")
+    image = models.ForeignKey(Image, related_name='upload_jobs', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="生成的图片")
+    error = models.TextField(blank=True, null=True, verbose_name="错误信息")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    def __str__(self):
+        return f"UploadJob {self.id} ({self.status})"
+
+    class Meta:
+        verbose_name = "上传任务"
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+
+class ChunkedUpload(models.Model):
+    """可续传的分块上传会话：分块写入本地暂存文件，全部到齐后再进入分析与上传流程"""
+    STATUS_UPLOADING = 'uploading'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, '上传中'),
+        (STATUS_PROCESSING, '处理中'),
+        (STATUS_COMPLETED, '已完成'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='chunked_uploads', on_delete=models.CASCADE, verbose_name="所属用户")
+    file_name = models.CharField(max_length=255, verbose_name="文件名")
+    total_size = models.BigIntegerField(verbose_name="文件大小")
+    # 客户端提供的整个文件的 SHA-256（可选），合并后校验
+    checksum = models.CharField(max_length=64, blank=True, default='', verbose_name="文件校验和")
+    file_path = models.CharField(max_length=1024, verbose_name="暂存路径")
+    # 已接收的字节区间，按起始位置排序并合并，如 [[0, 4194304], [8388608, 12582912]]（左闭右开）
+    received = models.JSONField(default=list, verbose_name="已接收区间")
+    title = models.CharField(max_length=255, blank=True, verbose_name="标题")
+    is_public = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_UPLOADING, verbose_name="状态")
+    image = models.ForeignKey(Image, related_name='chunked_uploads', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="生成的图片")
+    job = models.ForeignKey(UploadJob, related_name='chunked_uploads', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="异步任务")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    def __str__(self):
+        return f"ChunkedUpload {self.id} ({self.status})"
+
+    @property
+    def received_bytes(self):
+        return sum(end - start for start, end in self.received)
+
+    @property
+    def is_complete(self):
+        return self.received == [[0, self.total_size]]
+
+    class Meta:
+        verbose_name = "分块上传"
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+
+class DirectUpload(models.Model):
+    """客户端直传七牛云的会话：服务端签发只能写入指定 key 的上传凭证，上传完成后（回调或客户端通知）再分析入库"""
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '等待上传'),
+        (STATUS_PROCESSING, '处理中'),
+        (STATUS_COMPLETED, '已完成'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='direct_uploads', on_delete=models.CASCADE, verbose_name="所属用户")
+    file_name = models.CharField(max_length=255, verbose_name="文件名")
+    key = models.CharField(max_length=1024, verbose_name="存储路径")
+    title = models.CharField(max_length=255, blank=True, verbose_name="标题")
+    is_public = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name="状态")
+    image = models.ForeignKey(Image, related_name='direct_uploads', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="生成的图片")
+    job = models.ForeignKey(UploadJob, related_name='direct_uploads', null=True, blank=True, on_delete=models.SET_NULL, verbose_name="异步任务")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="创建时间")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+
+    def __str__(self):
+        return f"DirectUpload {self.id} ({self.status})"
+
+    class Meta:
+        verbose_name = "直传上传"
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
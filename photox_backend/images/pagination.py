@@ -0,0 +1,175 @@
+# images/pagination.py
+# 图片列表的游标分页：按 (created_at, id) 定位，不执行 COUNT，也不使用 OFFSET，
+# 无论翻到多深，每页都只扫描 page_size + 1 行
+import base64
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+logger = logging.getLogger(__name__)
+
+
+def encode_cursor(created_at, pk, reverse=False):
+    """游标对客户端不透明：(created_at, id, 方向) 的 JSON 再做 URL 安全的 Base64"""
+    payload = json.dumps({'c': created_at.isoformat(), 'i': pk, 'r': int(reverse)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value):
+    """:return: (created_at, id, reverse)；游标无效时抛出 ValueError"""
+    try:
+        padded = value + '=' * (-len(value) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(payload['c']), int(payload['i']), bool(payload.get('r'))
+    except (TypeError, KeyError, AttributeError) as e:
+        # 解码和解析失败本身抛出的是 ValueError 的子类，直接向上传递
+        raise ValueError(str(e))
+
+
+def _estimated_rows(plan):
+    """在 MySQL EXPLAIN FORMAT=JSON 的结果中找到优化器估算的结果行数"""
+    if isinstance(plan, dict):
+        if 'rows_produced_per_join' in plan:
+            return int(plan['rows_produced_per_join'])
+        values = plan.values()
+    elif isinstance(plan, list):
+        values = plan
+    else:
+        return None
+    for value in values:
+        rows = _estimated_rows(value)
+        if rows is not None:
+            return rows
+    return None
+
+
+def approximate_count(queryset):
+    """
+    近似总数：MySQL 使用执行计划中的估算行数（不扫描数据），
+    其他数据库使用精确计数，按查询条件缓存 IMAGE_LIST_TOTAL_CACHE_SECONDS 秒
+    """
+    queryset = queryset.order_by()
+    if connection.vendor == 'mysql':
+        try:
+            rows = _estimated_rows(json.loads(queryset.explain(format='json')))
+            if rows is not None:
+                return rows
+        except Exception as e:
+            logger.warning(f"读取执行计划估算行数失败，改用计数: {str(e)}")
+
+    key = 'images:approximate-count:' + hashlib.sha1(str(queryset.query).encode('utf-8')).hexdigest()
+    total = cache.get(key)
+    if total is None:
+        total = queryset.count()
+        cache.set(key, total, settings.IMAGE_LIST_TOTAL_CACHE_SECONDS)
+    return total
+
+
+class KeysetPagination(BasePagination):
+    """
+    游标分页：下一页取 (created_at, id) 小于上一页最后一条的记录（升序时相反），
+    返回不透明的 next / previous 游标；with_total=true 时附带近似总数
+    排序方向取自查询集的 created_at 排序（其他排序字段按 -created_at 处理）
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    total_query_param = 'with_total'
+    invalid_cursor_message = '游标无效'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        self.descending = self._is_descending(queryset)
+
+        self.total = None
+        if str(request.query_params.get(self.total_query_param, '')).lower() in ('1', 'true'):
+            self.total = approximate_count(queryset)
+
+        value = request.query_params.get(self.cursor_query_param)
+        if value:
+            try:
+                created_at, pk, reverse = decode_cursor(value)
+            except ValueError:
+                raise NotFound(self.invalid_cursor_message)
+        else:
+            created_at, pk, reverse = None, None, False
+
+        # 向前翻页时反转排序方向，取到之后再倒回来
+        descending = self.descending != reverse
+        sign = '-' if descending else ''
+        queryset = queryset.order_by(f'{sign}created_at', f'{sign}id')
+        if created_at is not None:
+            if descending:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            else:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+
+        # 多取一条用来判断这个方向上是否还有数据
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = created_at is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = created_at is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    @staticmethod
+    def _is_descending(queryset):
+        for field in queryset.query.order_by:
+            if isinstance(field, str) and field.lstrip('-') == 'created_at':
+                return field.startswith('-')
+        return True
+
+    def _link(self, obj, reverse):
+        if obj is None:
+            return None
+        url = remove_query_param(self.base_url, self.total_query_param)
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(obj.created_at, obj.pk, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        body = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ])
+        if self.total is not None:
+            body['total'] = self.total
+            body['total_is_approximate'] = True
+        return Response(body)
@@ -0,0 +1,481 @@
+# images/pipeline.py
+# 图片上传处理流水线：颜色提取 → AI 分类 → AI 标签 → 七牛云上传（带元数据）→ 衍生图 → 入库与相册归档
+# 同步上传视图和异步上传任务共用这里的逻辑
+import logging
+import math
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from ai_image import ai_image_batch_with_scores, ai_image_with_scores
+from ai_classify import image_classification
+from color import extract_colors_with_colorthief
+from image_context import ImageContext
+from http_client import client as http_client
+from save import object_metadata, public_url, set_metadata, thumbnail_url, upload_data, upload_file
+from .derivatives import generate_variants
+from .models import Image
+from .search import index_images
+from .tags import prefetch_tag_links, replace_image_tags
+
+logger = logging.getLogger(__name__)
+
+# 类别映射表（与 ai_classify 中的提示词一致）
+CATEGORY_MAP = {
+    0: "风景", 1: "人物肖像", 2: "动物", 3: "交通工具", 4: "食品",
+    5: "建筑", 6: "电子产品", 7: "运动器材", 8: "植物花卉", 9: "医疗用品",
+    10: "办公用品", 11: "服装鞋帽", 12: "家具家居", 13: "书籍文档", 14: "艺术创作",
+    15: "工业设备", 16: "体育赛事", 17: "天文地理", 18: "儿童玩具", 19: "美妆个护",
+    20: "军事装备", 21: "宠物用品", 22: "健身器材", 23: "厨房用品", 24: "实验室器材",
+    25: "音乐器材", 26: "户外装备", 27: "珠宝首饰", 28: "虚拟场景", 29: "其他"
+}
+
+# 流水线各阶段名称（异步任务按此顺序上报进度）
+STAGES = ['colors', 'classify', 'tags', 'upload', 'variants']
+# 客户端直传的图片已在七牛云中：先取回缩略图，分析完成后补写元数据
+STORED_STAGES = ['fetch', 'colors', 'classify', 'tags', 'metadata', 'variants']
+
+
+class UploadPipelineError(Exception):
+    """流水线中无法降级处理的错误（配置缺失、七牛云上传失败等）"""
+
+
+def make_object_key(file_name, suffix=None):
+    """
+    生成七牛云中的存储路径：时间戳加原始文件名
+    :param suffix: 附加在时间戳后的区分标识（如批量上传中的序号），避免同一时刻的同名文件冲突
+    """
+    safe_filename = os.path.basename(file_name).replace(' ', '_')
+    timestamp = str(time.time()).replace('.', '')
+    if suffix is not None:
+        timestamp = f"{timestamp}_{suffix}"
+    return f"images/{timestamp}_{safe_filename}"
+
+
+def _noop_report(stage, state):
+    pass
+
+
+_stage_executor = None
+_stage_executor_lock = threading.Lock()
+
+
+def get_stage_executor():
+    """进程内共享的阶段线程池（I/O 阶段在这里并发执行，ResNet 推理再交给微批推理服务）"""
+    global _stage_executor
+    with _stage_executor_lock:
+        if _stage_executor is None:
+            _stage_executor = ThreadPoolExecutor(
+                max_workers=settings.UPLOAD_STAGE_WORKERS,
+                thread_name_prefix='upload-stage'
+            )
+        return _stage_executor
+
+
+def _stage_result(stage, future, deadline, report):
+    """
+    在截止时间内等待阶段结果
+    :return: (成功标志, 结果)；超时或异常时返回 (False, None)
+    """
+    try:
+        result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        logger.error(f"阶段 {stage} 超时")
+        report(stage, 'timeout')
+        return False, None
+    except Exception as e:
+        logger.error(f"阶段 {stage} 执行失败: {str(e)}")
+        logger.error(traceback.format_exc())
+        report(stage, 'failed')
+        return False, None
+    return True, result
+
+
+def _upload_source(access_key, secret_key, bucket_name, image_context, key, metadata=None):
+    """按图片数据所在位置选择上传方式：本地文件或内存数据"""
+    if image_context.path:
+        return upload_file(access_key, secret_key, bucket_name, image_context.path, key, metadata)
+    return upload_data(access_key, secret_key, bucket_name, image_context.data, key, metadata)
+
+
+def _analysis_value(future, deadline):
+    """上传阶段读取分析结果，失败或超时时返回 None（错误由收集结果时上报）"""
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except Exception:
+        return None
+
+
+def _upload_with_metadata(credentials, image_context, key, colors_future, classify_future, deadlines):
+    """
+    等颜色和分类结果出来后上传，元数据随上传请求一起写入七牛云，不再单独调用 chgm；
+    这两个阶段先于本任务提交，线程池按顺序取任务，等待时它们已在执行，不会互相阻塞
+    """
+    colors = _analysis_value(colors_future, deadlines['colors'])
+    result = _analysis_value(classify_future, deadlines['classify'])
+    metadata = object_metadata(result['category_id'] if result else None, colors)
+    return _upload_source(*credentials, image_context, key, metadata)
+
+
+def _qiniu_credentials():
+    access_key = settings.QINIU_ACCESS_KEY
+    secret_key = settings.QINIU_SECRET_KEY
+    bucket_name = settings.QINIU_BUCKET_NAME
+    if not all([access_key, secret_key, bucket_name]):
+        logger.error("七牛云配置不完整")
+        raise UploadPipelineError("七牛云配置不完整，请配置环境变量")
+    logger.info(f"七牛云配置信息 - Access Key: {access_key[:5]}..., Bucket: {bucket_name}")
+    return access_key, secret_key, bucket_name
+
+
+def _submit_stages(executor, credentials, image_context, key, deadlines, tags_future=None):
+    """提交单张图片的各个阶段；批量上传时标签阶段由外部的批量推理提供"""
+    futures = {
+        'colors': executor.submit(extract_colors_with_colorthief, image_context, num_colors=2),
+        'classify': executor.submit(image_classification, image_context, settings.VLM_API_KEY),
+        'tags': tags_future or executor.submit(ai_image_with_scores, image_context),
+    }
+    futures['upload'] = executor.submit(
+        _upload_with_metadata, credentials, image_context, key, futures['colors'], futures['classify'], deadlines
+    )
+    futures['variants'] = executor.submit(generate_variants, *credentials, image_context, key)
+    return futures
+
+
+def _collect_analysis(futures, deadlines, report):
+    """等待颜色、分类和标签阶段的结果，失败的阶段使用默认值"""
+    ok, colors = _stage_result('colors', futures['colors'], deadlines['colors'], report)
+    if ok:
+        report('colors', 'done')
+    else:
+        colors = []
+
+    ok, result = _stage_result('classify', futures['classify'], deadlines['classify'], report)
+    category_id = result['category_id'] if result else None
+    if ok:
+        report('classify', 'done' if result else 'failed')
+
+    # AI分析失败时使用默认值
+    ok, tags_result = _stage_result('tags', futures['tags'], deadlines['tags'], report)
+    if ok:
+        tags, category, tag_scores = tags_result
+        logger.info(f"AI分析结果 - 标签: {tags}, 分类: {category}")
+        report('tags', 'done')
+    else:
+        tags, tag_scores = ["未分类"], None
+        logger.info("使用默认标签和分类")
+    return colors, category_id, tags, tag_scores
+
+
+def _collect_variants(futures, deadlines, report):
+    # 衍生图失败不影响上传，前端回退到原图
+    ok, variants = _stage_result('variants', futures['variants'], deadlines['variants'], report)
+    if ok:
+        report('variants', 'done')
+        return variants
+    return {}
+
+
+def _collect_stages(futures, key, deadlines, report):
+    """等待各阶段结果，失败的分析阶段使用默认值，七牛云上传失败时抛出 UploadPipelineError"""
+    colors, category_id, tags, tag_scores = _collect_analysis(futures, deadlines, report)
+
+    # 等待七牛云上传完成（元数据已随上传写入）
+    ok, uploaded = _stage_result('upload', futures['upload'], deadlines['upload'], report)
+    if not ok:
+        raise UploadPipelineError("上传到七牛云失败")
+
+    if not uploaded:
+        logger.error("图片URL为空")
+        report('upload', 'failed')
+        raise UploadPipelineError("上传到七牛云失败，未获取到图片URL")
+    image_url = public_url(key)
+    logger.info(f"上传结果 - URL: {image_url}")
+    report('upload', 'done')
+
+    return {
+        'image_url': image_url,
+        'tags': tags,
+        'tag_scores': tag_scores,
+        'category_id': category_id,
+        'colors': colors,
+        'variants': _collect_variants(futures, deadlines, report),
+    }
+
+
+def _deadlines(start, scale=1):
+    return {stage: start + timeout * scale for stage, timeout in settings.UPLOAD_STAGE_TIMEOUTS.items()}
+
+
+def analyze_and_upload(source, key, on_stage=None):
+    """
+    对上传的图片执行分析并上传到七牛云
+    颜色提取、VLM 分类、ResNet 标签和衍生图并发执行；原图在颜色和分类完成后上传，
+    类别、颜色元数据随上传请求一起写入，一次请求完成
+    :param source: ImageContext（各分析阶段共享同一份解码结果），或本地暂存文件路径
+    :param key: 七牛云中的存储路径
+    :param on_stage: 进度回调 on_stage(stage, state)，state 为 running/done/failed/timeout
+    :return: 包含 image_url、tags、category_id、colors 的字典
+    """
+    report = on_stage or _noop_report
+    credentials = _qiniu_credentials()
+
+    if isinstance(source, ImageContext):
+        image_context = source
+    else:
+        try:
+            image_context = ImageContext(source)
+        except Exception as e:
+            raise UploadPipelineError(f"无法识别的图片文件: {str(e)}")
+
+    deadlines = _deadlines(time.monotonic())
+    futures = _submit_stages(get_stage_executor(), credentials, image_context, key, deadlines)
+    for stage in STAGES:
+        report(stage, 'running')
+    return _collect_stages(futures, key, deadlines, report)
+
+
+def fetch_stored(key):
+    """从七牛云取回已上传图片的缩略图（最长边 DIRECT_UPLOAD_ANALYSIS_SIDE），分析不需要原图分辨率"""
+    response = http_client.get(thumbnail_url(key, settings.DIRECT_UPLOAD_ANALYSIS_SIDE),
+                               timeout=settings.UPLOAD_STAGE_TIMEOUTS['fetch'])
+    response.raise_for_status()
+    return ImageContext.from_bytes(response.content)
+
+
+def analyze_stored(key, on_stage=None):
+    """
+    分析客户端已直传到七牛云的图片：取回缩略图后并发执行颜色提取、VLM 分类、ResNet 标签和衍生图，
+    原图已在七牛云中，类别、颜色元数据用 chgm 补写（失败只记录日志）
+    :param key: 七牛云中的存储路径
+    :param on_stage: 进度回调，阶段见 STORED_STAGES
+    :return: 与 analyze_and_upload 相同的分析结果字典
+    """
+    report = on_stage or _noop_report
+    credentials = _qiniu_credentials()
+
+    report('fetch', 'running')
+    try:
+        image_context = fetch_stored(key)
+    except Exception as e:
+        logger.error(f"从七牛云取回图片失败: {key} - {str(e)}")
+        report('fetch', 'failed')
+        raise UploadPipelineError(f"无法从七牛云取回图片: {str(e)}")
+    report('fetch', 'done')
+
+    executor = get_stage_executor()
+    deadlines = _deadlines(time.monotonic())
+    futures = {
+        'colors': executor.submit(extract_colors_with_colorthief, image_context, num_colors=2),
+        'classify': executor.submit(image_classification, image_context, settings.VLM_API_KEY),
+        'tags': executor.submit(ai_image_with_scores, image_context),
+        'variants': executor.submit(generate_variants, *credentials, image_context, key),
+    }
+    for stage in futures:
+        report(stage, 'running')
+    colors, category_id, tags, tag_scores = _collect_analysis(futures, deadlines, report)
+
+    report('metadata', 'running')
+    try:
+        written = set_metadata(*credentials, key, category_id, colors)
+    except Exception as e:
+        logger.error(f"设置七牛云元数据时发生异常: {key} - {str(e)}")
+        written = False
+    report('metadata', 'done' if written else 'failed')
+
+    return {
+        'image_url': public_url(key),
+        'tags': tags,
+        'tag_scores': tag_scores,
+        'category_id': category_id,
+        'colors': colors,
+        'variants': _collect_variants(futures, deadlines, report),
+    }
+
+
+def _split_future(batch_future, count):
+    """把返回列表的批量 Future 拆成逐项的 Future"""
+    futures = [Future() for _ in range(count)]
+
+    def _done(future):
+        try:
+            results = future.result()
+        except Exception as e:
+            for item in futures:
+                item.set_exception(e)
+            return
+        for item, result in zip(futures, results):
+            item.set_result(result)
+
+    batch_future.add_done_callback(_done)
+    return futures
+
+
+def analyze_and_upload_batch(items):
+    """
+    批量分析并上传多张图片：ResNet 标签对整批图片做一次批量推理，
+    其余阶段与单张上传相同，按图片并发执行
+    :param items: [(ImageContext, key), ...]
+    :return: 与输入一一对应的列表，元素为分析结果字典或 UploadPipelineError
+    """
+    credentials = _qiniu_credentials()
+    executor = get_stage_executor()
+    # 每张图片占用线程池中的四个任务，超时时间按排队的轮数放宽
+    scale = max(1, math.ceil(4 * len(items) / settings.UPLOAD_STAGE_WORKERS))
+    deadlines = _deadlines(time.monotonic(), scale)
+    batch_tags = executor.submit(ai_image_batch_with_scores, [image_context for image_context, _ in items])
+    tags_futures = _split_future(batch_tags, len(items))
+    submitted = [
+        _submit_stages(executor, credentials, image_context, key, deadlines, tags_future)
+        for (image_context, key), tags_future in zip(items, tags_futures)
+    ]
+
+    results = []
+    for (_, key), futures in zip(items, submitted):
+        try:
+            results.append(_collect_stages(futures, key, deadlines, _noop_report))
+        except UploadPipelineError as e:
+            results.append(e)
+    return results
+
+
+def _analysis_from_image(image):
+    links = list(image.tag_links.all())
+    return {
+        'image_url': image.image_url,
+        'tags': image.tags,
+        'tag_scores': [link.confidence for link in links] if links else None,
+        'category_id': image.category_id,
+        'colors': image.colors,
+        'variants': image.variants,
+    }
+
+
+def find_duplicate(content_hash):
+    """
+    按内容哈希查找已上传过的相同图片（不区分用户）
+    :return: 可直接复用的分析结果（七牛云地址、标签、类别、颜色），没有时返回 None
+    """
+    if not content_hash:
+        return None
+    existing = Image.objects.filter(content_hash=content_hash).prefetch_related(prefetch_tag_links()).order_by('id').first()
+    if existing is None:
+        return None
+    logger.info(f"发现相同内容的图片 {existing.id}，复用其七牛云对象和分析结果")
+    return _analysis_from_image(existing)
+
+
+def find_duplicates(content_hashes):
+    """批量版本的 find_duplicate，一次查询返回 {内容哈希: 分析结果}"""
+    content_hashes = [content_hash for content_hash in set(content_hashes) if content_hash]
+    duplicates = {}
+    for image in Image.objects.filter(content_hash__in=content_hashes).prefetch_related(prefetch_tag_links()).order_by('-id'):
+        # 按 id 倒序遍历，相同哈希最终保留最早的一条
+        duplicates[image.content_hash] = _analysis_from_image(image)
+    return duplicates
+
+
+def add_to_category_album(user, image, category_id):
+    """自动创建对应类别的相册并添加图片，失败只记录日志（图片上传本身是成功的）"""
+    try:
+        category_name = CATEGORY_MAP.get(category_id, "其他")
+
+        # 查找或创建对应类别的相册
+        from albums.models import Album
+        album, created = Album.objects.get_or_create(
+            title=f"{category_name}相册",
+            user=user,
+            defaults={
+                'description': f'自动创建的{category_name}分类相册',
+                'is_public': False
+            }
+        )
+
+        album.images.add(image)
+        logger.info(f"图片已添加到{category_name}相册")
+    except Exception as e:
+        logger.error(f"自动添加到相册失败: {str(e)}")
+        logger.error(traceback.format_exc())
+
+
+def save_image(user, title, is_public, analysis, content_hash=''):
+    """将分析结果保存到数据库并归档到类别相册"""
+    logger.info("将图片信息保存到数据库...")
+    image = Image.objects.create(
+        image_url=analysis['image_url'],
+        title=title,
+        tags=analysis['tags'],
+        user=user,
+        is_public=is_public,
+        category_id=analysis['category_id'],
+        colors=analysis['colors'],
+        variants=analysis.get('variants', {}),
+        content_hash=content_hash
+    )
+    logger.info(f"数据库保存成功，图片ID: {image.id}")
+    replace_image_tags([(image.id, analysis['tags'], analysis.get('tag_scores'))])
+
+    add_to_category_album(user, image, analysis['category_id'])
+    return image
+
+
+def save_images_bulk(user, entries):
+    """
+    在一个事务中批量保存图片并归档到类别相册
+    :param entries: [(title, is_public, analysis, content_hash), ...]
+    :return: 保存后的 Image 列表
+    """
+    from albums.models import Album
+
+    images = [
+        Image(
+            image_url=analysis['image_url'],
+            title=title,
+            tags=analysis['tags'],
+            user=user,
+            is_public=is_public,
+            category_id=analysis['category_id'],
+            colors=analysis['colors'],
+            variants=analysis.get('variants', {}),
+            content_hash=content_hash,
+        )
+        for title, is_public, analysis, content_hash in entries
+    ]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Image.objects.bulk_create(images)
+            # bulk_create 不触发 post_save，显式写入搜索索引
+            index_images(images)
+        else:
+            # MySQL 的批量插入拿不到自增主键，相册关联需要主键，只能逐条插入（仍在同一事务中）
+            for image in images:
+                image.save()
+        replace_image_tags([
+            (image.id, analysis['tags'], analysis.get('tag_scores'))
+            for image, (_, _, analysis, _) in zip(images, entries)
+        ])
+
+        # 每个类别只查找或创建一次相册，再批量写入相册与图片的关联
+        albums = {}
+        for category_id in {image.category_id for image in images}:
+            category_name = CATEGORY_MAP.get(category_id, "其他")
+            albums[category_id], _ = Album.objects.get_or_create(
+                title=f"{category_name}相册",
+                user=user,
+                defaults={
+                    'description': f'自动创建的{category_name}分类相册',
+                    'is_public': False
+                }
+            )
+        Album.images.through.objects.bulk_create([
+            Album.images.through(album_id=albums[image.category_id].id, image_id=image.id)
+            for image in images
+        ], ignore_conflicts=True)
+    logger.info(f"批量保存 {len(images)} 张图片")
+    return images
@@ -0,0 +1,158 @@
+# images/search.py
+# 图片全文检索：标题、AI 标签和类别名称写入一张倒排索引表 images_image_fts（由迁移 0013 创建）
+#   SQLite: FTS5 虚拟表，rowid 即图片 id，按 bm25 排序；unicode61 分词器把连续的汉字当作一个词，
+#           因此写入和查询时都在汉字之间加空格，按单字建索引，查询词作为短语匹配
+#   MySQL:  InnoDB FULLTEXT 索引（ngram 分词，支持中文），按 MATCH ... AGAINST 的相关度排序
+#   其他数据库: 普通表，退化为 LIKE 匹配，不排序
+# 图片保存和删除时由 signals 增量更新；bulk_create / bulk_update 不触发信号，调用方需显式调用 index_images
+import logging
+import re
+
+from django.db import connection
+
+from .models import Image
+from .tags import normalized_tags
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'images_image_fts'
+
+# 查询最多使用的词数
+MAX_QUERY_TERMS = 10
+
+_CJK = re.compile(r'([\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff])')
+
+
+def _id_column():
+    # FTS5 虚拟表直接用 rowid 保存图片 id
+    return 'rowid' if connection.vendor == 'sqlite' else 'image_id'
+
+
+def _space_cjk(text):
+    return ' '.join(_CJK.sub(r' \1 ', text).split())
+
+
+def build_document(title, tags, category_id):
+    """索引内容：标题、规范化后的标签和类别名称，以换行分隔"""
+    # 流水线模块依赖模型推理代码，这里只需要类别表，用到时再导入
+    from .pipeline import CATEGORY_MAP
+
+    parts = [title or '']
+    parts.extend(normalized_tags(tags))
+    if category_id in CATEGORY_MAP:
+        parts.append(CATEGORY_MAP[category_id])
+    content = '\n'.join(part for part in parts if part)
+    return _space_cjk(content) if connection.vendor == 'sqlite' else content
+
+
+def _write(rows):
+    """写入或替换索引行：rows 为 [(图片 id, 内容), ...]"""
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (image_id, content) VALUES (%s, %s) "
+                f"ON DUPLICATE KEY UPDATE content = VALUES(content)",
+                rows,
+            )
+            return
+        ids = [image_id for image_id, _ in rows]
+        cursor.execute(f"DELETE FROM {TABLE} WHERE {_id_column()} IN ({', '.join(['%s'] * len(ids))})", ids)
+        cursor.executemany(f"INSERT INTO {TABLE} ({_id_column()}, content) VALUES (%s, %s)", rows)
+
+
+def index_images(images):
+    """
+    更新图片的索引内容，失败只记录日志（不影响图片本身的保存）
+    :param images: Image 对象列表
+    """
+    try:
+        _write([(image.id, build_document(image.title, image.tags, image.category_id)) for image in images])
+    except Exception as e:
+        logger.error(f"更新搜索索引失败: {str(e)}")
+
+
+def remove_images(image_ids):
+    if not image_ids:
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {TABLE} WHERE {_id_column()} IN ({', '.join(['%s'] * len(image_ids))})", list(image_ids)
+            )
+    except Exception as e:
+        logger.error(f"删除搜索索引失败: {str(e)}")
+
+
+def rebuild(batch_size=1000, on_batch=None):
+    """
+    按 id 分批重建全部图片的索引，再清理已删除图片残留的索引行
+    :param on_batch: 每批完成后的回调 on_batch(已处理数量)
+    :return: 处理的图片数量
+    """
+    processed = 0
+    last_id = 0
+    while True:
+        rows = list(
+            Image.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'title', 'tags', 'category_id')[:batch_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        _write([(image_id, build_document(title, tags, category_id)) for image_id, title, tags, category_id in rows])
+        processed += len(rows)
+        if on_batch:
+            on_batch(processed)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE {_id_column()} NOT IN (SELECT id FROM {Image._meta.db_table})"
+        )
+    return processed
+
+
+def _terms(query):
+    return query.split()[:MAX_QUERY_TERMS]
+
+
+def search(query, scope, limit, offset=0):
+    """
+    全文检索，返回按相关度排序的 [(图片 id, 分数), ...]，分数越大越相关
+    :param scope: 可见范围 (SQL 条件, 参数)，条件中用 img 指代图片表
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    where, params = scope
+    image_table = Image._meta.db_table
+
+    if connection.vendor == 'sqlite':
+        # 每个词作为一个短语（汉字已按单字分开），词之间是 OR，同时命中多个词的排在前面
+        match = ' OR '.join('"{}"'.format(_space_cjk(term).replace('"', '""')) for term in terms)
+        sql = (
+            f"SELECT img.id, -bm25({TABLE}) FROM {TABLE} JOIN {image_table} img ON img.id = {TABLE}.rowid "
+            f"WHERE {TABLE} MATCH %s AND {where} ORDER BY bm25({TABLE}), img.id DESC LIMIT %s OFFSET %s"
+        )
+        params = [match, *params, limit, offset]
+    elif connection.vendor == 'mysql':
+        sql = (
+            f"SELECT img.id, MATCH(f.content) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score "
+            f"FROM {TABLE} f JOIN {image_table} img ON img.id = f.image_id "
+            f"WHERE MATCH(f.content) AGAINST (%s IN NATURAL LANGUAGE MODE) AND {where} "
+            f"ORDER BY score DESC, img.id DESC LIMIT %s OFFSET %s"
+        )
+        text = ' '.join(terms)
+        params = [text, text, *params, limit, offset]
+    else:
+        likes = ' OR '.join(['f.content LIKE %s'] * len(terms))
+        sql = (
+            f"SELECT img.id, 0 FROM {TABLE} f JOIN {image_table} img ON img.id = f.image_id "
+            f"WHERE ({likes}) AND {where} ORDER BY img.id DESC LIMIT %s OFFSET %s"
+        )
+        params = [*[f'%{term}%' for term in terms], *params, limit, offset]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(image_id, float(score)) for image_id, score in cursor.fetchall()]
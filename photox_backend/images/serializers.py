@@ -1,5 +1,8 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Image
+from .chunked import missing_ranges
+from .models import ChunkedUpload, DirectUpload, Image, UploadJob
+from image_context import ImageContext
 import json
 
 class ImageSerializer(serializers.ModelSerializer):
@@ -9,7 +12,8 @@ class ImageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Image
-        fields = ['id', 'image_url', 'title', 'tags', 'tags_list', 'user', 'created_at', 'is_public', 'category_id', 'category', 'colors']
+        # content_hash 不对外返回：去重不区分用户，暴露哈希可以探测其他用户是否上传过某个文件
+        fields = ['id', 'image_url', 'title', 'tags', 'tags_list', 'user', 'created_at', 'is_public', 'category_id', 'category', 'colors', 'variants']
     
     def get_tags_list(self, obj):
         """获取标签列表"""
@@ -37,6 +41,96 @@ class ImageSerializer(serializers.ModelSerializer):
 
 class ImageUploadSerializer(serializers.Serializer):
     """处理图片上传请求"""
-    image = serializers.ImageField()
+    # 不使用 ImageField，避免校验时额外打开一次图片；由 ImageContext 读取文件头校验格式，
+    # 解码后的像素在后续所有分析阶段共享
+    image = serializers.FileField()
     title = serializers.CharField(required=False, max_length=255)
     is_public = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, attrs):
+        try:
+            attrs['image_context'] = ImageContext.from_uploaded_file(attrs['image'])
+        except Exception:
+            raise serializers.ValidationError({
+                'image': ['请上传一张有效的图片。您所上传的文件不是图片或者是已损坏的图片。']
+            })
+        return attrs
+
+
+class ImageBatchUploadSerializer(serializers.Serializer):
+    """处理批量图片上传请求（单个文件无法识别时在视图中逐个返回错误，不影响其他文件）"""
+    images = serializers.ListField(
+        child=serializers.FileField(), allow_empty=False, max_length=settings.BATCH_UPLOAD_MAX_FILES
+    )
+    title = serializers.CharField(required=False, max_length=255)
+    is_public = serializers.BooleanField(required=False, default=False)
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    """序列化异步上传任务"""
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadJob
+        fields = ['id', 'status', 'stages', 'image', 'error', 'created_at', 'updated_at']
+
+    def get_image(self, obj):
+        """任务完成后返回生成的图片数据"""
+        if obj.image is None:
+            return None
+        return ImageSerializer(obj.image).data
+
+
+class ChunkedUploadCreateSerializer(serializers.Serializer):
+    """创建分块上传会话"""
+    file_name = serializers.CharField(max_length=255)
+    total_size = serializers.IntegerField(min_value=1, max_value=settings.CHUNKED_UPLOAD_MAX_SIZE)
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, default='')
+    title = serializers.CharField(required=False, max_length=255, default='')
+    is_public = serializers.BooleanField(required=False, default=False)
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    """序列化分块上传会话（含已接收和缺失的区间）"""
+    received_bytes = serializers.IntegerField(read_only=True)
+    missing = serializers.SerializerMethodField()
+    chunk_size = serializers.SerializerMethodField()
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'file_name', 'total_size', 'chunk_size', 'received', 'received_bytes', 'missing',
+                  'status', 'image', 'job', 'created_at', 'updated_at']
+
+    def get_missing(self, obj):
+        return missing_ranges(obj.received, obj.total_size)
+
+    def get_chunk_size(self, obj):
+        """建议的分块大小"""
+        return settings.CHUNKED_UPLOAD_CHUNK_SIZE
+
+    def get_image(self, obj):
+        if obj.image is None:
+            return None
+        return ImageSerializer(obj.image).data
+
+
+class DirectUploadCreateSerializer(serializers.Serializer):
+    """创建直传会话"""
+    file_name = serializers.CharField(max_length=255)
+    title = serializers.CharField(required=False, max_length=255, default='')
+    is_public = serializers.BooleanField(required=False, default=False)
+
+
+class DirectUploadSerializer(serializers.ModelSerializer):
+    """序列化直传会话"""
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DirectUpload
+        fields = ['id', 'file_name', 'key', 'status', 'image', 'job', 'created_at', 'updated_at']
+
+    def get_image(self, obj):
+        if obj.image is None:
+            return None
+        return ImageSerializer(obj.image).data
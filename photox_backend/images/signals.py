@@ -0,0 +1,22 @@
+# images/signals.py
+# 图片保存（上传、修改标题等）和删除时增量更新全文检索索引和本进程的颜色索引
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .color_index import color_index
+from .models import Image
+from .search import index_images, remove_images
+
+
+@receiver(post_save, sender=Image)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    # loaddata 导入的数据由 rebuild_search_index 统一建索引
+    if not raw:
+        index_images([instance])
+        color_index.update(instance)
+
+
+@receiver(post_delete, sender=Image)
+def remove_search_index(sender, instance, **kwargs):
+    remove_images([instance.id])
+    color_index.remove(instance.id)
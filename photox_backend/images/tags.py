@@ -0,0 +1,143 @@
+# images/tags.py
+# 规范化标签：Image.tags 保留模型输出的原始文本（历史数据有 Python 列表和 JSON 两种格式），
+# 同时把小写规范化后的标签写入 Tag / ImageTag 表，按标签筛选走索引；
+# 序列化时 tags_list 读取预取的关联，返回 Tag.label 中保存的原始写法，不再解析文本
+import ast
+import json
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+
+from .models import ImageTag, Tag
+
+logger = logging.getLogger(__name__)
+
+# 单次筛选最多的标签数
+MAX_FILTER_TAGS = 10
+
+
+def display_tag(name):
+    """标签的显示写法：保留大小写，只合并空白，超出长度的部分截断"""
+    return ' '.join(str(name).split())[:Tag._meta.get_field('label').max_length]
+
+
+def normalize_tag(name):
+    """小写并合并空白，超出长度的部分截断；空标签返回 None"""
+    name = ' '.join(str(name).split()).lower()
+    return name[:Tag._meta.get_field('name').max_length] or None
+
+
+def parse_tags(value):
+    """把 Image.tags 的各种历史格式（列表、JSON 字符串、Python 列表的 repr、逗号分隔）解析为列表"""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            parsed = parse(value)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        if isinstance(parsed, (list, tuple)):
+            return list(parsed)
+        if isinstance(parsed, str) and parsed != value:
+            # 多次 json.dumps 的字符串，继续解析
+            return parse_tags(parsed)
+    return [tag.strip() for tag in value.split(',') if tag.strip()]
+
+
+def normalized_tags(value):
+    """Image.tags 原始文本对应的规范化标签（去重、保持顺序），与写入 ImageTag 的标签一致"""
+    names = []
+    for tag in parse_tags(value):
+        name = normalize_tag(tag)
+        if name is not None and name not in names:
+            names.append(name)
+    return names
+
+
+def resolve_tag_ids(names, tag_model=Tag, cache=None, labels=None):
+    """
+    查找或创建标签，返回 {名称: id}
+    :param tag_model: 数据迁移中传入历史模型
+    :param cache: 跨批次复用的 {名称: id}，会被就地更新
+    :param labels: 新建标签的显示写法 {名称: 原始写法}，已有标签不修改
+    """
+    cache = {} if cache is None else cache
+    labels = labels or {}
+    missing = [name for name in set(names) if name not in cache]
+    if missing:
+        # 并发创建同名标签时由唯一索引去重
+        tag_model.objects.bulk_create(
+            [tag_model(name=name, label=labels.get(name, '')) for name in missing], ignore_conflicts=True
+        )
+        cache.update(tag_model.objects.filter(name__in=missing).values_list('name', 'id'))
+    return cache
+
+
+def build_links(entries, tag_model=Tag, link_model=ImageTag, cache=None):
+    """
+    :param entries: [(image_id, 原始标签, 置信度列表或 None), ...]
+    :return: 未保存的关联对象列表（同一图片的重复标签只保留第一个）
+    """
+    normalized = []
+    labels = {}
+    for image_id, tags, scores in entries:
+        tags = parse_tags(tags)
+        scores = list(scores or [])
+        seen = {}
+        for index, tag in enumerate(tags):
+            name = normalize_tag(tag)
+            if name is not None and name not in seen:
+                seen[name] = scores[index] if index < len(scores) else None
+                labels.setdefault(name, display_tag(tag))
+        normalized.append((image_id, seen))
+
+    ids = resolve_tag_ids([name for _, seen in normalized for name in seen], tag_model, cache, labels)
+    return [
+        link_model(image_id=image_id, tag_id=ids[name], confidence=confidence, rank=rank)
+        for image_id, seen in normalized
+        for rank, (name, confidence) in enumerate(seen.items())
+    ]
+
+
+def replace_image_tags(entries):
+    """
+    用新的分析结果替换图片的标签关联
+    并发替换同一图片的标签（唯一约束冲突）或图片已被删除（外键约束）时只记录日志，Image.tags 原始文本已保存
+    :param entries: [(image_id, 原始标签, 置信度列表或 None), ...]
+    """
+    if not entries:
+        return
+    try:
+        with transaction.atomic():
+            links = build_links(entries)
+            ImageTag.objects.filter(image_id__in=[image_id for image_id, _, _ in entries]).delete()
+            ImageTag.objects.bulk_create(links, batch_size=1000)
+    except IntegrityError as e:
+        logger.error(f"写入规范化标签失败: {str(e)}")
+
+
+def prefetch_tag_links():
+    """预取图片的标签关联（按顺序，带标签），配合 Image.get_tags_as_list 使用"""
+    return Prefetch('tag_links', queryset=ImageTag.objects.select_related('tag').order_by('rank'))
+
+
+def filter_by_tags(queryset, names, match_all=True):
+    """
+    按标签筛选图片：每个标签是一次 (tag, image) 索引上的半连接
+    :param match_all: True 时需要包含全部标签（AND），False 时包含任一标签即可（OR）
+    """
+    names = {name for name in (normalize_tag(name) for name in names) if name}
+    tag_ids = list(Tag.objects.filter(name__in=names).values_list('id', flat=True))
+    if match_all:
+        if len(tag_ids) < len(names):
+            # 有标签不存在，不可能全部包含
+            return queryset.none()
+        for tag_id in tag_ids:
+            queryset = queryset.filter(id__in=ImageTag.objects.filter(tag_id=tag_id).values('image_id'))
+        return queryset
+    if not tag_ids:
+        return queryset.none()
+    return queryset.filter(id__in=ImageTag.objects.filter(tag_id__in=tag_ids).values('image_id'))
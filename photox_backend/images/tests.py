@@ -1,3 +1,2302 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+
+from users.models import CustomUser
+
+
+def make_test_image(path, width=320, height=240, seed=0):
+    """生成带渐变和噪声的测试图片（纯色图的感知哈希都相同）"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([
+        (x * 255 // width + seed * 40) % 256,
+        (y * 255 // height + seed * 70) % 256,
+        ((x + y) * 128 // (width + height) + rng.integers(0, 30, size=(height, width))) % 256,
+    ], axis=-1).astype(np.uint8)
+    PILImage.fromarray(pixels).save(path, 'JPEG', quality=90)
+    return path
+
+
+def jpeg_upload(name='a.jpg', color=(200, 30, 30), size=(64, 48)):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def fake_analysis(key='images/a.jpg', tags=('Dog', 'cat'), category_id=2):
+    return {
+        'image_url': f'http://cdn.example.com/{key}',
+        'tags': list(tags),
+        'tag_scores': [0.9, 0.1][:len(tags)],
+        'category_id': category_id,
+        'colors': [[1, 2, 3], [4, 5, 6]],
+        'variants': {},
+    }
+
+
+class ImageContextTests(SimpleTestCase):
+    def open_fds(self):
+        return len(os.listdir('/proc/self/fd'))
+
+    @skipUnless(os.path.isdir('/proc/self/fd'), "需要 /proc 统计文件句柄")
+    def test_close_releases_undecoded_file(self):
+        from image_context import ImageContext
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = make_test_image(os.path.join(tmpdir, 'a.jpg'))
+        before = self.open_fds()
+        context = ImageContext(path)
+        self.assertEqual(self.open_fds(), before + 1)
+        context.close()
+        self.assertEqual(self.open_fds(), before)
+        with self.assertRaises(ValueError):
+            context.image
+
+        with ImageContext(path) as context:
+            self.assertEqual(context.size, (320, 240))
+        self.assertEqual(self.open_fds(), before)
+
+    def test_close_after_decode_keeps_pixels(self):
+        from image_context import ImageContext
+
+        buffer = io.BytesIO()
+        PILImage.new('RGBA', (40, 30), (10, 20, 30, 255)).save(buffer, 'PNG')
+        context = ImageContext.from_bytes(buffer.getvalue())
+        self.assertEqual(context.image.mode, 'RGB')
+        context.close()
+        self.assertEqual(context.scaled(max_side=20).size, (20, 15))
+        self.assertEqual(context.image.getpixel((0, 0)), (10, 20, 30))
+
+
+class _VLMStandIn(BaseHTTPRequestHandler):
+    """本地 VLM 接口替身：返回 server.status 和固定的类别编号，记录调用次数"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.calls += 1
+        if self.server.status == 200:
+            body = json.dumps({'choices': [{'message': {'content': '3'}}]}).encode('utf-8')
+        else:
+            body = b'{"error": "unavailable"}'
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class VLMResultCacheTests(TestCase):
+    """VLM 分类结果缓存：命中、未命中、过期和失败结果不缓存（PHOTOX_VLM_API_URL 指向本地替身服务）"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _VLMStandIn)
+        cls.server.calls = 0
+        cls.server.status = 200
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        import ai_classify
+        import vlm_cache
+
+        self.ai_classify = ai_classify
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.cache = vlm_cache.VLMResultCache(os.path.join(self.tmpdir, 'vlm_cache.sqlite3'), ttl=3600)
+        self.server.calls = 0
+        self.server.status = 200
+
+        # PHOTOX_VLM_API_URL 在导入时读取，这里直接替换模块变量
+        api_url = f'http://127.0.0.1:{self.server.server_port}/v1/chat/completions'
+        for patcher in (
+            mock.patch.object(ai_classify, 'VLM_API_URL', api_url),
+            mock.patch.object(ai_classify, 'cache', self.cache),
+            mock.patch.object(vlm_cache, 'CACHE_ENABLED', True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.image_path = make_test_image(os.path.join(self.tmpdir, 'a.jpg'))
+
+    def classify(self, path=None):
+        return self.ai_classify.image_classification(path or self.image_path, 'test-key')
+
+    def test_miss_then_hit(self):
+        first = self.classify()
+        self.assertEqual(first['category_id'], 3)
+        self.assertEqual(self.server.calls, 1)
+
+        # 重新编码后的同一张图片感知哈希相同，直接命中缓存
+        PILImage.open(self.image_path).save(os.path.join(self.tmpdir, 'b.jpg'), 'JPEG', quality=60)
+        second = self.classify(os.path.join(self.tmpdir, 'b.jpg'))
+        self.assertEqual(second['category_id'], 3)
+        self.assertEqual(self.server.calls, 1)
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1})
+
+    def test_distinct_images_miss(self):
+        # 纯黑、纯白、从左到右变亮的渐变图的 dHash 部分都是全 0，颜色签名必须把它们区分开
+        gradient = np.tile(np.linspace(0, 255, 320, dtype=np.uint8), (240, 1))
+        images = {
+            'black.png': PILImage.new('RGB', (320, 240), (0, 0, 0)),
+            'white.png': PILImage.new('RGB', (320, 240), (255, 255, 255)),
+            'red.png': PILImage.new('RGB', (320, 240), (200, 30, 30)),
+            'gradient.png': PILImage.fromarray(np.stack([gradient] * 3, axis=-1)),
+        }
+        paths = [self.image_path, make_test_image(os.path.join(self.tmpdir, 'other.jpg'), seed=1)]
+        for name, img in images.items():
+            img.save(os.path.join(self.tmpdir, name))
+            paths.append(os.path.join(self.tmpdir, name))
+
+        for path in paths:
+            self.classify(path)
+        self.assertEqual(self.server.calls, len(paths))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (0, len(paths), len(paths)))
+
+    def test_expired_entry_calls_api_again(self):
+        self.classify()
+        conn = self.cache._connection()
+        conn.execute("UPDATE vlm_cache SET created_at = created_at - ?", (self.cache.ttl + 1,))
+        conn.commit()
+
+        self.classify()
+        self.assertEqual(self.server.calls, 2)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (0, 2, 1))
+
+    def test_failed_call_is_not_cached(self):
+        self.server.status = 400
+        self.assertIsNone(self.classify())
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+        self.server.status = 200
+        calls = self.server.calls
+        self.assertEqual(self.classify()['category_id'], 3)
+        self.assertEqual(self.server.calls, calls + 1)
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_stats_exposed_in_upstream_metrics(self):
+        self.classify()
+        self.classify()
+        admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with mock.patch('images.views.vlm_cache', self.cache):
+            response = client.get('/api/v1/images/metrics/upstreams/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['vlm_cache'],
+                         {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 1})
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        settings_patch = override_settings(UPLOAD_STAGING_DIR=self.tmpdir)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        self.user = CustomUser.objects.create_user('chunked', 'chunked@example.com', 'pw')
+
+    def test_corrupt_retransmit_keeps_received_data(self):
+        from .chunked import ChunkError, create_upload, write_chunk
+
+        data = os.urandom(3000)
+        upload = create_upload(self.user, 'a.jpg', len(data))
+        upload = write_chunk(upload, 0, 1000, io.BytesIO(data[:1000]), hashlib.sha256(data[:1000]).hexdigest())
+
+        # 重传第一块时数据损坏：校验失败，已接收的数据和区间都不变
+        corrupt = bytes(1000)
+        with self.assertRaises(ChunkError):
+            write_chunk(upload, 0, 1000, io.BytesIO(corrupt), hashlib.sha256(data[:1000]).hexdigest())
+        upload.refresh_from_db()
+        self.assertEqual(upload.received, [[0, 1000]])
+        with open(upload.file_path, 'rb') as f:
+            self.assertEqual(f.read(1000), data[:1000])
+
+
+class PaletteEngineTests(TestCase):
+    """NumPy 向量化 MMCQ 与 ColorThief 的调色板一致"""
+
+    def generated_images(self):
+        rng = np.random.default_rng(7)
+        y, x = np.mgrid[0:200, 0:300]
+        gradient = np.stack([x * 255 // 300, y * 255 // 200, (x + y) * 255 // 500], axis=-1)
+        blocks = np.kron(rng.integers(0, 256, size=(10, 15, 3)), np.ones((20, 20, 1)))
+        noise = rng.integers(0, 256, size=(200, 300, 3))
+        # 带透明和接近白色像素的图片：两者都应跳过这些像素
+        rgba = np.dstack([gradient, np.where(x < 100, 0, 255)])
+        rgba[:50] = 255
+        return [
+            PILImage.fromarray(gradient.astype(np.uint8)),
+            PILImage.fromarray(blocks.astype(np.uint8)),
+            PILImage.fromarray(noise.astype(np.uint8)),
+            PILImage.fromarray(rgba.astype(np.uint8), 'RGBA'),
+        ]
+
+    def test_palettes_match_colorthief(self):
+        from color import _DecodedColorThief, extract_palettes
+
+        images = self.generated_images()
+        for color_count in (2, 3, 5, 8, 10):
+            palettes = extract_palettes(images, color_count)
+            for index, img in enumerate(images):
+                with self.subTest(image=index, color_count=color_count):
+                    expected = _DecodedColorThief(img).get_palette(color_count=color_count)
+                    self.assertEqual([tuple(color) for color in palettes[index]], expected)
+
+    def test_numpy_engine_faster_than_colorthief(self):
+        from color import COLOR_MAX_SIDE, _DecodedColorThief, extract_palettes
+
+        def best_of(func, repeat=3):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        # 上传流水线中两者处理的都是最长边 COLOR_MAX_SIDE 的缩小图
+        images = [img.resize((COLOR_MAX_SIDE, COLOR_MAX_SIDE * 2 // 3)) for img in self.generated_images()]
+        colorthief = sum(best_of(lambda: _DecodedColorThief(img).get_palette(color_count=5)) for img in images)
+        numpy_engine = sum(best_of(lambda: extract_palettes([img], 5)) for img in images)
+        # 本机实测约快 70-90 倍，这里只要求 5 倍，避免机器负载导致误报
+        self.assertGreater(colorthief / numpy_engine, 5,
+                           f"colorthief {colorthief * 1000:.1f} ms, numpy {numpy_engine * 1000:.1f} ms")
+
+    def test_all_white_image_has_empty_palette(self):
+        from color import _DecodedColorThief, extract_palettes
+
+        white = PILImage.new('RGB', (100, 100), (255, 255, 255))
+        self.assertEqual(extract_palettes([white], 5), [[]])
+        # ColorThief 在没有有效像素时抛出异常，NumPy 引擎返回空调色板
+        with self.assertRaises(Exception):
+            _DecodedColorThief(white).get_palette(color_count=5)
+
+
+class FakeQiniuMixin:
+    """在临时目录上启动七牛云替身（fake_qiniu，即 manage.py runfakeqiniu），上传和管理接口都指向它"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import fake_qiniu
+        import save
+
+        cls.qiniu_root = tempfile.mkdtemp()
+        cls.qiniu = fake_qiniu.FakeQiniuServer(
+            ('127.0.0.1', 0), cls.qiniu_root, settings.QINIU_ACCESS_KEY, settings.QINIU_SECRET_KEY
+        )
+        threading.Thread(target=cls.qiniu.serve_forever, daemon=True).start()
+        host = f'http://127.0.0.1:{cls.qiniu.server_port}'
+        cls.qiniu_host = host
+        cls.qiniu_patchers = [
+            mock.patch.multiple(save, QINIU_UP_HOST=host, QINIU_RS_HOST=host, QINIU_PUBLIC_URL=host,
+                                RESUMABLE_THRESHOLD=1024 * 1024, PART_SIZE=1024 * 1024),
+            mock.patch('images.direct.QINIU_CLIENT_UP_HOST', host),
+        ]
+        for patcher in cls.qiniu_patchers:
+            patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        for patcher in reversed(cls.qiniu_patchers):
+            patcher.stop()
+        cls.qiniu.shutdown()
+        cls.qiniu.server_close()
+        shutil.rmtree(cls.qiniu_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.qiniu.store.requests.clear()
+
+    @property
+    def credentials(self):
+        return settings.QINIU_ACCESS_KEY, settings.QINIU_SECRET_KEY, settings.QINIU_BUCKET_NAME
+
+    def stored(self, key):
+        return self.qiniu.store.stat(settings.QINIU_BUCKET_NAME, key)
+
+
+class QiniuUploadTests(FakeQiniuMixin, SimpleTestCase):
+    def jpeg_bytes(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (64, 48), (200, 30, 30)).save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def test_form_upload_writes_metadata(self):
+        from save import object_metadata, upload_data
+
+        self.assertTrue(upload_data(*self.credentials, self.jpeg_bytes(), 'images/a.jpg',
+                                    object_metadata(3, [(1, 2, 3), (4, 5, 6)])))
+        self.assertEqual(self.qiniu.store.requests, {'form': 1})
+        info = self.stored('images/a.jpg')
+        self.assertEqual(info['mimeType'], 'image/jpeg')
+        self.assertEqual(info['x-qn-meta'], {'user': 'user01', 'category': '3', 'color': '(1,2,3),(4,5,6)'})
+
+    def test_large_upload_uses_multipart_v2(self):
+        from save import object_metadata, upload_data
+
+        data = os.urandom(2 * 1024 * 1024 + 1000)
+        self.assertTrue(upload_data(*self.credentials, data, 'images/big.png', object_metadata(5, [(7, 8, 9)])))
+        self.assertEqual(self.qiniu.store.requests, {'init_parts': 1, 'upload_part': 3, 'complete_parts': 1})
+        info = self.stored('images/big.png')
+        self.assertEqual(info['mimeType'], 'image/png')
+        self.assertEqual(info['x-qn-meta'], {'user': 'user01', 'category': '5', 'color': '(7,8,9)'})
+        with open(os.path.join(self.qiniu_root, settings.QINIU_BUCKET_NAME, 'images/big.png'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_invalid_signature_is_rejected(self):
+        from save import upload_data
+
+        access_key, _, bucket = self.credentials
+        self.assertFalse(upload_data(access_key, 'wrong-secret', bucket, self.jpeg_bytes(), 'images/bad.jpg'))
+        self.assertIsNone(self.stored('images/bad.jpg'))
+
+
+class DirectUploadCallbackTests(FakeQiniuMixin, LiveServerTestCase):
+    """直传回调：七牛云替身按上传策略签名回调本服务，签名校验通过后提交后台任务"""
+
+    def setUp(self):
+        super().setUp()
+        self.callback_url = f'{self.live_server_url}/api/v1/images/direct-uploads/callback/'
+        settings_patch = override_settings(DIRECT_UPLOAD_CALLBACK_URL=self.callback_url)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        # 只验证任务已提交，不在后台线程中执行分析
+        executor_patch = mock.patch('images.jobs.get_executor')
+        self.executor = executor_patch.start()
+        self.addCleanup(executor_patch.stop)
+
+        self.user = CustomUser.objects.create_user('direct', 'direct@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_signed_callback_submits_job(self):
+        import qiniu
+        from .models import DirectUpload, UploadJob
+
+        response = self.client.post('/api/v1/images/direct-uploads/', {'file_name': 'my pic.jpg'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertTrue(data['callback'])
+        self.assertEqual(data['upload_host'], self.qiniu_host)
+
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (64, 48), (20, 130, 60)).save(buffer, 'JPEG')
+        ret, info = qiniu.put_data(data['token'], data['key'], buffer.getvalue(), mime_type='image/jpeg',
+                                   regions=[qiniu.Region(up_host=data['upload_host'])])
+        self.assertEqual(info.status_code, 200, info.text_body)
+        self.assertEqual(self.qiniu.store.requests.get('callback'), 1)
+        self.assertEqual(ret['data']['upload']['status'], DirectUpload.STATUS_COMPLETED)
+
+        upload = DirectUpload.objects.get(id=data['id'])
+        self.assertEqual(upload.status, DirectUpload.STATUS_COMPLETED)
+        job = UploadJob.objects.get(id=upload.job_id)
+        self.assertEqual(job.file_name, data['key'])
+        self.executor.return_value.submit.assert_called_once()
+
+    def test_forged_callback_is_rejected(self):
+        import requests
+
+        response = self.client.post('/api/v1/images/direct-uploads/', {'file_name': 'a.jpg'}, format='json')
+        data = response.json()['data']
+        forged = requests.post(self.callback_url, json={'upload_id': data['id'], 'key': data['key']},
+                               headers={'Authorization': 'QBox fake:signature'}, timeout=5)
+        self.assertEqual(forged.status_code, 403)
+
+
+@skipUnless(connection.vendor in ('sqlite', 'mysql'), "只检查 SQLite 和 MySQL 的执行计划")
+class ImageListIndexTests(TestCase):
+    """图片列表的查询应当命中复合索引，并且按 created_at 排序时不需要额外排序"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Image
+
+        cls.user = CustomUser.objects.create_user('owner', 'owner@example.com', 'pw')
+        other = CustomUser.objects.create_user('other', 'other@example.com', 'pw')
+        # 表太小时优化器可能直接扫描，造一批其他用户的数据
+        Image.objects.bulk_create(
+            [Image(title=f't{i}', image_url='http://x', user=cls.user, is_public=i % 2 == 0, category_id=i % 3)
+             for i in range(30)]
+            + [Image(title='o', image_url='http://x', user=other, is_public=i % 10 == 0, category_id=i % 20)
+               for i in range(5000)]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE' if connection.vendor == 'sqlite' else f'ANALYZE TABLE {Image._meta.db_table}')
+
+    def list_queryset(self, params):
+        from .views import ImageListView
+
+        request = APIRequestFactory().get('/api/v1/images/', params)
+        force_authenticate(request, self.user)
+        view = ImageListView()
+        view.request = view.initialize_request(request)
+        return view.get_queryset()[:11]
+
+    def assertUsesIndex(self, params, index_name):
+        plan = self.list_queryset(params).explain()
+        self.assertIn(index_name, plan)
+        if connection.vendor == 'sqlite':
+            self.assertNotIn('TEMP B-TREE', plan.upper())
+        else:
+            # MySQL 的 EXPLAIN 中 Extra 列出现 Using filesort 表示需要额外排序
+            self.assertNotIn('Using filesort', plan)
+
+    def test_own_images(self):
+        self.assertUsesIndex({}, 'image_user_created_pub_idx')
+        self.assertUsesIndex({'ordering': 'created_at'}, 'image_user_created_pub_idx')
+
+    def test_own_private_images(self):
+        self.assertUsesIndex({'is_public': 'false'}, 'image_user_created_pub_idx')
+
+    def test_public_feed(self):
+        self.assertUsesIndex({'is_public': 'true'}, 'image_created_public_idx')
+        self.assertUsesIndex({'is_public': 'true', 'ordering': 'created_at'}, 'image_created_public_idx')
+
+    def test_category_filter(self):
+        self.assertUsesIndex({'category_id': '1'}, 'image_user_category_idx')
+
+
+class ImageTagsListTests(TestCase):
+    """tags_list 读取 Tag / ImageTag（保留标签首次出现时的写法），规范化的名称只用于筛选"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('tags', 'tags@example.com', 'pw')
+
+    def test_tags_list_served_from_tag_links(self):
+        from .models import Image, Tag
+        from .serializers import ImageSerializer
+        from .tags import filter_by_tags, prefetch_tag_links, replace_image_tags
+
+        raw = ["116: 'Chiton,  coat-of-mail shell'", 'Dog', 'dog', ' Sea   Cradle ']
+        image = Image.objects.create(title='t', image_url='http://x', user=self.user, tags=json.dumps(raw))
+        replace_image_tags([(image.id, image.tags, [0.5, 0.3, 0.1, 0.1])])
+
+        expected = ["116: 'Chiton, coat-of-mail shell'", 'Dog', 'Sea Cradle']
+        with mock.patch('images.tags.parse_tags') as parse_tags:
+            prefetched = Image.objects.prefetch_related(prefetch_tag_links()).get(id=image.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(ImageSerializer(prefetched).data['tags_list'], expected)
+            self.assertEqual(ImageSerializer(Image.objects.get(id=image.id)).data['tags_list'], expected)
+        parse_tags.assert_not_called()
+
+        self.assertEqual(
+            list(Tag.objects.order_by('name').values_list('name', flat=True)),
+            ["116: 'chiton, coat-of-mail shell'", 'dog', 'sea cradle'],
+        )
+        self.assertEqual(list(filter_by_tags(Image.objects.all(), ['DOG', 'sea cradle'])), [image])
+
+        # 已有标签保留首次出现时的写法
+        other = Image.objects.create(title='o', image_url='http://y', user=self.user, tags=json.dumps(['DOG', 'Cat']))
+        replace_image_tags([(other.id, other.tags, [0.6, 0.4])])
+        self.assertEqual(ImageSerializer(other).data['tags_list'], ['Dog', 'Cat'])
+
+    def test_list_view_prefetches_tag_links(self):
+        from .models import Image
+        from .tags import replace_image_tags
+
+        for i in range(3):
+            image = Image.objects.create(title=f'{i}', image_url='http://x', user=self.user,
+                                         tags=json.dumps([f'Tag{i}', 'Shared']))
+            replace_image_tags([(image.id, image.tags, None)])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/v1/images/')
+        items = response.json()['results']
+        self.assertEqual(sorted(item['tags_list'][0] for item in items), ['Tag0', 'Tag1', 'Tag2'])
+        self.assertEqual({item['tags_list'][1] for item in items}, {'Shared'})
+
+    def test_images_without_links_fall_back_to_text(self):
+        from .models import Image
+        from .serializers import ImageSerializer
+
+        image = Image.objects.create(title='t', image_url='http://x', user=self.user, tags=json.dumps(['Dog']))
+        self.assertEqual(ImageSerializer(image).data['tags_list'], ['Dog'])
+
+    def test_label_backfill_migration(self):
+        from importlib import import_module
+
+        from django.apps import apps
+
+        from .models import Image, Tag
+
+        Image.objects.create(title='a', image_url='http://x', user=self.user, tags=json.dumps(['Golden  Retriever']))
+        Image.objects.create(title='b', image_url='http://y', user=self.user, tags="['golden retriever', 'Ball']")
+        Tag.objects.bulk_create([Tag(name='golden retriever'), Tag(name='ball'), Tag(name='unused')])
+
+        import_module('images.migrations.0014_tag_label').backfill_tag_labels(apps, None)
+        self.assertEqual(dict(Tag.objects.values_list('name', 'label')),
+                         {'golden retriever': 'Golden Retriever', 'ball': 'Ball', 'unused': ''})
+        self.assertEqual(Tag.objects.get(name='unused').display_name, 'unused')
+
+
+class _StandInClassifier:
+    """推理节点中替代真实模型的分类器：固定返回节点名作为标签，可模拟推理耗时"""
+
+    def __init__(self, name, delay):
+        self.name = name
+        self.delay = delay
+
+    def predict(self, image, top_k=5):
+        import time
+
+        image.image  # 与真实分类器一样解码图片
+        time.sleep(self.delay)
+        return [(self.name, 0.9)]
+
+    def predict_batch(self, images, top_k=5):
+        import time
+
+        for image in images:
+            image.image
+        # 一个批次只做一次前向推理
+        time.sleep(self.delay)
+        return [[(self.name, 0.9)] for _ in images]
+
+
+def _run_inference_node(name, port, delay, ready, max_batch=None):
+    """在子进程中启动 inference_server 节点，模型换成 _StandInClassifier"""
+    import inference_server
+
+    inference_server._classifiers['resnet50'] = _StandInClassifier(name, delay)
+    if max_batch:
+        inference_server.MAX_BATCH = max_batch
+    server = inference_server.InferenceHTTPServer(('127.0.0.1', port))
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+class RemoteInferenceTests(SimpleTestCase):
+    """多个本地 inference_server 进程作为推理节点：最少未完成请求负载均衡、故障切换和本机推理兜底"""
+
+    def start_node(self, name, port=0, delay=0.0, max_batch=None):
+        import multiprocessing
+
+        context = multiprocessing.get_context('fork')
+        ready = context.Queue()
+        process = context.Process(target=_run_inference_node, args=(name, port, delay, ready, max_batch),
+                                  daemon=True)
+        process.start()
+        self.addCleanup(self.stop_node, process)
+        return process, f'http://127.0.0.1:{ready.get(timeout=10)}'
+
+    def stop_node(self, process):
+        if process.is_alive():
+            process.terminate()
+        process.join(5)
+
+    def images(self, count):
+        from image_context import ImageContext
+
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (64, 48), (20, 130, 60)).save(buffer, 'JPEG')
+        return [ImageContext.from_bytes(buffer.getvalue()) for _ in range(count)]
+
+    def make_client(self, urls):
+        from inference_client import RemoteInferenceClient
+
+        # 健康检查只在测试中手动触发
+        return RemoteInferenceClient(urls, timeout=5, health_interval=3600)
+
+    def labels(self, results):
+        return [result[0][0] for result in results]
+
+    def record_posts(self):
+        """记录发往推理节点的请求，返回每个请求包含的图片数"""
+        import requests
+
+        batches = []
+        post = requests.Session.post
+
+        def recording_post(session, url, **kwargs):
+            batches.append(len(kwargs['headers']['X-Image-Sizes'].split(',')))
+            return post(session, url, **kwargs)
+
+        patcher = mock.patch.object(requests.Session, 'post', recording_post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return batches
+
+    def test_equal_nodes_share_requests(self):
+        _, url_a = self.start_node('a', delay=0.05)
+        _, url_b = self.start_node('b', delay=0.05)
+        batches = self.record_posts()
+        labels = self.labels(self.make_client([url_a, url_b]).predict_many(self.images(16)))
+        # 16 张图片合并为两个请求，每个节点一个
+        self.assertEqual(sorted(labels), ['a'] * 8 + ['b'] * 8)
+        self.assertEqual(batches, [8, 8])
+
+    def test_batches_are_chunked_by_node_max_batch(self):
+        _, url = self.start_node('a', max_batch=3)
+        client = self.make_client([url])
+        batches = self.record_posts()
+        # 客户端还不知道节点的上限，超出时节点返回 413 和上限，按上限拆分后重发
+        self.assertEqual(self.labels(client.predict_many(self.images(7))), ['a'] * 7)
+        self.assertEqual(batches, [7, 3, 3, 1])
+        self.assertEqual(client.nodes[0].max_batch, 3)
+        self.assertTrue(client.status()[0]['healthy'])
+
+        batches.clear()
+        self.assertEqual(self.labels(client.predict_many(self.images(7))), ['a'] * 7)
+        self.assertEqual(sorted(batches), [1, 3, 3])
+
+        # 健康检查同样返回节点的上限
+        client.nodes[0].max_batch = None
+        client.check_health()
+        self.assertEqual(client.nodes[0].max_batch, 3)
+
+    def test_non_json_error_body_uses_response_text(self):
+        import requests
+        from inference_client import RemoteInferenceError
+
+        response = requests.Response()
+        response.status_code = 400
+        response._content = b'<html>Bad Request</html>'
+        client = self.make_client(['http://127.0.0.1:9'])
+        with mock.patch.object(requests.Session, 'post', return_value=response), \
+                self.assertRaisesMessage(RemoteInferenceError, '<html>Bad Request</html>'):
+            client.predict(self.images(1)[0])
+
+    def test_slow_node_gets_fewer_requests(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        _, slow = self.start_node('slow', delay=0.5)
+        _, fast = self.start_node('fast', delay=0.02)
+        client = self.make_client([slow, fast])
+        # 多个线程同时发出单张图片的请求
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            labels = self.labels(executor.map(client.predict, self.images(16)))
+        # 慢节点上的请求迟迟不返回，未完成请求数高，新请求都会发往快节点
+        self.assertGreater(labels.count('fast'), 2 * labels.count('slow'))
+        self.assertTrue(all(node['outstanding'] == 0 for node in client.status()))
+
+    def test_failed_node_is_evicted_and_readmitted(self):
+        process, url_a = self.start_node('a')
+        _, url_b = self.start_node('b')
+        client = self.make_client([url_a, url_b])
+        self.assertEqual(sorted(self.labels(client.predict_many(self.images(2)))), ['a', 'b'])
+
+        self.stop_node(process)
+        # 发往已停止节点的请求换到另一个节点重试，该节点被移出轮换
+        self.assertEqual(self.labels(client.predict_many(self.images(4))), ['b'] * 4)
+        status = {node['url']: node for node in client.status()}
+        self.assertFalse(status[url_a]['healthy'])
+        self.assertTrue(status[url_b]['healthy'])
+
+        client.check_health()
+        self.assertFalse(client.status()[0]['healthy'])
+
+        # 节点在原端口重启，健康检查通过后重新加入
+        self.start_node('a', port=int(url_a.rsplit(':', 1)[1]))
+        client.check_health()
+        self.assertTrue(all(node['healthy'] for node in client.status()))
+        self.assertIn('a', self.labels(client.predict_many(self.images(4))))
+
+    def test_all_nodes_down_falls_back_to_local_inference(self):
+        import ai_image
+        import inference_client
+        from inference_client import RemoteInferenceError
+
+        process_a, url_a = self.start_node('a')
+        process_b, url_b = self.start_node('b')
+        client = self.make_client([url_a, url_b])
+        self.stop_node(process_a)
+        self.stop_node(process_b)
+        with self.assertRaises(RemoteInferenceError):
+            client.predict(self.images(1)[0])
+
+        local = mock.Mock()
+        local.return_value.predict.return_value = [('local', 0.8)]
+        local.return_value.predict_batch.return_value = [[('local', 0.8)], [('local', 0.7)]]
+        with mock.patch.object(inference_client, 'NODES', [url_a, url_b]), \
+                mock.patch.object(inference_client, '_client', client), \
+                mock.patch.object(ai_image, 'ImageClassifier', local):
+            self.assertEqual(ai_image.ai_image_with_scores(self.images(1)[0]), (['local'], '其他', [0.8]))
+            self.assertEqual([tags for tags, _, _ in ai_image.ai_image_batch_with_scores(self.images(2))],
+                             [['local'], ['local']])
+
+
+class StagingDirMixin:
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        settings_patch = override_settings(UPLOAD_STAGING_DIR=self.tmpdir)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+
+    def staged_files(self):
+        return [os.path.join(root, name) for root, _, files in os.walk(self.tmpdir) for name in files]
+
+
+class AsyncUploadJobTests(StagingDirMixin, TestCase):
+    """异步上传：202 响应、任务状态查询、阶段状态变化和失败路径（分析流水线替换为假实现）"""
+
+    def setUp(self):
+        super().setUp()
+        # 提交的任务不在后台线程中执行，测试中直接调用 run_upload_job
+        executor_patch = mock.patch('images.jobs.get_executor')
+        self.executor = executor_patch.start()
+        self.addCleanup(executor_patch.stop)
+        self.user = CustomUser.objects.create_user('async', 'async@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def submit(self):
+        response = self.client.post('/api/v1/images/upload/?async=true', {'image': jpeg_upload(), 'title': 't'},
+                                    format='multipart')
+        self.assertEqual(response.status_code, 202)
+        return response.json()['data']
+
+    def job(self, job_id):
+        response = self.client.get(f'/api/v1/images/jobs/{job_id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['data']
+
+    def test_accepted_job_is_staged_and_queued(self):
+        from image_context import ImageContext
+        from .jobs import run_upload_job
+
+        # 只用于校验格式的上下文在返回 202 之前关闭
+        with mock.patch.object(ImageContext, 'close', autospec=True, side_effect=ImageContext.close) as close:
+            data = self.submit()
+        close.assert_called_once()
+        self.assertEqual(data['status'], 'pending')
+        self.assertEqual(data['stages'], {stage: 'pending' for stage in ['colors', 'classify', 'tags', 'upload', 'variants']})
+        self.assertIsNone(data['image'])
+        self.executor.return_value.submit.assert_called_once_with(run_upload_job, mock.ANY)
+        self.assertEqual(str(self.executor.return_value.submit.call_args[0][1]), data['id'])
+        # 返回 202 之前图片已写入暂存目录
+        self.assertEqual(len(self.staged_files()), 1)
+        self.assertEqual(self.job(data['id'])['status'], 'pending')
+
+    def test_stage_transitions_and_success(self):
+        from .jobs import run_upload_job
+        from .models import UploadJob
+
+        data = self.submit()
+        observed = []
+
+        def analyze(path, key, on_stage):
+            self.assertTrue(os.path.exists(path))
+            for stage in ['colors', 'classify', 'tags', 'upload', 'variants']:
+                on_stage(stage, 'running')
+                on_stage(stage, 'done')
+                job = UploadJob.objects.get(id=data['id'])
+                observed.append((job.status, dict(job.stages)))
+            return fake_analysis(key)
+
+        with mock.patch('images.jobs.analyze_and_upload', side_effect=analyze):
+            run_upload_job(data['id'])
+
+        self.assertEqual(observed[0], ('running', {'colors': 'done', 'classify': 'pending', 'tags': 'pending',
+                                                   'upload': 'pending', 'variants': 'pending'}))
+        self.assertEqual(observed[2][1]['tags'], 'done')
+        job = self.job(data['id'])
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(set(job['stages'].values()), {'done'})
+        self.assertEqual(job['image']['title'], 't')
+        self.assertEqual(job['image']['category_id'], 2)
+        self.assertEqual(self.staged_files(), [])
+
+    def test_pipeline_error_fails_job(self):
+        from .jobs import run_upload_job
+        from .pipeline import UploadPipelineError
+
+        data = self.submit()
+        with mock.patch('images.jobs.analyze_and_upload', side_effect=UploadPipelineError("上传到七牛云失败")):
+            run_upload_job(data['id'])
+        job = self.job(data['id'])
+        self.assertEqual((job['status'], job['error'], job['image']), ('failed', "上传到七牛云失败", None))
+        self.assertEqual(self.staged_files(), [])
+
+        data = self.submit()
+        with mock.patch('images.jobs.analyze_and_upload', side_effect=RuntimeError("boom")):
+            run_upload_job(data['id'])
+        job = self.job(data['id'])
+        self.assertEqual((job['status'], job['error']), ('failed', "服务器内部错误: boom"))
+
+    def test_other_users_job_is_not_found(self):
+        data = self.submit()
+        other = APIClient()
+        other.force_authenticate(CustomUser.objects.create_user('other', 'other@example.com', 'pw'))
+        self.assertEqual(other.get(f'/api/v1/images/jobs/{data["id"]}/').status_code, 404)
+
+
+class UploadJobRecoveryTests(StagingDirMixin, TransactionTestCase):
+    """recover_upload_jobs：重启后重新执行或标记失败中断的任务，并清理孤立的暂存文件"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user('recover', 'recover@example.com', 'pw')
+
+    def stale_job(self, status='pending', staged=True):
+        from .models import UploadJob
+
+        file_path = ''
+        if staged:
+            file_path = os.path.join(self.tmpdir, f'{len(self.staged_files())}_a.jpg')
+            with open(file_path, 'wb') as f:
+                f.write(jpeg_upload().read())
+        job = UploadJob.objects.create(
+            user=self.user, file_path=file_path or os.path.join(self.tmpdir, 'missing.jpg'), file_name='images/a.jpg',
+            status=status, stages={'colors': 'done', 'classify': 'running'},
+        )
+        UploadJob.objects.filter(id=job.id).update(updated_at=job.updated_at - timedelta(hours=1))
+        return job
+
+    def test_stale_jobs_are_rerun(self):
+        from .models import Image, UploadJob
+
+        pending = self.stale_job('pending')
+        running = self.stale_job('running')
+        missing = self.stale_job('running', staged=False)
+        fresh = self.stale_job('pending')
+        UploadJob.objects.filter(id=fresh.id).update(updated_at=timezone.now())
+
+        with mock.patch('images.jobs.analyze_and_upload', side_effect=lambda path, key, on_stage: fake_analysis(key)):
+            call_command('recover_upload_jobs', older_than=30, workers=1, stdout=io.StringIO())
+
+        jobs = {job.id: job for job in UploadJob.objects.all()}
+        self.assertEqual(jobs[pending.id].status, UploadJob.STATUS_SUCCEEDED)
+        self.assertEqual(jobs[running.id].status, UploadJob.STATUS_SUCCEEDED)
+        self.assertEqual(Image.objects.count(), 2)
+        self.assertEqual(jobs[missing.id].status, UploadJob.STATUS_FAILED)
+        self.assertIn("暂存文件已丢失", jobs[missing.id].error)
+        # 最近还在更新的任务可能仍由某个进程执行，保持不变，其暂存文件也不清理
+        self.assertEqual(jobs[fresh.id].status, UploadJob.STATUS_PENDING)
+        self.assertEqual(self.staged_files(), [fresh.file_path])
+
+    def test_fail_option_and_orphan_sweep(self):
+        from .models import UploadJob
+
+        job = self.stale_job('running')
+        orphan = os.path.join(self.tmpdir, 'orphan.jpg')
+        recent = os.path.join(self.tmpdir, 'recent.jpg')
+        for path in (orphan, recent):
+            with open(path, 'wb') as f:
+                f.write(b'x')
+        old = time.time() - 3600
+        os.utime(orphan, (old, old))
+        os.utime(job.file_path, (old, old))
+
+        with mock.patch('images.jobs.analyze_and_upload') as analyze:
+            call_command('recover_upload_jobs', older_than=30, fail=True, stdout=io.StringIO())
+        analyze.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_FAILED)
+        # 失败任务和孤立的暂存文件被删除，刚写入的文件可能属于正在处理的请求，保留
+        self.assertEqual(self.staged_files(), [recent])
+
+
+class _StandInModel:
+    """微批测试用的模型：记录每次前向推理的批大小，可以阻塞或抛出异常"""
+
+    def __init__(self, delay=0.0, gate=None, error=None):
+        self.batch_sizes = []
+        self.delay = delay
+        self.gate = gate
+        self.error = error
+
+    def __call__(self, batch_tensor):
+        self.batch_sizes.append(len(batch_tensor))
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        time.sleep(self.delay)
+        return batch_tensor.flatten(1)[:, :10]
+
+
+class _BatcherCrash(BaseException):
+    """让批处理线程退出（_process 只捕获 Exception）"""
+
+
+class BatchingInferenceTests(SimpleTestCase):
+    """动态微批：合批、等待超时和后台线程重启（模型替换为 _StandInModel）"""
+
+    def service(self, model, max_batch_size=4, max_latency_ms=200):
+        from types import SimpleNamespace
+
+        from inference_batcher import BatchingInferenceService
+
+        patcher = mock.patch('inference_batcher.registry.get', return_value=SimpleNamespace(model=model, device='cpu'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return BatchingInferenceService('stand-in', max_batch_size=max_batch_size, max_latency_ms=max_latency_ms)
+
+    def tensors(self, count):
+        import torch
+
+        return torch.rand(count, 3, 4, 4)
+
+    def test_concurrent_requests_are_coalesced(self):
+        from inference_batcher import run_topk, wait_results
+
+        model = _StandInModel()
+        service = self.service(model)
+        tensors = self.tensors(6)
+        results = wait_results(service.submit_many(tensors, top_k=3))
+        self.assertEqual(model.batch_sizes, [4, 2])
+        expected = run_topk(_StandInModel(), tensors, 3)
+        self.assertEqual(len(results), 6)
+        for result, row in zip(results, expected):
+            self.assertEqual([index for index, _ in result], [index for index, _ in row])
+
+    def test_timeout_cancels_queued_requests(self):
+        from concurrent.futures import TimeoutError
+
+        from inference_batcher import wait_results
+
+        gate = threading.Event()
+        model = _StandInModel(gate=gate)
+        service = self.service(model, max_batch_size=1, max_latency_ms=0)
+        futures = service.submit_many(self.tensors(3))
+        with self.assertRaises(TimeoutError):
+            wait_results(futures, timeout=0.2)
+        # 第一张已在推理中，其余两张还在队列里，被取消后不再推理
+        self.assertTrue(futures[1].cancelled() and futures[2].cancelled())
+        gate.set()
+        futures[0].result(timeout=5)
+        self.assertEqual(len(service.submit(self.tensors(1)[0]).result(timeout=5)), 5)
+        self.assertEqual(model.batch_sizes, [1, 1])
+
+    def test_timeout_scales_with_batches(self):
+        from concurrent.futures import TimeoutError
+
+        from inference_batcher import wait_results
+
+        # 8 张图片分 4 个批次，每批 0.1 秒：单个批次的 0.25 秒不够，按批次数放宽后足够
+        service = self.service(_StandInModel(delay=0.1), max_batch_size=2, max_latency_ms=0)
+        with self.assertRaises(TimeoutError):
+            wait_results(service.submit_many(self.tensors(8)), timeout=0.25)
+        service = self.service(_StandInModel(delay=0.1), max_batch_size=2, max_latency_ms=0)
+        self.assertEqual(len(wait_results(service.submit_many(self.tensors(8)), timeout=0.25, batch_size=2)), 8)
+
+    def test_infer_scales_timeout_by_batch_size(self):
+        import inference_batcher
+
+        model = _StandInModel()
+        self.service(model)
+        with mock.patch.object(inference_batcher, 'BATCHING_ENABLED', True), \
+                mock.patch.object(inference_batcher.inference_pool, 'available', return_value=False), \
+                mock.patch.object(inference_batcher, '_services', {}), \
+                mock.patch('inference_batcher.wait_results', wraps=inference_batcher.wait_results) as wait:
+            results = inference_batcher.infer('stand-in', 'DEFAULT', 'cpu', self.tensors(20), top_k=2)
+        self.assertEqual(len(results), 20)
+        self.assertEqual(wait.call_args.kwargs['batch_size'], inference_batcher.MAX_BATCH_SIZE)
+
+    def test_restarted_thread_keeps_queued_requests(self):
+        gate = threading.Event()
+        model = _StandInModel(gate=gate, error=_BatcherCrash())
+        service = self.service(model, max_batch_size=1, max_latency_ms=0)
+        with mock.patch('threading.excepthook'):
+            service.submit(self.tensors(1)[0])
+            # 第一张推理时线程退出，此时第二张已在队列中
+            queued = service.submit(self.tensors(1)[0])
+            crashed_thread = service._thread
+            gate.set()
+            crashed_thread.join(5)
+        self.assertFalse(crashed_thread.is_alive())
+
+        # 下一次提交重启线程并沿用原来的队列，之前排队的请求同样得到处理
+        latest = service.submit(self.tensors(1)[0])
+        self.assertIsNot(service._thread, crashed_thread)
+        self.assertEqual(len(queued.result(timeout=5)), 5)
+        self.assertEqual(len(latest.result(timeout=5)), 5)
+
+
+class BatchUploadTests(FakeQiniuMixin, TestCase):
+    """批量上传：逐个文件返回成功或失败、文件数上限和按批大小放宽的阶段超时（七牛云使用替身，AI 阶段替换为假实现）"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user('batch', 'batch@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for patcher in (
+            mock.patch('images.pipeline.image_classification', return_value={'category_id': 2}),
+            mock.patch('images.pipeline.ai_image_batch_with_scores', side_effect=self.tag_batch),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tag_delay = 0
+
+    def tag_batch(self, images):
+        time.sleep(self.tag_delay)
+        return [(['dog', 'cat'], '动物', [0.9, 0.1]) for _ in images]
+
+    def post(self, files):
+        return self.client.post('/api/v1/images/upload/batch/', {'images': files, 'title': 'batch'}, format='multipart')
+
+    def test_per_file_results(self):
+        import save
+
+        def upload(access_key, secret_key, bucket, data, key, metadata=None):
+            # 模拟单个文件上传七牛云失败
+            return False if key.endswith('_bad.jpg') else save.upload_data(access_key, secret_key, bucket, data, key, metadata)
+
+        same = jpeg_upload('a.jpg', (200, 30, 30))
+        files = [
+            jpeg_upload('a.jpg', (200, 30, 30)),
+            SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg'),
+            jpeg_upload('bad.jpg', (20, 130, 60)),
+            SimpleUploadedFile('copy.jpg', same.read(), content_type='image/jpeg'),
+        ]
+        with mock.patch('images.pipeline.upload_data', side_effect=upload):
+            response = self.post(files)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()['data']
+        self.assertEqual((data['succeeded'], data['failed']), (2, 2))
+        results = data['results']
+        self.assertEqual([result['code'] for result in results], [0, 1, 1, 0])
+        self.assertEqual([result['file_name'] for result in results], ['a.jpg', 'broken.jpg', 'bad.jpg', 'copy.jpg'])
+        self.assertIn('有效的图片', results[1]['message'])
+        self.assertIn('七牛云', results[2]['message'])
+        # 同一批次中相同内容的文件只分析、上传一次
+        self.assertEqual(results[3]['data']['image_url'], results[0]['data']['image_url'])
+        self.assertEqual(self.qiniu.store.requests.get('form'), 1)
+        self.assertEqual(results[0]['data']['tags'], ['dog', 'cat'])
+        self.assertEqual(results[0]['data']['category_id'], 2)
+
+    def test_all_files_failed(self):
+        response = self.post([SimpleUploadedFile('broken.jpg', b'x', content_type='image/jpeg')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['data']['failed'], 1)
+
+    def test_max_files(self):
+        files = [jpeg_upload(f'{i}.jpg', (i, i, i), size=(8, 8)) for i in range(settings.BATCH_UPLOAD_MAX_FILES + 1)]
+        response = self.post(files)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('images', response.json()['errors'])
+        self.assertEqual(self.qiniu.store.requests, {})
+
+    def test_deadlines_scale_with_batch_size(self):
+        from image_context import ImageContext
+        from .pipeline import analyze_and_upload_batch
+
+        def items(count):
+            return [(ImageContext.from_bytes(jpeg_upload(color=(i * 40, 0, 0)).read()), f'images/{i}.jpg')
+                    for i in range(count)]
+
+        # 批量推理耗时超过单张图片的标签阶段超时，但在按批大小放宽后的超时之内
+        self.tag_delay = 0.4
+        timeouts = {**settings.UPLOAD_STAGE_TIMEOUTS, 'tags': 0.2}
+        with override_settings(UPLOAD_STAGE_TIMEOUTS=timeouts, UPLOAD_STAGE_WORKERS=4):
+            results = analyze_and_upload_batch(items(3))
+            self.assertEqual([result['tags'] for result in results], [['dog', 'cat']] * 3)
+
+            results = analyze_and_upload_batch(items(1))
+            self.assertEqual(results[0]['tags'], ['未分类'])
+
+
+_stage_release = threading.Event()
+
+
+def _slow_stage(*args, **kwargs):
+    _stage_release.wait(5)
+    return {'category_id': 7}
+
+
+def _failing_stage(*args, **kwargs):
+    raise RuntimeError('stage crashed')
+
+
+class PipelineStageFaultTests(FakeQiniuMixin, SimpleTestCase):
+    """单个分析阶段超时或失败时，其余阶段的结果照常使用，失败的阶段取默认值，上传不受影响"""
+
+    def setUp(self):
+        super().setUp()
+        _stage_release.clear()
+        self.addCleanup(_stage_release.set)
+        self.reports = []
+        timeouts = {**settings.UPLOAD_STAGE_TIMEOUTS, 'colors': 0.3, 'classify': 0.3, 'tags': 0.3}
+        settings_patch = override_settings(UPLOAD_STAGE_TIMEOUTS=timeouts)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+
+    def patch_stages(self, **stages):
+        defaults = {
+            'extract_colors_with_colorthief': mock.Mock(return_value=[(200, 30, 30), (20, 20, 20)]),
+            'image_classification': mock.Mock(return_value={'category_id': 2}),
+            'ai_image_with_scores': mock.Mock(return_value=(['dog', 'cat'], '动物', [0.9, 0.1])),
+        }
+        defaults.update(stages)
+        for name, stage in defaults.items():
+            patcher = mock.patch(f'images.pipeline.{name}', stage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_pipeline(self, key):
+        from image_context import ImageContext
+        from .pipeline import analyze_and_upload
+
+        image_context = ImageContext.from_bytes(jpeg_upload(size=(32, 32)).read())
+        started = time.monotonic()
+        with self.assertLogs('images.pipeline', 'ERROR'):
+            result = analyze_and_upload(image_context, key, lambda stage, state: self.reports.append((stage, state)))
+        # 超时的阶段不会拖住整个流水线
+        self.assertLess(time.monotonic() - started, 3)
+        return result
+
+    def test_classify_timeout_and_tags_failure_fall_back(self):
+        self.patch_stages(image_classification=_slow_stage, ai_image_with_scores=_failing_stage)
+        result = self.run_pipeline('images/fault_a.jpg')
+
+        self.assertEqual(result['colors'], [(200, 30, 30), (20, 20, 20)])
+        self.assertIsNone(result['category_id'])
+        self.assertEqual((result['tags'], result['tag_scores']), (['未分类'], None))
+        for report in [('colors', 'done'), ('classify', 'timeout'), ('tags', 'failed'), ('upload', 'done')]:
+            self.assertIn(report, self.reports)
+        # 颜色仍随上传写入元数据，类别缺失时不写
+        meta = self.stored('images/fault_a.jpg')['x-qn-meta']
+        self.assertEqual(meta['color'], '(200,30,30),(20,20,20)')
+        self.assertNotIn('category', meta)
+
+    def test_colors_failure_and_tags_timeout_fall_back(self):
+        self.patch_stages(extract_colors_with_colorthief=_failing_stage, ai_image_with_scores=_slow_stage)
+        with mock.patch('images.pipeline.generate_variants', _failing_stage):
+            result = self.run_pipeline('images/fault_b.jpg')
+
+        self.assertEqual(result['colors'], [])
+        self.assertEqual(result['category_id'], 2)
+        self.assertEqual((result['tags'], result['tag_scores']), (['未分类'], None))
+        self.assertEqual(result['variants'], {})
+        for report in [('colors', 'failed'), ('classify', 'done'), ('tags', 'timeout'), ('variants', 'failed')]:
+            self.assertIn(report, self.reports)
+        meta = self.stored('images/fault_b.jpg')['x-qn-meta']
+        self.assertEqual(meta['category'], '2')
+        self.assertNotIn('color', meta)
+
+
+@skipUnless(connection.vendor == 'sqlite', "只在 SQLite（FTS5）上运行")
+class ImageSearchTests(TestCase):
+    """全文检索：标题、标签和类别命中，中文子串，信号增量更新，可见范围和重建命令"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Image
+
+        cls.user = CustomUser.objects.create_user('searcher', 'searcher@example.com', 'pw')
+        cls.other = CustomUser.objects.create_user('stranger', 'stranger@example.com', 'pw')
+        # 通过 create 保存，post_save 信号写入索引
+        cls.sunset = Image.objects.create(title='海边日落', tags=json.dumps(['seashore', 'sandbar']), category_id=0,
+                                          user=cls.user, image_url='http://x/1', is_public=True)
+        cls.dog = Image.objects.create(title='My dog', tags=json.dumps(['golden retriever']), category_id=2,
+                                       user=cls.user, image_url='http://x/2')
+        cls.pets = Image.objects.create(title='pets', tags=json.dumps(['tabby cat', 'dog']), category_id=2,
+                                        user=cls.user, image_url='http://x/3')
+        cls.other_private = Image.objects.create(title='dog', tags='[]', user=cls.other, image_url='http://x/4')
+        cls.other_public = Image.objects.create(title='dog', tags='[]', user=cls.other, image_url='http://x/5',
+                                                is_public=True)
+
+    def ids(self, query, scope=None):
+        from .search import search
+
+        return [image_id for image_id, _ in search(query, scope or ("img.user_id = %s", [self.user.id]), limit=10)]
+
+    def test_title_tag_and_category_hits(self):
+        self.assertEqual(set(self.ids('dog')), {self.dog.id, self.pets.id})
+        self.assertEqual(self.ids('retriever'), [self.dog.id])
+        self.assertEqual(set(self.ids('动物')), {self.dog.id, self.pets.id})
+        self.assertEqual(self.ids('风景'), [self.sunset.id])
+        self.assertEqual(self.ids('giraffe'), [])
+
+    def test_more_matching_terms_rank_first(self):
+        from .search import search
+
+        hits = search('cat dog', ("img.user_id = %s", [self.user.id]), limit=10)
+        self.assertEqual(hits[0][0], self.pets.id)
+        self.assertEqual([image_id for image_id, _ in hits], [self.pets.id, self.dog.id])
+        self.assertGreater(hits[0][1], hits[1][1])
+
+    def test_cjk_substrings(self):
+        for query in ('日落', '海边', '海', '边日'):
+            with self.subTest(query=query):
+                self.assertEqual(self.ids(query), [self.sunset.id])
+        self.assertEqual(self.ids('日出'), [])
+
+    def test_signals_update_index(self):
+        from .models import Image
+
+        self.dog.title = 'My puppy'
+        self.dog.save()
+        self.assertEqual(self.ids('puppy'), [self.dog.id])
+        self.assertEqual(self.ids('dog'), [self.pets.id])
+
+        image = Image.objects.create(title='新的照片', tags='[]', user=self.user, image_url='http://x/6')
+        self.assertEqual(self.ids('照片'), [image.id])
+        image.delete()
+        self.assertEqual(self.ids('照片'), [])
+
+    def test_scope_hides_other_users_private_images(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        public = client.get('/api/v1/images/search/', {'q': 'dog', 'is_public': 'true'}).json()['data']['results']
+        self.assertEqual([result['id'] for result in public], [self.other_public.id])
+
+        own = client.get('/api/v1/images/search/', {'q': 'dog'}).json()['data']['results']
+        self.assertEqual({result['id'] for result in own}, {self.dog.id, self.pets.id})
+        self.assertTrue(all('score' in result for result in own))
+
+        anonymous = APIClient().get('/api/v1/images/search/', {'q': 'dog'})
+        self.assertEqual(anonymous.status_code, 401)
+
+    def test_rebuild_command(self):
+        from .search import TABLE
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE}")
+            # 已删除图片残留的索引行
+            cursor.execute(f"INSERT INTO {TABLE} (rowid, content) VALUES (%s, %s)", [999999, 'dog'])
+        self.assertEqual(self.ids('retriever'), [])
+
+        out = io.StringIO()
+        call_command('rebuild_search_index', batch_size=2, stdout=out)
+        self.assertIn('5', out.getvalue())
+        self.assertEqual(self.ids('retriever'), [self.dog.id])
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {TABLE}")
+            self.assertEqual(cursor.fetchone()[0], 5)
+
+
+class KeysetPaginationTests(TestCase):
+    """游标分页：前后翻页往返、created_at 相同时按 id 定序、升序、with_total 和无效游标"""
+
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Image
+
+        cls.user = CustomUser.objects.create_user('pager', 'pager@example.com', 'pw')
+        other = CustomUser.objects.create_user('pager2', 'pager2@example.com', 'pw')
+        base = timezone.now() - timedelta(days=1)
+        # 第 1-3 张和第 5-6 张的创建时间相同，分页边界落在它们中间
+        offsets = [0, 1, 1, 1, 2, 3, 3]
+        images = [Image.objects.create(title=f'p{i}', image_url='http://x', user=cls.user, is_public=i % 2 == 0)
+                  for i in range(len(offsets))]
+        for image, offset in zip(images, offsets):
+            Image.objects.filter(id=image.id).update(created_at=base + timedelta(minutes=offset))
+        images = Image.objects.filter(user=cls.user)
+        cls.expected = [image.id for image in sorted(images, key=lambda image: (image.created_at, image.id), reverse=True)]
+        cls.public_other = Image.objects.create(title='o', image_url='http://x', user=other, is_public=True)
+        Image.objects.create(title='o', image_url='http://x', user=other, is_public=False)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url='/api/v1/images/', **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, **params):
+        pages = []
+        body = self.get(pagination='cursor', page_size=2, **params)
+        self.assertIsNone(body['previous'])
+        while True:
+            pages.append([image['id'] for image in body['results']])
+            if body['next'] is None:
+                return pages, body
+            body = self.get(body['next'])
+
+    def test_forward_and_backward_round_trip(self):
+        pages, last = self.walk()
+        self.assertEqual(pages, [self.expected[i:i + 2] for i in range(0, len(self.expected), 2)])
+
+        backward = []
+        body = last
+        while body['previous'] is not None:
+            body = self.get(body['previous'])
+            backward.append([image['id'] for image in body['results']])
+        self.assertEqual(backward, pages[-2::-1])
+        # 回到第一页后再向后翻，与第一次翻页的结果一致
+        self.assertEqual([image['id'] for image in self.get(body['next'])['results']], pages[1])
+
+    def test_ascending_ordering(self):
+        pages, _ = self.walk(ordering='created_at')
+        self.assertEqual(sum(pages, []), self.expected[::-1])
+
+    def test_public_feed(self):
+        anonymous = APIClient()
+        body = anonymous.get('/api/v1/images/', {'pagination': 'cursor', 'is_public': 'true', 'page_size': 50}).json()
+        ids = [image['id'] for image in body['results']]
+        self.assertIn(self.public_other.id, ids)
+        self.assertEqual(len(ids), 5)
+
+    def test_with_total(self):
+        body = self.get(pagination='cursor', page_size=2, with_total='true')
+        self.assertEqual((body['total'], body['total_is_approximate']), (7, True))
+        # 翻页链接中不再带 with_total，后续页不重复计数
+        self.assertNotIn('with_total', body['next'])
+        self.assertNotIn('total', self.get(body['next']))
+
+    def test_malformed_cursor_is_404(self):
+        import base64
+
+        def b64(payload):
+            return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+        for cursor in ('abc', '!!!', b64('not json'), b64('[1, 2]'), b64('{"c": "2024-01-01"}'),
+                       b64('{"c": "yesterday", "i": 1}')):
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/api/v1/images/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_cursor_round_trip(self):
+        from .pagination import decode_cursor, encode_cursor
+
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42, reverse=True)), (created_at, 42, True))
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 7)), (created_at, 7, False))
+
+
+class UploadDeduplicationTests(FakeQiniuMixin, TestCase):
+    """内容去重：相同字节的图片复用已有的七牛云对象和分析结果，不再调用七牛云和 VLM"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user('dedup', 'dedup@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patchers = [
+            mock.patch('images.pipeline.image_classification', return_value={'category_id': 2}),
+            mock.patch('images.pipeline.ai_image_with_scores', return_value=(['dog', 'cat'], '动物', [0.9, 0.1])),
+        ]
+        self.classify, self.tag = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def upload(self, upload_file, client=None, title='t'):
+        response = (client or self.client).post('/api/v1/images/upload/', {'image': upload_file, 'title': title},
+                                                format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['data']
+
+    def test_identical_bytes_reuse_analysis(self):
+        from .models import Image
+
+        data = jpeg_upload('a.jpg').read()
+        first = self.upload(SimpleUploadedFile('a.jpg', data, content_type='image/jpeg'))
+        self.assertEqual(self.qiniu.store.requests, {'form': 1})
+        self.assertEqual(self.classify.call_count, 1)
+
+        # 其他用户用不同的文件名上传相同内容
+        other = APIClient()
+        other.force_authenticate(CustomUser.objects.create_user('dedup2', 'dedup2@example.com', 'pw'))
+        second = self.upload(SimpleUploadedFile('renamed.jpg', data, content_type='image/jpeg'), other, 'again')
+        self.assertEqual(self.qiniu.store.requests, {'form': 1})
+        self.assertEqual((self.classify.call_count, self.tag.call_count), (1, 1))
+
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertEqual(second['title'], 'again')
+        for field in ('image_url', 'category_id', 'colors', 'tags_list'):
+            self.assertEqual(second[field], first[field], field)
+        self.assertNotIn('content_hash', second)
+        hashes = Image.objects.filter(id__in=[first['id'], second['id']]).values_list('content_hash', flat=True)
+        self.assertEqual(set(hashes), {hashlib.sha256(data).hexdigest()})
+        self.assertEqual(list(Image.objects.get(id=second['id']).tag_links.values_list('confidence', flat=True)),
+                         [0.9, 0.1])
+
+    def test_different_bytes_are_analyzed(self):
+        from .models import Image
+
+        first = self.upload(jpeg_upload('a.jpg', (200, 30, 30)))
+        second = self.upload(jpeg_upload('a.jpg', (20, 130, 60)))
+        self.assertEqual(self.qiniu.store.requests, {'form': 2})
+        self.assertEqual((self.classify.call_count, self.tag.call_count), (2, 2))
+        self.assertNotEqual(second['image_url'], first['image_url'])
+        hashes = Image.objects.filter(id__in=[first['id'], second['id']]).values_list('content_hash', flat=True)
+        self.assertEqual(len(set(hashes)), 2)
+
+
+
+class HashingUploadHandlerTests(SimpleTestCase):
+    """HashingUploadHandler：按阈值在内存和临时文件之间切换，流式计算的哈希与整体计算一致"""
+
+    THRESHOLD = 100 * 1024
+
+    def parse(self, data):
+        from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+        from django.test import RequestFactory
+
+        from .upload_handlers import HashingUploadHandler
+
+        request = RequestFactory().post('/api/v1/images/upload/', {
+            'image': SimpleUploadedFile('big.bin', data, content_type='application/octet-stream'),
+        })
+        with override_settings(UPLOAD_MEMORY_THRESHOLD=self.THRESHOLD):
+            request.upload_handlers = [HashingUploadHandler(request)]
+        uploaded = request.FILES['image']
+        self.addCleanup(uploaded.close)
+        self.assertIsInstance(uploaded, (InMemoryUploadedFile, TemporaryUploadedFile))
+        self.assertEqual(uploaded.size, len(data))
+        self.assertEqual(uploaded.read(), data)
+        self.assertEqual(uploaded.content_hash, hashlib.sha256(data).hexdigest())
+        return uploaded
+
+    def test_small_upload_stays_in_memory(self):
+        from django.core.files.uploadedfile import InMemoryUploadedFile
+
+        # 恰好等于阈值时不转存
+        for size in (1, self.THRESHOLD):
+            uploaded = self.parse(os.urandom(size))
+            self.assertIsInstance(uploaded, InMemoryUploadedFile, size)
+
+    def test_large_upload_spills_to_temp_file(self):
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+
+        # 超过阈值的上传跨越多个 64KB 分块，转存前已接收的数据也要写进临时文件
+        for size in (self.THRESHOLD + 1, 3 * self.THRESHOLD + 12345):
+            uploaded = self.parse(os.urandom(size))
+            self.assertIsInstance(uploaded, TemporaryUploadedFile, size)
+            self.assertTrue(os.path.exists(uploaded.temporary_file_path()))
+
+
+class _TinyWeights:
+    """替代 torchvision 权重对象：只提供 prepare 用到的输入尺寸和名称"""
+
+    class _Transforms:
+        crop_size = [8]
+
+    def transforms(self):
+        return self._Transforms()
+
+    def __str__(self):
+        return 'Tiny.TEST'
+
+
+class InferenceBackendCheckTests(SimpleTestCase):
+    """推理后端的 top-5 精度校验：用小模型导出 TorchScript，结果偏离 FP32 时回退到 eager"""
+
+    def setUp(self):
+        import torch
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        patcher = mock.patch('inference_backends.CACHE_DIR', cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache_dir = cache_dir
+
+        torch.manual_seed(0)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 8 * 8, 20)).eval()
+
+    def checks(self):
+        return [name for name in os.listdir(self.cache_dir) if name.endswith('.check.json')]
+
+    def test_backend_within_tolerance_is_used(self):
+        import inference_backends
+
+        runner, _, backend = inference_backends.prepare('tiny', _TinyWeights(), self.model, backend='torchscript')
+        self.assertEqual(backend, 'torchscript')
+        self.assertIsNot(runner, self.model)
+        (check,) = self.checks()
+        with open(os.path.join(self.cache_dir, check), encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['top5_agreement'], 1.0)
+
+    def test_backend_outside_tolerance_falls_back_to_eager(self):
+        import inference_backends
+
+        extension, export, load = inference_backends._EXPORTERS['torchscript']
+
+        def load_diverging(path):
+            # 取反后的输出 top-5 与原模型完全不重合
+            runner = load(path)
+            return lambda batch: -runner(batch)
+
+        with mock.patch.dict(inference_backends._EXPORTERS, {'torchscript': (extension, export, load_diverging)}):
+            with mock.patch('inference_backends._check', wraps=inference_backends._check) as check:
+                runner, size_bytes, backend = inference_backends.prepare(
+                    'tiny', _TinyWeights(), self.model, backend='torchscript'
+                )
+                self.assertEqual((runner, backend), (self.model, 'eager'))
+                self.assertEqual(size_bytes, inference_backends._module_size(self.model))
+                self.assertEqual(check.call_count, 1)
+
+                # 校验结果随导出文件缓存，再次准备时直接拒绝，不重复校验
+                runner, _, backend = inference_backends.prepare('tiny', _TinyWeights(), self.model, backend='torchscript')
+                self.assertEqual((runner, backend), (self.model, 'eager'))
+                self.assertEqual(check.call_count, 1)
+
+        (check_file,) = self.checks()
+        with open(os.path.join(self.cache_dir, check_file), encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['top5_agreement'], 0.0)
+
+    def test_threshold_is_configurable(self):
+        import inference_backends
+
+        with mock.patch('inference_backends.MIN_TOP5_AGREEMENT', 1.01):
+            runner, _, backend = inference_backends.prepare('tiny', _TinyWeights(), self.model, backend='torchscript')
+        self.assertEqual((runner, backend), (self.model, 'eager'))
+
+
+def _pool_model():
+    """推理进程池测试用的小模型：输入含 NaN 时直接退出所在进程，模拟推理进程崩溃"""
+    import torch
+
+    class PoolModel(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.linear = torch.nn.Linear(3 * 8 * 8, 20)
+
+        def forward(self, batch_tensor):
+            if torch.isnan(batch_tensor).any():
+                os._exit(1)
+            return self.linear(batch_tensor.flatten(1))
+
+    torch.manual_seed(0)
+    return PoolModel().eval()
+
+
+def _run_inference_pool(socket_path, model):
+    """在子进程中运行推理进程池，模型换成 fork 之前预加载的小模型"""
+    from multiprocessing import resource_tracker
+
+    import inference_pool
+    from model_registry import registry
+
+    # 实际部署时推理进程池与 web 进程各有自己的 resource_tracker，fork 出来的进程池换用新的
+    tracker = resource_tracker.ResourceTracker()
+    resource_tracker._resource_tracker = tracker
+    for name in ('ensure_running', 'register', 'unregister'):
+        setattr(resource_tracker, name, getattr(tracker, name))
+
+    registry._preloaded[('tiny', 'DEFAULT', 'cpu')] = (model, _TinyWeights())
+    inference_pool.serve(socket_path, processes=1, threads=1, model_names=('tiny',))
+
+
+class InferencePoolTests(SimpleTestCase):
+    """本地推理进程池：结果与当前进程推理一致，成功、推理失败和推理进程崩溃时共享内存都被释放"""
+
+    def setUp(self):
+        import multiprocessing
+        from multiprocessing.shared_memory import SharedMemory
+
+        import inference_pool
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        socket_path = os.path.join(tmp_dir, 'inference.sock')
+        self.model = _pool_model()
+
+        # 进程池还要再 fork 推理进程，不能是 daemon 进程
+        process = multiprocessing.get_context('fork').Process(target=_run_inference_pool, args=(socket_path, self.model))
+        process.start()
+        self.addCleanup(process.join, 15)
+        self.addCleanup(process.terminate)
+        deadline = time.monotonic() + 15
+        while not os.path.exists(socket_path):
+            self.assertTrue(process.is_alive() and time.monotonic() < deadline, '推理进程池未启动')
+            time.sleep(0.05)
+
+        # 记录客户端创建的共享内存段
+        self.segments = []
+
+        def create_segment(*args, **kwargs):
+            shm = SharedMemory(*args, **kwargs)
+            self.segments.append(shm.name)
+            return shm
+
+        for patcher in (
+            mock.patch.multiple(inference_pool, SOCKET_PATH=socket_path, AUTHKEY=b'', POOL_MODE='auto',
+                                _retry_after=0.0, TIMEOUT=10),
+            mock.patch('inference_pool.SharedMemory', side_effect=create_segment),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(inference_pool._drop_connection)
+
+    def assertSegmentsReleased(self):
+        from multiprocessing.shared_memory import SharedMemory
+
+        self.assertTrue(self.segments)
+        for name in self.segments:
+            with self.assertRaises(FileNotFoundError, msg=name):
+                SharedMemory(name=name)
+
+    def test_results_match_in_process_inference(self):
+        import torch
+
+        import inference_pool
+        from inference_batcher import run_topk
+
+        batch = torch.randn(3, 3, 8, 8, generator=torch.Generator().manual_seed(1))
+        results = inference_pool.infer('tiny', 'DEFAULT', batch, top_k=5)
+        expected = run_topk(self.model, batch, 5)
+        self.assertEqual(len(results), 3)
+        for result, row in zip(results, expected):
+            self.assertEqual([index for index, _ in result], [index for index, _ in row])
+            for (_, prob), (_, expected_prob) in zip(result, row):
+                self.assertAlmostEqual(prob, expected_prob, places=5)
+        self.assertSegmentsReleased()
+
+    def test_segments_released_when_inference_fails(self):
+        import torch
+
+        import inference_pool
+
+        # 输入尺寸与模型不符，推理进程返回错误
+        with self.assertRaises(inference_pool.InferencePoolError):
+            inference_pool.infer('tiny', 'DEFAULT', torch.zeros(1, 3, 4, 4))
+        self.assertSegmentsReleased()
+
+    def test_segments_released_when_worker_crashes(self):
+        import torch
+
+        import inference_pool
+
+        with self.assertRaises(inference_pool.InferencePoolError):
+            inference_pool.infer('tiny', 'DEFAULT', torch.full((1, 3, 8, 8), float('nan')))
+        self.assertSegmentsReleased()
+
+        # 推理进程由进程池重新启动，重新连接后继续可用
+        self.assertEqual(len(inference_pool.infer('tiny', 'DEFAULT', torch.zeros(2, 3, 8, 8))), 2)
+        self.assertSegmentsReleased()
+
+
+# reanalyze 测试中记录工作进程处理过的图片 id 的文件（fork 出来的工作进程继承该值）
+_REANALYZE_LOG = None
+
+
+def _stub_analyze_batch(items, stages, api_key):
+    """替代 reanalyze.analyze_batch：不下载图片，把 id 写入记录文件，颜色写成 [[id, 0, 0]]；第一批处理得最慢"""
+    if items[0][0] == _stub_analyze_batch.first_id:
+        time.sleep(0.3)
+    with open(_REANALYZE_LOG, 'a', encoding='utf-8') as f:
+        f.write(''.join(f'{image_id}\n' for image_id, _ in items))
+    return [(image_id, {'colors': [[image_id, 0, 0]]}, None) for image_id, _ in items]
+
+
+class ReanalyzeCommandTests(TestCase):
+    """reanalyze 命令：--limit 中断后从检查点继续、不重复处理，以及多个工作进程乱序完成时检查点的推进"""
+
+    def setUp(self):
+        global _REANALYZE_LOG
+        from .models import Image
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        self.checkpoint = os.path.join(tmp_dir, 'reanalyze.checkpoint.json')
+        _REANALYZE_LOG = os.path.join(tmp_dir, 'processed.log')
+        open(_REANALYZE_LOG, 'w').close()
+
+        user = CustomUser.objects.create_user('reanalyze', 'reanalyze@example.com', 'pw')
+        self.ids = [Image.objects.create(title=f'{i}', image_url=f'http://x/{i}', user=user).id for i in range(10)]
+        _stub_analyze_batch.first_id = self.ids[0]
+        self.stub = mock.patch('images.management.commands.reanalyze.analyze_batch', _stub_analyze_batch)
+        self.stub.start()
+        self.addCleanup(self.stub.stop)
+
+    def reanalyze(self, **options):
+        options.setdefault('stages', 'colors')
+        call_command('reanalyze', batch_size=2, checkpoint=self.checkpoint,
+                     stdout=io.StringIO(), stderr=io.StringIO(), **options)
+        with open(self.checkpoint, encoding='utf-8') as f:
+            return json.load(f)
+
+    def processed(self):
+        with open(_REANALYZE_LOG, encoding='utf-8') as f:
+            return [int(line) for line in f]
+
+    def assertColorsWritten(self, ids):
+        from .models import Image
+
+        colors = dict(Image.objects.values_list('id', 'colors'))
+        self.assertEqual({image_id for image_id, value in colors.items() if value}, set(ids))
+        for image_id in ids:
+            self.assertEqual(colors[image_id], [[image_id, 0, 0]])
+
+    def test_limit_then_resume_from_checkpoint(self):
+        state = self.reanalyze(limit=4, workers=1)
+        self.assertEqual((state['last_id'], state['processed']), (self.ids[3], 4))
+        self.assertEqual(self.processed(), self.ids[:4])
+        self.assertColorsWritten(self.ids[:4])
+
+        state = self.reanalyze(workers=1)
+        self.assertEqual((state['last_id'], state['processed'], state['failed']), (self.ids[-1], 10, 0))
+        # 两次运行合计每张图片只处理一次
+        self.assertEqual(self.processed(), self.ids)
+        self.assertColorsWritten(self.ids)
+
+        # 全部完成后再次执行不再处理任何图片
+        self.reanalyze(workers=1)
+        self.assertEqual(self.processed(), self.ids)
+
+    def test_parallel_workers_advance_checkpoint_in_order(self):
+        from images.management.commands.reanalyze import Checkpoint
+
+        saves = []
+        save = Checkpoint.save
+
+        def record_save(checkpoint):
+            saves.append((checkpoint.last_id, set(self.processed())))
+            save(checkpoint)
+
+        with mock.patch.object(Checkpoint, 'save', record_save):
+            state = self.reanalyze(limit=6, workers=3)
+        self.assertEqual((state['last_id'], state['processed']), (self.ids[5], 6))
+        self.assertEqual(sorted(self.processed()), self.ids[:6])
+        # 第一批最慢，后面的批次先完成；检查点只在前面的批次都完成后前移
+        self.assertEqual(saves[0][0], self.ids[5])
+        for last_id, done in saves:
+            self.assertLessEqual({image_id for image_id in self.ids if image_id <= last_id}, done)
+
+        state = self.reanalyze(workers=3)
+        self.assertEqual((state['last_id'], state['processed'], state['failed']), (self.ids[-1], 10, 0))
+        self.assertEqual(sorted(self.processed()), self.ids)
+        self.assertColorsWritten(self.ids)
+
+    def test_checkpoint_with_other_filters_is_rejected(self):
+        from django.core.management.base import CommandError
+
+        self.reanalyze(limit=2, workers=1)
+        with self.assertRaises(CommandError):
+            self.reanalyze(workers=1, category=3)
+
+    def test_failed_tag_inference_keeps_existing_tags(self):
+        from images.management.commands import reanalyze
+        from .models import Image, ImageTag
+        from .tags import replace_image_tags
+
+        Image.objects.update(tags=json.dumps(['Dog', 'Grass']))
+        replace_image_tags([(image_id, json.dumps(['Dog', 'Grass']), [0.8, 0.1]) for image_id in self.ids])
+        links = list(ImageTag.objects.order_by('image_id', 'rank').values_list('image_id', 'tag__name', 'confidence'))
+
+        # 远程和本机推理都失败时 ai_image_batch_with_scores 返回默认标签
+        fallback = lambda images, model_type='resnet50': [(['未分类'], '其他', [None]) for _ in images]
+        self.stub.stop()
+        with mock.patch.object(reanalyze, '_fetch', return_value=jpeg_upload().read()), \
+                mock.patch.object(reanalyze, 'ai_image_batch_with_scores', side_effect=fallback), \
+                mock.patch.object(reanalyze.registry, 'preload'):
+            state = self.reanalyze(stages='tags', workers=1)
+
+        self.assertEqual((state['processed'], state['failed']), (0, 10))
+        self.assertEqual(set(Image.objects.values_list('tags', flat=True)), {json.dumps(['Dog', 'Grass'])})
+        self.assertEqual(
+            list(ImageTag.objects.order_by('image_id', 'rank').values_list('image_id', 'tag__name', 'confidence')),
+            links,
+        )
+
+
+class ColorIndexTests(TestCase):
+    """按颜色找图：调色板距离排序、公开范围过滤，以及删除、公开状态修改和 bulk_create 对索引的更新"""
+
+    def setUp(self):
+        from .color_index import color_index
+
+        color_index.clear()
+        self.addCleanup(color_index.clear)
+        self.user = CustomUser.objects.create_user('colors', 'colors@example.com', 'pw')
+        self.other = CustomUser.objects.create_user('colors2', 'colors2@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create(self, title, colors, user=None, is_public=False):
+        from .models import Image
+
+        return Image.objects.create(title=title, image_url=f'http://x/{title}', user=user or self.user,
+                                    colors=colors, is_public=is_public)
+
+    def search(self, color, client=None, **params):
+        response = (client or self.client).get('/api/v1/images/by-color/', {'color': color, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']['results']
+
+    def public_hits(self, color='ff0000'):
+        from .color_index import PUBLIC, color_index
+
+        rgb = [int(color[i:i + 2], 16) for i in (0, 2, 4)]
+        return [image_id for image_id, _ in color_index.nearest(PUBLIC, [rgb], 10)]
+
+    def test_results_ordered_by_nearest_palette(self):
+        blue = self.create('blue', [[0, 0, 255], [0, 0, 120]])
+        red = self.create('red', [[250, 10, 10], [0, 0, 255]])
+        orange = self.create('orange', [[255, 140, 0]])
+        self.create('other', [[255, 0, 0]], user=self.other)
+
+        results = self.search('ff0000')
+        self.assertEqual([item['id'] for item in results], [red.id, orange.id, blue.id])
+        distances = [item['distance'] for item in results]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual([item['id'] for item in self.search('ff0000', limit=1)], [red.id])
+        # 返回的距离保留两位小数
+        nearby = self.search('ff0000', max_distance=distances[1] + 0.01)
+        self.assertEqual([item['id'] for item in nearby], [red.id, orange.id])
+
+        # 多个查询颜色取平均距离：红 + 蓝时两种颜色都有的图片最接近
+        self.assertEqual(self.search('ff0000,0000ff')[0]['id'], red.id)
+
+    def test_public_scope_excludes_private_images(self):
+        public = self.create('public', [[255, 0, 0]], user=self.other, is_public=True)
+        self.create('private', [[255, 0, 0]], user=self.other)
+        self.create('mine', [[255, 0, 0]])
+
+        anonymous = APIClient()
+        self.assertEqual([item['id'] for item in self.search('ff0000', anonymous, is_public='true')], [public.id])
+        self.assertEqual(self.public_hits(), [public.id])
+
+    def test_delete_and_visibility_changes_update_index(self):
+        from .models import Image
+
+        first = self.create('first', [[255, 0, 0]], is_public=True)
+        second = self.create('second', [[250, 0, 0]], is_public=True)
+        self.assertEqual(self.public_hits(), [first.id, second.id])
+
+        first.delete()
+        self.assertEqual(self.public_hits(), [second.id])
+
+        second.is_public = False
+        second.save()
+        self.assertEqual(self.public_hits(), [])
+        # 设为私有后仍在本人范围内
+        self.assertEqual([item['id'] for item in self.search('ff0000')], [second.id])
+
+        second.is_public = True
+        second.save()
+        self.assertEqual(self.public_hits(), [second.id])
+
+        # 不经过信号的修改（其他进程、queryset.update）在重建前不会更新索引，由视图按可见范围重新过滤
+        Image.objects.filter(id=second.id).update(is_public=False)
+        self.assertEqual(self.public_hits(), [second.id])
+        self.assertEqual(self.search('ff0000', APIClient(), is_public='true'), [])
+
+    def test_cold_load_does_not_block_signals_or_other_scopes(self):
+        from .color_index import PUBLIC, _Scope, color_index
+        from .models import Image
+
+        public = self.create('public', [[255, 0, 0]], user=self.other, is_public=True)
+        self.assertEqual(self.public_hits(), [public.id])
+        keep = self.create('keep', [[255, 0, 0]])
+        gone = self.create('gone', [[250, 0, 0]])
+
+        def concurrently():
+            # 其他范围的查询和保存/删除信号的处理
+            with mock.patch.object(_Scope, 'fetch_new'):
+                hits['public'] = color_index.nearest(PUBLIC, [[255, 0, 0]], 10)
+            color_index.remove(gone.id)
+            color_index.update(Image(id=gone.id + 100, user=self.user, colors=[[255, 10, 10]]))
+
+        hits = {}
+        load = _Scope.load
+
+        def slow_load(scope):
+            load(scope)
+            # 已从数据库读完、尚未换入时，其他线程的操作不应等待
+            thread = threading.Thread(target=concurrently)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive(), '加载期间全局锁被占用')
+
+        with mock.patch.object(_Scope, 'load', slow_load):
+            hits['user'] = color_index.nearest(self.user.id, [[255, 0, 0]], 10)
+
+        self.assertEqual([image_id for image_id, _ in hits['public']], [public.id])
+        # 加载期间的删除和新增在换入时重放
+        self.assertEqual([image_id for image_id, _ in hits['user']], [keep.id, gone.id + 100])
+
+    def test_bulk_created_rows_are_fetched(self):
+        from .models import Image
+
+        existing = self.create('existing', [[0, 0, 255]], is_public=True)
+        self.assertEqual(self.public_hits(), [existing.id])
+
+        # bulk_create 不触发 post_save，查询前按 id 读取新行
+        Image.objects.bulk_create([
+            Image(title='bulk-red', image_url='http://x/bulk-red', user=self.other, colors=[[255, 0, 0]], is_public=True),
+            Image(title='bulk-private', image_url='http://x/bulk-private', user=self.other, colors=[[255, 0, 0]]),
+        ])
+        bulk_red = Image.objects.get(title='bulk-red')
+        self.assertEqual(self.public_hits(), [bulk_red.id, existing.id])
+        self.assertEqual([item['id'] for item in self.search('ff0000', APIClient(), is_public='true')],
+                         [bulk_red.id, existing.id])
+
+
+class DerivativeTests(FakeQiniuMixin, SimpleTestCase):
+    """衍生图：存储路径命名、不超过原图的尺寸才生成，单个尺寸上传失败不影响其他尺寸"""
+
+    def context(self, size):
+        from image_context import ImageContext
+
+        buffer = io.BytesIO()
+        PILImage.new('RGB', size, (30, 120, 200)).save(buffer, 'JPEG')
+        return ImageContext.from_bytes(buffer.getvalue())
+
+    def test_variant_key(self):
+        from .derivatives import variant_key
+
+        with override_settings(IMAGE_VARIANT_FORMAT='webp'):
+            self.assertEqual(variant_key('images/123_a.jpg', 256), 'images/123_a_256w.webp')
+            self.assertEqual(variant_key('images/v1.2/a.b.png', 768), 'images/v1.2/a.b_768w.webp')
+            self.assertEqual(variant_key('images/raw', 1600), 'images/raw_1600w.webp')
+        self.assertEqual(variant_key('images/123_a.png', 256, 'jpeg'), 'images/123_a_256w.jpg')
+
+    def test_sizes_not_smaller_than_original_are_skipped(self):
+        from .derivatives import generate_variants, render_variants, variant_key
+
+        context = self.context((800, 600))
+        rendered = render_variants(context, sizes=[1600, 800, 256, 768], fmt='jpeg')
+        self.assertEqual(list(rendered), [256, 768])
+        for size, data in rendered.items():
+            with PILImage.open(io.BytesIO(data)) as img:
+                self.assertEqual((img.format, max(img.size)), ('JPEG', size))
+
+        with override_settings(IMAGE_VARIANT_SIZES=[256, 800, 1600], IMAGE_VARIANT_FORMAT='webp'):
+            variants = generate_variants(*self.credentials, context, 'images/1_a.jpg')
+        self.assertEqual(variants, {'256': f'{self.qiniu_host}/images/1_a_256w.webp'})
+        self.assertEqual(self.qiniu.store.requests, {'form': 1})
+        self.assertIsNone(self.stored(variant_key('images/1_a.jpg', 800, 'webp')))
+
+    def test_failed_size_leaves_other_sizes(self):
+        import requests
+
+        import save
+        from .derivatives import generate_variants
+
+        def upload_data(access_key, secret_key, bucket, data, key, metadata=None):
+            if key.endswith('_768w.webp'):
+                raise requests.ConnectionError('connection reset')
+            if key.endswith('_1600w.webp'):
+                return False
+            return save.upload_data(access_key, secret_key, bucket, data, key, metadata)
+
+        context = self.context((2000, 1500))
+        with override_settings(IMAGE_VARIANT_SIZES=[256, 768, 1200, 1600], IMAGE_VARIANT_FORMAT='webp'), \
+                mock.patch('images.derivatives.upload_data', side_effect=upload_data):
+            variants = generate_variants(*self.credentials, context, 'images/2_a.jpg')
+
+        self.assertEqual(variants, {
+            '256': f'{self.qiniu_host}/images/2_a_256w.webp',
+            '1200': f'{self.qiniu_host}/images/2_a_1200w.webp',
+        })
+        for size in (256, 1200):
+            info = self.stored(f'images/2_a_{size}w.webp')
+            self.assertEqual(info['mimeType'], 'image/webp')
+        for size in (768, 1600):
+            self.assertIsNone(self.stored(f'images/2_a_{size}w.webp'))
+
+
+def _tiny_loader(model_name, weights):
+    """替代 torchvision 的加载函数：返回随机初始化的小模型和 _TinyWeights"""
+    import torch
+
+    model = torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(3 * 8 * 8, 20))
+    _tiny_loader.calls.append(model_name)
+    return model, _TinyWeights()
+
+
+_tiny_loader.calls = []
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """模型注册表：fork 之前预加载（mmap 权重，清理旧指纹的缓存文件）、worker 中的预热、LRU 淘汰和并发加载去重"""
+
+    def setUp(self):
+        from model_registry import ModelRegistry
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        self.cache_dir = cache_dir
+        _tiny_loader.calls = []
+        for patcher in (
+            mock.patch('inference_backends.CACHE_DIR', cache_dir),
+            mock.patch('model_registry._default_loader', _tiny_loader),
+            mock.patch('model_registry.MMAP_WEIGHTS', True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.registry = ModelRegistry(memory_budget_mb=1)
+
+    def cached_files(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_preload_maps_weights_and_warm_up_reuses_them(self):
+        import torch
+
+        self.registry.preload(['tiny'])
+        (mmap_file,) = self.cached_files()
+        self.assertIn('-mmap-', mmap_file)
+        model, _ = self.registry._preloaded[('tiny', 'DEFAULT', 'cpu')]
+        saved = torch.load(os.path.join(self.cache_dir, mmap_file), weights_only=True)
+        for name, tensor in model.state_dict().items():
+            self.assertTrue(torch.equal(tensor, saved[name]), name)
+
+        with mock.patch.object(model, 'forward', wraps=model.forward) as forward:
+            self.registry.warm_up(['tiny'])
+        # 预热使用预加载的权重，不再调用加载函数，并用空白批次执行一次前向推理
+        self.assertEqual(_tiny_loader.calls, ['tiny'])
+        self.assertEqual(tuple(forward.call_args.args[0].shape), (1, 3, 8, 8))
+        entry = self.registry.get('tiny')
+        self.assertIs(entry.model, model)
+        self.assertEqual(entry.backend, 'eager')
+        self.assertEqual(self.registry.loaded_models(), [('tiny', 'DEFAULT', 'cpu')])
+
+    def test_new_fingerprint_prunes_old_mmap_files(self):
+        self.registry.preload(['tiny'])
+        first = self.cached_files()
+
+        # 权重变化（随机初始化的新模型）后重新预加载，旧指纹的文件被删除
+        self.registry.clear()
+        self.registry.preload(['tiny'])
+        second = self.cached_files()
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first, second)
+
+    def test_on_demand_load_does_not_write_mmap_files(self):
+        entry = self.registry.get('tiny')
+        self.assertEqual(entry.backend, 'eager')
+        self.assertEqual(self.cached_files(), [])
+
+    @staticmethod
+    def sized_loader(out_features):
+        """参数约 out_features * 400 字节的替身模型"""
+        import torch
+
+        def loader(model_name, weights):
+            _tiny_loader.calls.append(model_name)
+            return torch.nn.Sequential(torch.nn.Flatten(), torch.nn.Linear(99, out_features)), _TinyWeights()
+
+        return loader
+
+    def test_evicts_least_recently_used_over_budget(self):
+        # 预算 1MB，每个模型约 400KB，同时只能保留两个
+        loader = self.sized_loader(1000)
+        self.registry.get('a', loader=loader)
+        self.registry.get('b', loader=loader)
+        self.registry.get('a', loader=loader)
+        self.assertEqual(_tiny_loader.calls, ['a', 'b'])
+
+        self.registry.get('c', loader=loader)
+        self.assertEqual([key[0] for key in self.registry.loaded_models()], ['a', 'c'])
+        self.assertLessEqual(self.registry.memory_usage(), self.registry.memory_budget_bytes)
+
+        # 被淘汰的模型再次使用时重新加载
+        self.registry.get('b', loader=loader)
+        self.assertEqual(_tiny_loader.calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual([key[0] for key in self.registry.loaded_models()], ['c', 'b'])
+
+    def test_single_model_over_budget_is_kept(self):
+        entry = self.registry.get('huge', loader=self.sized_loader(3000))
+        self.assertGreater(entry.size_bytes, self.registry.memory_budget_bytes)
+        self.assertEqual(self.registry.loaded_models(), [('huge', 'DEFAULT', 'cpu')])
+
+    def test_concurrent_gets_load_once_per_key(self):
+        release = threading.Event()
+        entered = threading.Event()
+        sized = self.sized_loader(10)
+
+        def slow_loader(model_name, weights):
+            entered.set()
+            release.wait(5)
+            return sized(model_name, weights)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.registry.get('slow', loader=slow_loader)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        self.assertTrue(entered.wait(5))
+
+        # 一个模型加载期间，其他模型的加载不受影响
+        self.registry.get('other', loader=sized)
+        self.assertEqual(_tiny_loader.calls, ['other'])
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(_tiny_loader.calls, ['other', 'slow'])
+        self.assertTrue(all(entry is results[0] for entry in results))
+
+
+class _ScriptedAdapter:
+    """替代 requests 传输层的适配器：按顺序返回给定的状态码或抛出异常，可在 gate 上阻塞"""
+
+    def __init__(self, outcomes=(), gate=None):
+        self.outcomes = list(outcomes)
+        self.gate = gate
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        import requests
+
+        with self.lock:
+            self.calls.append((request.method, request.url))
+            outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if self.gate is not None:
+            self.gate.wait(5)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response.url = request.url
+        response.request = request
+        response._content = b'{}'
+        return response
+
+    def close(self):
+        pass
+
+
+class HttpClientTests(SimpleTestCase):
+    """出站 HTTP 客户端：只重试幂等请求、熔断的打开/半开/关闭，以及每个主机的并发上限（传输层替换为 _ScriptedAdapter）"""
+
+    def setUp(self):
+        import http_client
+
+        patcher = mock.patch.multiple(http_client, RETRIES=2, BACKOFF_BASE=0, BREAKER_THRESHOLD=100,
+                                      BREAKER_RESET=0.2, MAX_CONCURRENCY=2, ACQUIRE_TIMEOUT=0.2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = http_client.HttpClient()
+
+    def transport(self, *outcomes, gate=None):
+        adapter = _ScriptedAdapter(outcomes, gate)
+        session = self.client._get_session()
+        session.mount('http://', adapter)
+        return adapter
+
+    def circuit(self, host='upstream'):
+        return self.client.metrics()[host]['circuit']
+
+    def test_idempotent_requests_are_retried(self):
+        import requests
+
+        adapter = self.transport(503, requests.ConnectionError('reset'), 200)
+        self.assertEqual(self.client.get('http://upstream/a').status_code, 200)
+        self.assertEqual(len(adapter.calls), 3)
+        self.assertEqual(self.client.metrics()['upstream']['retries'], 2)
+
+        # 重试次数用尽后返回最后一次的响应或抛出最后一次的异常
+        adapter = self.transport(500, 502, 503)
+        self.assertEqual(self.client.request('PUT', 'http://upstream/b').status_code, 503)
+        self.assertEqual(len(adapter.calls), 3)
+        adapter = self.transport(*[requests.Timeout('slow')] * 3)
+        with self.assertRaises(requests.Timeout):
+            self.client.get('http://upstream/c')
+        self.assertEqual(len(adapter.calls), 3)
+
+        # 4xx（429 除外）不是上游故障，不重试
+        adapter = self.transport(404)
+        self.assertEqual(self.client.get('http://upstream/d').status_code, 404)
+        self.assertEqual(len(adapter.calls), 1)
+
+    def test_post_is_not_retried_unless_idempotent(self):
+        import requests
+
+        adapter = self.transport(503, 200)
+        self.assertEqual(self.client.post('http://upstream/a').status_code, 503)
+        self.assertEqual(len(adapter.calls), 1)
+
+        adapter = self.transport(requests.ConnectionError('reset'), 200)
+        with self.assertRaises(requests.ConnectionError):
+            self.client.post('http://upstream/a')
+        self.assertEqual(len(adapter.calls), 1)
+
+        adapter = self.transport(503, 200)
+        self.assertEqual(self.client.post('http://upstream/a', idempotent=True).status_code, 200)
+        self.assertEqual(len(adapter.calls), 2)
+
+    def test_circuit_opens_half_opens_and_closes(self):
+        import http_client
+
+        patcher = mock.patch('http_client.BREAKER_THRESHOLD', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        adapter = self.transport(500, 500, 500)
+        for _ in range(3):
+            self.assertEqual(self.client.post('http://upstream/a').status_code, 500)
+        self.assertEqual(self.circuit(), 'open')
+
+        # 打开期间直接拒绝，不发出请求；其他主机不受影响
+        with self.assertRaises(http_client.UpstreamUnavailable):
+            self.client.post('http://upstream/a')
+        self.assertEqual(len(adapter.calls), 3)
+        self.transport(200)
+        self.assertEqual(self.client.get('http://other/a').status_code, 200)
+
+        # 到达重置时间后半开，试探请求失败时重新打开
+        time.sleep(0.25)
+        self.assertEqual(self.circuit(), 'half_open')
+        adapter = self.transport(503)
+        self.assertEqual(self.client.post('http://upstream/a').status_code, 503)
+        self.assertEqual(self.circuit(), 'open')
+
+        # 半开状态只放行一个试探请求，试探成功后关闭
+        time.sleep(0.25)
+        gate = threading.Event()
+        adapter = self.transport(200, gate=gate)
+        probe = threading.Thread(target=self.client.post, args=('http://upstream/a',))
+        probe.start()
+        while not adapter.calls:
+            time.sleep(0.01)
+        with self.assertRaises(http_client.UpstreamUnavailable):
+            self.client.post('http://upstream/a')
+        gate.set()
+        probe.join(5)
+        self.assertEqual(self.circuit(), 'closed')
+        self.assertEqual(len(adapter.calls), 1)
+        self.assertEqual(self.client.metrics()['upstream']['rejected'], 2)
+
+    def test_per_host_concurrency_limit(self):
+        import http_client
+
+        gate = threading.Event()
+        adapter = self.transport(gate=gate)
+        threads = [threading.Thread(target=self.client.get, args=(f'http://slow/{i}',)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        while len(adapter.calls) < 2:
+            time.sleep(0.01)
+
+        # 达到上限后排队 ACQUIRE_TIMEOUT 秒仍拿不到名额，直接失败
+        started = time.monotonic()
+        with self.assertRaises(http_client.UpstreamUnavailable):
+            self.client.get('http://slow/2')
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(self.client.metrics()['slow']['in_flight'], 2)
+        # 排队失败不计入熔断，其他主机有各自的名额
+        self.assertEqual(self.circuit('slow'), 'closed')
+        with mock.patch.object(adapter, 'gate', None):
+            self.assertEqual(self.client.get('http://fast/a').status_code, 200)
+
+        gate.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(self.client.get('http://slow/3').status_code, 200)
+        self.assertEqual(self.client.metrics()['slow']['requests'], 3)
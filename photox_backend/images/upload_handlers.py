@@ -0,0 +1,60 @@
+# images/upload_handlers.py
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    边接收边计算 SHA-256 的上传处理器：
+    小于 UPLOAD_MEMORY_THRESHOLD 的文件只保存在内存中，超过阈值时才转存到临时文件。
+    生成的上传文件对象带有 content_hash 属性
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.threshold = settings.UPLOAD_MEMORY_THRESHOLD
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hasher = hashlib.sha256()
+        self.buffer = BytesIO()
+        self.temp_file = None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        if self.temp_file is None and start + len(raw_data) > self.threshold:
+            # 超过内存阈值，把已接收的数据转存到临时文件（请求结束时由 Django 关闭并删除）
+            self.temp_file = TemporaryUploadedFile(
+                self.file_name, self.content_type, 0, self.charset, self.content_type_extra
+            )
+            self.temp_file.write(self.buffer.getvalue())
+            self.buffer = None
+        if self.temp_file is not None:
+            self.temp_file.write(raw_data)
+        else:
+            self.buffer.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.temp_file is not None:
+            uploaded = self.temp_file
+            uploaded.flush()
+            uploaded.seek(0)
+            uploaded.size = file_size
+        else:
+            self.buffer.seek(0)
+            uploaded = InMemoryUploadedFile(
+                file=self.buffer,
+                field_name=self.field_name,
+                name=self.file_name,
+                content_type=self.content_type,
+                size=file_size,
+                charset=self.charset,
+                content_type_extra=self.content_type_extra,
+            )
+        uploaded.content_hash = self.hasher.hexdigest()
+        return uploaded
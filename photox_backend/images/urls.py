@@ -2,12 +2,28 @@
 app_name = 'images'
 
 from django.urls import path
-from .views import ImageUploadView, ImageListView, ImageDetailView
+from .views import (
+    ImageUploadView, ImageBatchUploadView, ImageListView, ImageSearchView, ImageByColorView, ImageDetailView,
+    UploadJobDetailView, ChunkedUploadCreateView, ChunkedUploadDetailView, ChunkedUploadFinalizeView, UpstreamMetricsView,
+    DirectUploadCreateView, DirectUploadDetailView, DirectUploadFinalizeView, DirectUploadCallbackView
+)
 
 urlpatterns = [
     path('upload/', ImageUploadView.as_view(), name='image-upload'),
+    path('upload/batch/', ImageBatchUploadView.as_view(), name='image-batch-upload'),
     path('', ImageListView.as_view(), name='image-list'),
+    path('search/', ImageSearchView.as_view(), name='image-search'),
+    path('by-color/', ImageByColorView.as_view(), name='image-by-color'),
     path('<int:image_id>/', ImageDetailView.as_view(), name='image-detail-delete'),
+    path('jobs/<uuid:job_id>/', UploadJobDetailView.as_view(), name='upload-job-detail'),
+    path('uploads/', ChunkedUploadCreateView.as_view(), name='chunked-upload-create'),
+    path('uploads/<uuid:upload_id>/', ChunkedUploadDetailView.as_view(), name='chunked-upload-detail'),
+    path('uploads/<uuid:upload_id>/finalize/', ChunkedUploadFinalizeView.as_view(), name='chunked-upload-finalize'),
+    path('direct-uploads/', DirectUploadCreateView.as_view(), name='direct-upload-create'),
+    path('direct-uploads/callback/', DirectUploadCallbackView.as_view(), name='direct-upload-callback'),
+    path('direct-uploads/<uuid:upload_id>/', DirectUploadDetailView.as_view(), name='direct-upload-detail'),
+    path('direct-uploads/<uuid:upload_id>/finalize/', DirectUploadFinalizeView.as_view(), name='direct-upload-finalize'),
+    path('metrics/upstreams/', UpstreamMetricsView.as_view(), name='upstream-metrics'),
 
 ]
 
@@ -1,13 +1,12 @@
 # views.py
 from django.conf import settings  # 导入 settings
-from django.core.files.storage import FileSystemStorage
 from django.shortcuts import render
 from django.http import HttpResponse
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.generics import ListAPIView
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser
@@ -17,14 +16,27 @@ import logging
 import traceback
 import os
 
-from ai_image import ai_image
 from .delete import delete_image_from_cloud
-from .models import Image
-from .serializers import ImageUploadSerializer, ImageSerializer
-from save import upload_and_set_metadata  # 七牛云上传工具
-from .tasks import ai_image_analysis
-from ai_classify import image_classification
-from color import extract_colors_with_colorthief
+from .chunked import ChunkError, abort_upload, create_upload, finalize_upload, write_chunk
+from .direct import DirectUploadError, create_direct_upload, finalize_direct_upload, handle_callback
+from .jobs import submit_upload_job
+from .models import ChunkedUpload, DirectUpload, Image, UploadJob
+from .color_index import PUBLIC, color_index
+from .pagination import KeysetPagination
+from .search import search as search_images
+from .tags import MAX_FILTER_TAGS, filter_by_tags, prefetch_tag_links
+from .pipeline import (
+    UploadPipelineError, analyze_and_upload, analyze_and_upload_batch, find_duplicate, find_duplicates,
+    make_object_key, save_image, save_images_bulk
+)
+from .upload_handlers import HashingUploadHandler
+from .serializers import (
+    ImageUploadSerializer, ImageBatchUploadSerializer, ImageSerializer, UploadJobSerializer,
+    ChunkedUploadCreateSerializer, ChunkedUploadSerializer, DirectUploadCreateSerializer, DirectUploadSerializer
+)
+from image_context import ImageContext
+from http_client import client as http_client
+from vlm_cache import cache as vlm_cache
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +47,17 @@ class ImageUploadView(APIView):
     permission_classes = [IsAuthenticated]  # 只有认证用户才能上传
     parser_classes = [MultiPartParser]  # 处理 multipart/form-data 请求
 
+    def initialize_request(self, request, *args, **kwargs):
+        # 使用边接收边计算哈希的上传处理器，小文件只保留在内存中
+        request.upload_handlers = [HashingUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    @staticmethod
+    def _wants_async(request):
+        """通过查询参数或表单字段 async=true 开启异步上传"""
+        value = request.query_params.get('async', request.data.get('async', ''))
+        return str(value).lower() in ('1', 'true')
+
     def post(self, request, *args, **kwargs):
         logger.info("开始处理图片上传请求...")
         try:
@@ -65,135 +88,52 @@ class ImageUploadView(APIView):
                 
             # 获取上传的图片文件
             image_file = request.FILES['image']
-            logger.info(f"接收到上传的图片: {image_file.name}, 大小: {image_file.size} 字节")
+            logger.info(f"接收到上传的图片: {image_file.name}, 大小: {image_file.size} 字节, SHA-256: {image_file.content_hash}")
             
-            # 正式处理逻辑
-            try:
-                # 使用 FileSystemStorage 保存文件，生成临时路径
-                fs = FileSystemStorage(location='/tmp')  # 存储到临时目录
-                tmp_file_path = fs.save(image_file.name, image_file)  # 保存到临时目录
-                tmp_file_path = fs.path(tmp_file_path)  # 获取文件的绝对路径
-                logger.info(f"图片已保存到临时路径: {tmp_file_path}")
-
-                # 使用原始图片名称或生成唯一文件名
-                safe_filename = os.path.basename(image_file.name).replace(' ', '_')
-                file_name = f"images/{str(time.time()).replace('.', '')}_{safe_filename}"
-                logger.info(f"在七牛云中的存储路径: {file_name}")
-
-                # 从环境变量获取七牛云的配置
-                access_key = settings.QINIU_ACCESS_KEY
-                secret_key = settings.QINIU_SECRET_KEY
-                bucket_name = settings.QINIU_BUCKET_NAME
-                api_key = "sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301"
-
-                colors = extract_colors_with_colorthief(tmp_file_path, num_colors=2)
-                result = image_classification(tmp_file_path, api_key)
-                category_id = result['category_id']
-                logger.info(f"七牛云配置信息 - Access Key: {access_key[:5]}..., Bucket: {bucket_name}")
-
-                if not all([access_key, secret_key, bucket_name]):
-                    logger.error("七牛云配置不完整")
-                    return Response({
-                        "code": 1,
-                        "message": "七牛云配置不完整，请配置环境变量"
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                # 尝试AI分析，如果失败则使用默认值
-                try:
-                    logger.info("开始AI分析图片...")
-                    tags, category = ai_image(tmp_file_path)
-                    logger.info(f"AI分析结果 - 标签: {tags}, 分类: {category}")
-                except Exception as e:
-                    logger.error(f"AI分析图片失败: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    tags = ["未分类"]
-                    category = "其他"
-                    logger.info("使用默认标签和分类")
-
-                 
+            # 使用原始图片名称或生成唯一文件名
+            file_name = make_object_key(image_file.name)
+            logger.info(f"在七牛云中的存储路径: {file_name}")
+            title = serializer.validated_data.get('title', '')
+            is_public = serializer.validated_data.get('is_public', False)
+            content_hash = image_file.content_hash
+            image_context = serializer.validated_data['image_context']
+
+            # 内容去重：相同内容已上传过时直接复用七牛云对象和分析结果，只新建数据库记录
+            analysis = find_duplicate(content_hash)
+            if analysis is not None:
+                image_context.close()
+                image = save_image(request.user, title, is_public, analysis, content_hash=content_hash)
+                logger.info(f"重复内容，已复用分析结果，图片ID: {image.id}")
+                return Response({
+                    "code": 0,
+                    "message": "图片上传成功",
+                    "data": ImageSerializer(image).data
+                }, status=status.HTTP_201_CREATED)
+
+            # 异步模式：图片落盘后立即返回任务ID，分析与上传在后台执行
+            if self._wants_async(request):
+                # 后台任务重新打开暂存文件，这里的上下文只用于校验格式
+                image_context.close()
+                job = submit_upload_job(request.user, image_file, file_name, title, is_public, content_hash)
+                return Response({
+                    "code": 0,
+                    "message": "图片已接收，正在后台处理",
+                    "data": UploadJobSerializer(job).data
+                }, status=status.HTTP_202_ACCEPTED)
 
-                # 上传图片到七牛云并获取外链 URL
+            # 正式处理逻辑：各阶段直接读取上传缓冲区（小文件在内存中，大文件在请求结束时自动删除的临时文件中）
+            try:
                 try:
-                    logger.info("开始上传图片到七牛云...")
-                    image_url = upload_and_set_metadata(
-                        access_key=access_key,
-                        secret_key=secret_key,
-                        bucket_name=bucket_name,
-                        file_path=tmp_file_path,  # 传递临时文件的绝对路径
-                        key=file_name,  # 七牛云中的路径+文件名
-                        category_id=category_id,  # 使用 category_id
-                        colors=colors  # 使用 colors
-                    )
-                    logger.info(f"上传结果 - URL: {image_url}")
-                except Exception as e:
-                    logger.error(f"上传到七牛云时发生异常: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    # 删除临时文件
-                    if os.path.exists(tmp_file_path):
-                        fs.delete(tmp_file_path)
-                    return Response({
-                        "code": 1,
-                        "message": f"上传到七牛云失败: {str(e)}"
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-                # 删除临时文件
-                logger.info("删除临时文件...")
-                if os.path.exists(tmp_file_path):
-                    fs.delete(tmp_file_path)
-
-                if not image_url:
-                    logger.error("图片URL为空")
+                    analysis = analyze_and_upload(image_context, file_name)
+                except UploadPipelineError as e:
                     return Response({
                         "code": 1,
-                        "message": "上传到七牛云失败，未获取到图片URL"
+                        "message": str(e)
                     }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
                 # 保存图片信息到数据库
                 try:
-                    logger.info("将图片信息保存到数据库...")
-                    image = Image.objects.create(
-                        image_url=image_url,
-                        title=serializer.validated_data.get('title', ''),
-                        tags=tags,
-                        user=request.user,  # 上传者为当前认证的用户
-                        is_public=serializer.validated_data.get('is_public', False),
-                        category_id=category_id,  # 使用 category_id
-                        colors=colors  # 添加颜色数据
-                    )
-                    logger.info(f"数据库保存成功，图片ID: {image.id}")
-
-                    # 自动创建对应类别的相册并添加图片
-                    try:
-                        # 获取类别名称
-                        category_map = {
-                            0: "风景", 1: "人物肖像", 2: "动物", 3: "交通工具", 4: "食品",
-                            5: "建筑", 6: "电子产品", 7: "运动器材", 8: "植物花卉", 9: "医疗用品",
-                            10: "办公用品", 11: "服装鞋帽", 12: "家具家居", 13: "书籍文档", 14: "艺术创作",
-                            15: "工业设备", 16: "体育赛事", 17: "天文地理", 18: "儿童玩具", 19: "美妆个护",
-                            20: "军事装备", 21: "宠物用品", 22: "健身器材", 23: "厨房用品", 24: "实验室器材",
-                            25: "音乐器材", 26: "户外装备", 27: "珠宝首饰", 28: "虚拟场景", 29: "其他"
-                        }
-                        category_name = category_map.get(category_id, "其他")
-
-                        # 查找或创建对应类别的相册
-                        from albums.models import Album
-                        album, created = Album.objects.get_or_create(
-                            title=f"{category_name}相册",
-                            user=request.user,
-                            defaults={
-                                'description': f'自动创建的{category_name}分类相册',
-                                'is_public': False
-                            }
-                        )
-
-                        # 将图片添加到相册
-                        album.images.add(image)
-                        logger.info(f"图片已添加到{category_name}相册")
-
-                    except Exception as e:
-                        logger.error(f"自动添加到相册失败: {str(e)}")
-                        logger.error(traceback.format_exc())
-                        # 这里我们不抛出异常，因为图片上传本身是成功的
+                    image = save_image(request.user, title, is_public, analysis, content_hash=content_hash)
 
                     # 构造成功响应
                     response_data = {
@@ -226,6 +166,109 @@ class ImageUploadView(APIView):
                 "message": f"服务器错误: {str(e)}"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ImageBatchUploadView(APIView):
+    permission_classes = [IsAuthenticated]  # 只有认证用户才能上传
+    parser_classes = [MultiPartParser]  # 处理 multipart/form-data 请求
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [HashingUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    # POST 请求，一次上传多张图片（表单字段 images 可重复），逐个返回结果
+    def post(self, request, *args, **kwargs):
+        serializer = ImageBatchUploadSerializer(data=request.data)
+        if not serializer.is_valid():
+            logger.warning(f"表单数据验证失败: {serializer.errors}")
+            return Response({
+                "code": 1,
+                "message": "表单数据验证失败",
+                "errors": serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        files = serializer.validated_data['images']
+        title = serializer.validated_data.get('title', '')
+        is_public = serializer.validated_data.get('is_public', False)
+        logger.info(f"用户 {request.user.username} 批量上传 {len(files)} 张图片")
+
+        results = [None] * len(files)
+        analyses = {}
+        # 已上传过的内容直接复用；同一批次中重复的内容只分析一次
+        duplicates = find_duplicates([image_file.content_hash for image_file in files])
+        first_index = {}
+        same_as = {}
+        pending = []
+        for index, image_file in enumerate(files):
+            try:
+                image_context = ImageContext.from_uploaded_file(image_file)
+            except Exception:
+                results[index] = self._error(index, image_file, "请上传一张有效的图片。您所上传的文件不是图片或者是已损坏的图片。")
+                continue
+            content_hash = image_file.content_hash
+            if content_hash in duplicates:
+                image_context.close()
+                analyses[index] = duplicates[content_hash]
+            elif content_hash in first_index:
+                image_context.close()
+                same_as[index] = first_index[content_hash]
+            else:
+                first_index[content_hash] = index
+                pending.append((index, image_context, make_object_key(image_file.name, suffix=index)))
+
+        if pending:
+            try:
+                batch_results = analyze_and_upload_batch([(context, key) for _, context, key in pending])
+            except UploadPipelineError as e:
+                return Response({
+                    "code": 1,
+                    "message": str(e)
+                }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            for (index, _, _), result in zip(pending, batch_results):
+                if isinstance(result, UploadPipelineError):
+                    results[index] = self._error(index, files[index], str(result))
+                else:
+                    analyses[index] = result
+        for index, source in same_as.items():
+            if source in analyses:
+                analyses[index] = analyses[source]
+            else:
+                results[index] = self._error(index, files[index], results[source]["message"])
+
+        saved_indexes = sorted(analyses)
+        try:
+            images = save_images_bulk(request.user, [
+                (title, is_public, analyses[index], files[index].content_hash) for index in saved_indexes
+            ])
+        except Exception as e:
+            logger.error(f"批量保存图片信息到数据库失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            return Response({
+                "code": 1,
+                "message": f"保存图片信息到数据库失败: {str(e)}"
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        for index, image in zip(saved_indexes, images):
+            results[index] = {
+                "index": index,
+                "file_name": files[index].name,
+                "code": 0,
+                "data": ImageSerializer(image).data
+            }
+
+        succeeded = len(saved_indexes)
+        return Response({
+            "code": 0 if succeeded else 1,
+            "message": f"批量上传完成：成功 {succeeded} 张，失败 {len(files) - succeeded} 张",
+            "data": {
+                "succeeded": succeeded,
+                "failed": len(files) - succeeded,
+                "results": results
+            }
+        }, status=status.HTTP_201_CREATED if succeeded else status.HTTP_400_BAD_REQUEST)
+
+    @staticmethod
+    def _error(index, image_file, message):
+        return {"index": index, "file_name": image_file.name, "code": 1, "message": message}
+
+
 class ImageListView(ListAPIView):
     serializer_class = ImageSerializer  # 使用已有的序列化器
 
@@ -237,6 +280,21 @@ class ImageListView(ListAPIView):
 
     pagination_class = CustomPagination
 
+    # 允许的排序方式（均由 Image 的复合索引支持）
+    ORDERING_FIELDS = ('-created_at', 'created_at')
+
+    @property
+    def paginator(self):
+        # pagination=cursor（或带 cursor 参数）时使用游标分页，不做 COUNT、不用 OFFSET，适合无限滚动；
+        # 默认仍是页码分页，兼容已有客户端
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_permissions(self):
         # 如果请求公开图片，不需要认证
         is_public = self.request.query_params.get('is_public', None)
@@ -256,6 +314,7 @@ class ImageListView(ListAPIView):
         if is_public is not None:
             # 将字符串转换为布尔值
             is_public = str(is_public).lower() == 'true'
+            # 按 (created_at, id) 顺序扫描复合索引，is_public 在索引内过滤（见 Image.Meta.indexes）
             if is_public:
                 # 如果是公开图片，返回所有公开的图片
                 queryset = queryset.filter(is_public=True)
@@ -272,15 +331,141 @@ class ImageListView(ListAPIView):
             else:
                 queryset = Image.objects.none()  # 未登录用户不能查看私有图片
 
-        # 获取排序参数
-        ordering = self.request.query_params.get('ordering', '-created_at')  # 默认按创建时间降序排序
-
-        return queryset.order_by(ordering)
+        # 按分类筛选，走 (user, category_id, created_at) 索引
+        category_id = self.request.query_params.get('category_id')
+        if category_id not in (None, ''):
+            try:
+                queryset = queryset.filter(category_id=int(category_id))
+            except ValueError:
+                raise ValidationError({'category_id': ['分类ID必须是整数']})
+
+        # 按标签筛选：tag 可重复或用逗号分隔，默认需包含全部标签，tag_match=any 时包含任一即可
+        tags = [tag for value in self.request.query_params.getlist('tag') for tag in value.split(',') if tag.strip()]
+        if tags:
+            if len(tags) > MAX_FILTER_TAGS:
+                raise ValidationError({'tag': [f"最多同时筛选 {MAX_FILTER_TAGS} 个标签"]})
+            tag_match = self.request.query_params.get('tag_match', 'all')
+            if tag_match not in ('all', 'any'):
+                raise ValidationError({'tag_match': ["可选: all, any"]})
+            queryset = filter_by_tags(queryset, tags, match_all=tag_match == 'all')
+
+        # 获取排序参数，只允许有索引支持的排序，避免大表上的文件排序
+        ordering = self.request.query_params.get('ordering') or '-created_at'  # 默认按创建时间降序排序
+        if ordering not in self.ORDERING_FIELDS:
+            raise ValidationError({'ordering': [f"不支持的排序方式，可选: {', '.join(self.ORDERING_FIELDS)}"]})
+
+        # id 作为第二排序字段，创建时间相同时顺序稳定
+        # 预取标签关联，序列化时不再逐行解析 tags 文本
+        queryset = queryset.prefetch_related(prefetch_tag_links())
+        return queryset.order_by(ordering, ordering.replace('created_at', 'id'))
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
+class ImageSearchView(APIView):
+    """全文检索图片标题、AI 标签和类别名称，按相关度排序"""
+    page_size = 10
+    max_page_size = 50
+
+    def get_permissions(self):
+        # 与图片列表一致：搜索公开图片不需要认证
+        if str(self.request.query_params.get('is_public', '')).lower() == 'true':
+            return []
+        return [IsAuthenticated()]
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"code": 1, "message": "请提供搜索关键词 q"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            page = max(1, int(request.query_params.get('page', 1)))
+            page_size = min(self.max_page_size, max(1, int(request.query_params.get('page_size', self.page_size))))
+        except ValueError:
+            return Response({"code": 1, "message": "page 和 page_size 必须是整数"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 可见范围与图片列表相同：公开图片、自己的私有图片或自己的全部图片
+        is_public = request.query_params.get('is_public', None)
+        if is_public is not None and str(is_public).lower() == 'true':
+            scope = ("img.is_public = %s", [True])
+        elif is_public is not None:
+            scope = ("img.user_id = %s AND img.is_public = %s", [request.user.id, False])
+        else:
+            scope = ("img.user_id = %s", [request.user.id])
+
+        # 多取一条判断是否还有下一页，不计算总数
+        hits = search_images(query, scope, limit=page_size + 1, offset=(page - 1) * page_size)
+        has_next = len(hits) > page_size
+        hits = hits[:page_size]
+        images = Image.objects.prefetch_related(prefetch_tag_links()).in_bulk([image_id for image_id, _ in hits])
+
+        results = []
+        for image_id, score in hits:
+            # 索引写入后图片可能已被删除
+            if image_id in images:
+                data = ImageSerializer(images[image_id]).data
+                data['score'] = score
+                results.append(data)
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": {"query": query, "page": page, "page_size": page_size, "has_next": has_next, "results": results}
+        }, status=status.HTTP_200_OK)
+
+
+class ImageByColorView(APIView):
+    """按颜色找图：在 Lab 空间中找调色板与查询颜色最接近的图片"""
+    max_colors = 5
+    default_limit = 20
+    max_limit = 100
+
+    def get_permissions(self):
+        # 与图片列表一致：查找公开图片不需要认证
+        if str(self.request.query_params.get('is_public', '')).lower() == 'true':
+            return []
+        return [IsAuthenticated()]
+
+    @staticmethod
+    def _parse_color(value):
+        value = value.strip().lstrip('#')
+        if len(value) != 6:
+            raise ValueError(value)
+        return [int(value[i:i + 2], 16) for i in (0, 2, 4)]
+
+    def get(self, request):
+        values = [value for param in request.query_params.getlist('color') for value in param.split(',') if value.strip()]
+        if not values or len(values) > self.max_colors:
+            return Response({"code": 1, "message": f"请提供 1-{self.max_colors} 个颜色，如 color=ff8800"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            colors = [self._parse_color(value) for value in values]
+            limit = min(self.max_limit, max(1, int(request.query_params.get('limit', self.default_limit))))
+            max_distance = request.query_params.get('max_distance')
+            max_distance = float(max_distance) if max_distance not in (None, '') else None
+        except ValueError:
+            return Response({"code": 1, "message": "颜色应为 6 位十六进制（如 ff8800），limit 和 max_distance 必须是数字"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # 公开图片，或当前用户自己的全部图片
+        public = str(request.query_params.get('is_public', '')).lower() == 'true'
+        hits = color_index.nearest(PUBLIC if public else request.user.id, colors, limit, max_distance)
+
+        # 按可见范围重新过滤：其他进程修改公开状态或删除图片后，本进程的索引可能短暂过期
+        queryset = Image.objects.filter(is_public=True) if public else Image.objects.filter(user=request.user)
+        images = queryset.prefetch_related(prefetch_tag_links()).in_bulk([image_id for image_id, _ in hits])
+        results = []
+        for image_id, distance in hits:
+            if image_id in images:
+                data = ImageSerializer(images[image_id]).data
+                data['distance'] = round(distance, 2)
+                results.append(data)
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": {"colors": ['#%02x%02x%02x' % tuple(color) for color in colors], "results": results}
+        }, status=status.HTTP_200_OK)
+
+
 class ImageDetailView(APIView):
     permission_classes = [IsAuthenticated]  # 需要认证
 
@@ -337,6 +522,7 @@ class ImageDetailView(APIView):
             raise PermissionDenied("You do not have permission to delete this image.")
 
         # # 删除图片文件（目前只实现了数据库的删除，七牛云上未删除）
+        # # 注意：相同内容的图片共享同一个七牛云对象，启用时需先确认没有其他记录引用
         # delete_image_from_cloud(image.image_url)
 
         # 删除图片记录
@@ -344,3 +530,280 @@ class ImageDetailView(APIView):
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+
+class UploadJobDetailView(APIView):
+    permission_classes = [IsAuthenticated]  # 需要认证
+
+    # GET 请求，查询异步上传任务的进度
+    def get(self, request, job_id):
+        try:
+            job = UploadJob.objects.select_related('image').get(id=job_id, user=request.user)
+        except UploadJob.DoesNotExist:
+            return Response({"code": 1, "message": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": UploadJobSerializer(job).data
+        }, status=status.HTTP_200_OK)
+
+
+class UpstreamMetricsView(APIView):
+    permission_classes = [IsAdminUser]  # 仅管理员
+
+    # GET 请求，查看当前 worker 进程访问各上游（VLM 接口、七牛云）的请求数、熔断状态和延迟，以及 VLM 缓存命中率
+    def get(self, request):
+        try:
+            cache_stats = vlm_cache.stats()
+        except Exception as e:
+            logger.error(f"读取 VLM 缓存统计失败: {str(e)}")
+            cache_stats = None
+
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": {"pid": os.getpid(), "hosts": http_client.metrics(), "vlm_cache": cache_stats}
+        }, status=status.HTTP_200_OK)
+
+
+class ChunkedUploadCreateView(APIView):
+    permission_classes = [IsAuthenticated]  # 只有认证用户才能上传
+
+    # POST 请求，创建分块上传会话
+    def post(self, request):
+        serializer = ChunkedUploadCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                "code": 1,
+                "message": "表单数据验证失败",
+                "errors": serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        upload = create_upload(request.user, **serializer.validated_data)
+        logger.info(f"用户 {request.user.username} 创建分块上传: {upload.id}, 大小: {upload.total_size} 字节")
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": ChunkedUploadSerializer(upload).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class ChunkedUploadDetailView(APIView):
+    permission_classes = [IsAuthenticated]  # 需要认证
+
+    @staticmethod
+    def _get_upload(request, upload_id):
+        return ChunkedUpload.objects.select_related('image').get(id=upload_id, user=request.user)
+
+    # GET 请求，查询已接收和缺失的区间（断点续传时使用）
+    def get(self, request, upload_id):
+        try:
+            upload = self._get_upload(request, upload_id)
+        except ChunkedUpload.DoesNotExist:
+            return Response({"code": 1, "message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": ChunkedUploadSerializer(upload).data
+        }, status=status.HTTP_200_OK)
+
+    # PUT 请求，上传一个分块：请求体为分块的原始字节，查询参数 offset 为分块在文件中的起始位置，
+    # 请求头 X-Chunk-SHA256 为分块的校验和
+    def put(self, request, upload_id):
+        try:
+            upload = self._get_upload(request, upload_id)
+        except ChunkedUpload.DoesNotExist:
+            return Response({"code": 1, "message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        checksum = request.headers.get('X-Chunk-SHA256', '')
+        if not checksum:
+            return Response({"code": 1, "message": "缺少分块校验和 (X-Chunk-SHA256)"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            offset = int(request.query_params.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({"code": 1, "message": "offset 参数无效"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            upload = write_chunk(upload, offset, length, request.stream, checksum)
+        except ChunkError as e:
+            logger.warning(f"分块上传失败: {upload.id} - {str(e)}")
+            return Response({"code": 1, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": ChunkedUploadSerializer(upload).data
+        }, status=status.HTTP_200_OK)
+
+    # DELETE 请求，放弃上传并删除暂存文件
+    def delete(self, request, upload_id):
+        try:
+            upload = self._get_upload(request, upload_id)
+        except ChunkedUpload.DoesNotExist:
+            return Response({"code": 1, "message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+        if upload.status == ChunkedUpload.STATUS_PROCESSING:
+            return Response({"code": 1, "message": "上传正在处理中"}, status=status.HTTP_409_CONFLICT)
+
+        abort_upload(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ChunkedUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]  # 需要认证
+
+    # POST 请求，所有分块上传完成后合并处理；async=true 时交给后台任务
+    def post(self, request, upload_id):
+        try:
+            upload = ChunkedUpload.objects.get(id=upload_id, user=request.user)
+        except ChunkedUpload.DoesNotExist:
+            return Response({"code": 1, "message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # 重复的 finalize 请求（如客户端超时重试）直接返回之前的结果
+        if upload.status == ChunkedUpload.STATUS_COMPLETED:
+            image, job = upload.image, upload.job
+        else:
+            try:
+                image, job = finalize_upload(upload, run_async=ImageUploadView._wants_async(request))
+            except ChunkError as e:
+                upload.refresh_from_db()
+                return Response({
+                    "code": 1,
+                    "message": str(e),
+                    "data": ChunkedUploadSerializer(upload).data
+                }, status=status.HTTP_409_CONFLICT)
+            except UploadPipelineError as e:
+                return Response({"code": 1, "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except Exception as e:
+                logger.error(f"分块上传处理失败: {str(e)}")
+                logger.error(traceback.format_exc())
+                return Response({"code": 1, "message": f"服务器内部错误: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if job is not None:
+            return Response({
+                "code": 0,
+                "message": "图片已接收，正在后台处理",
+                "data": UploadJobSerializer(job).data
+            }, status=status.HTTP_202_ACCEPTED)
+        return Response({
+            "code": 0,
+            "message": "图片上传成功",
+            "data": ImageSerializer(image).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class DirectUploadCreateView(APIView):
+    permission_classes = [IsAuthenticated]  # 只有认证用户才能上传
+
+    # POST 请求，创建直传会话并签发七牛云上传凭证，客户端拿到凭证后直接上传到七牛云
+    def post(self, request):
+        serializer = DirectUploadCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({
+                "code": 1,
+                "message": "表单数据验证失败",
+                "errors": serializer.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        upload, credentials = create_direct_upload(request.user, **serializer.validated_data)
+        logger.info(f"用户 {request.user.username} 创建直传会话: {upload.id}, 存储路径: {upload.key}")
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": {**DirectUploadSerializer(upload).data, **credentials}
+        }, status=status.HTTP_201_CREATED)
+
+
+class DirectUploadDetailView(APIView):
+    permission_classes = [IsAuthenticated]  # 需要认证
+
+    # GET 请求，查询直传会话的状态
+    def get(self, request, upload_id):
+        try:
+            upload = DirectUpload.objects.select_related('image').get(id=upload_id, user=request.user)
+        except DirectUpload.DoesNotExist:
+            return Response({"code": 1, "message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "code": 0,
+            "message": "Success",
+            "data": DirectUploadSerializer(upload).data
+        }, status=status.HTTP_200_OK)
+
+
+class DirectUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated]  # 需要认证
+
+    # POST 请求，客户端上传到七牛云完成后通知服务端分析入库；async=true 时交给后台任务
+    def post(self, request, upload_id):
+        try:
+            upload = DirectUpload.objects.get(id=upload_id, user=request.user)
+        except DirectUpload.DoesNotExist:
+            return Response({"code": 1, "message": "Upload not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        # 已由七牛云回调或之前的 finalize 请求处理过时直接返回结果
+        if upload.status == DirectUpload.STATUS_COMPLETED:
+            image, job = upload.image, upload.job
+        else:
+            try:
+                image, job = finalize_direct_upload(upload, run_async=ImageUploadView._wants_async(request))
+            except DirectUploadError as e:
+                upload.refresh_from_db()
+                return Response({
+                    "code": 1,
+                    "message": str(e),
+                    "data": DirectUploadSerializer(upload).data
+                }, status=status.HTTP_409_CONFLICT)
+            except UploadPipelineError as e:
+                return Response({"code": 1, "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            except Exception as e:
+                logger.error(f"直传图片处理失败: {str(e)}")
+                logger.error(traceback.format_exc())
+                return Response({"code": 1, "message": f"服务器内部错误: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        if job is not None:
+            return Response({
+                "code": 0,
+                "message": "图片已接收，正在后台处理",
+                "data": UploadJobSerializer(job).data
+            }, status=status.HTTP_202_ACCEPTED)
+        return Response({
+            "code": 0,
+            "message": "图片上传成功",
+            "data": ImageSerializer(image).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class DirectUploadCallbackView(APIView):
+    # 七牛云服务端回调，用回调签名鉴权，不走用户认证
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    # POST 请求，七牛云在客户端上传完成后回调；响应内容由七牛云原样返回给客户端
+    def post(self, request):
+        # 签名校验需要原始请求体，先于 request.data 读取
+        body = request.body
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return Response({"code": 1, "message": "回调内容无效"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            upload = handle_callback(
+                request.headers.get('Authorization', ''), request.build_absolute_uri(), body,
+                request.content_type, payload
+            )
+        except DirectUploadError as e:
+            logger.warning(f"七牛云回调被拒绝: {str(e)}")
+            return Response({"code": 1, "message": str(e)}, status=status.HTTP_403_FORBIDDEN)
+        except Exception as e:
+            logger.error(f"七牛云回调处理失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            return Response({"code": 1, "message": f"服务器内部错误: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return Response({
+            "code": 0,
+            "message": "图片已接收，正在后台处理",
+            "data": {"upload": DirectUploadSerializer(upload).data, "job": UploadJobSerializer(upload.job).data}
+        }, status=status.HTTP_200_OK)
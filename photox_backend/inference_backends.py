@@ -0,0 +1,284 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# CPU 推理后端（环境变量）：全局默认值，以及按模型覆盖，如 PHOTOX_INFERENCE_BACKEND_RESNET50=onnx
+#   eager       原始的 PyTorch FP32 动态图
+#   torchscript trace + freeze + optimize_for_inference，导出结果缓存到磁盘
+#   compile     torch.compile（需要可用的 C++ 编译器，编译结果由 inductor 自行缓存）
+#   onnx        导出为 ONNX，由 ONNX Runtime 执行（需要安装 onnxruntime）
+#   onnx-int8   ONNX Runtime 动态 int8 量化后的模型
+#   int8        PyTorch 动态 int8 量化（量化全连接层），导出结果缓存到磁盘
+BACKENDS = ("eager", "torchscript", "compile", "onnx", "onnx-int8", "int8")
+DEFAULT_BACKEND = os.getenv("PHOTOX_INFERENCE_BACKEND", "eager")
+CACHE_DIR = os.getenv("PHOTOX_MODEL_CACHE_DIR", os.path.join(BASE_DIR, "model_cache"))
+# 与 FP32 模型 top-5 结果的最低平均重合率，低于该值时放弃该后端，回退到 eager
+MIN_TOP5_AGREEMENT = float(os.getenv("PHOTOX_BACKEND_MIN_TOP5_AGREEMENT", "0.8"))
+
+# 精度校验使用的样本数
+_CHECK_SAMPLES = 8
+
+
+def backend_for(model_name):
+    """读取某个模型配置的推理后端"""
+    return os.getenv(f"PHOTOX_INFERENCE_BACKEND_{model_name.upper()}", DEFAULT_BACKEND).lower()
+
+
+def _input_size(weights):
+    transforms = weights.transforms()
+    return transforms.crop_size[0]
+
+
+def _sample_batch(weights, count=_CHECK_SAMPLES):
+    """固定随机种子生成的校验输入（已按权重的均值/方差归一化的分布）"""
+    size = _input_size(weights)
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(count, 3, size, size, generator=generator)
+
+
+def _fingerprint(model):
+    """模型权重的指纹（首尾两个参数的哈希），权重文件更新后缓存自动失效"""
+    parameters = list(model.parameters())
+    hasher = hashlib.sha1()
+    for parameter in (parameters[0], parameters[-1]):
+        hasher.update(parameter.detach().cpu().contiguous().numpy().tobytes())
+    return hasher.hexdigest()[:12]
+
+
+def _safe_weights(weights):
+    return str(weights).replace(".", "_").replace("/", "_")
+
+
+def _artifact_path(model_name, weights, fingerprint, backend, extension):
+    return os.path.join(
+        CACHE_DIR, f"{model_name}-{_safe_weights(weights)}-{fingerprint}-{backend}-torch{torch.__version__}.{extension}"
+    )
+
+
+def _prune_artifacts(model_name, weights, backend, extension, keep):
+    """删除同一模型和后端的旧缓存文件（权重指纹或 torch 版本不同），连同它们的校验结果"""
+    # 文件名中的权重指纹和 torch 版本用通配符匹配
+    pattern = (f"{glob.escape(f'{model_name}-{_safe_weights(weights)}-')}*"
+               f"{glob.escape(f'-{backend}-torch')}*{glob.escape(f'.{extension}')}")
+    for path in glob.glob(os.path.join(glob.escape(CACHE_DIR), pattern)):
+        if path == keep:
+            continue
+        for stale in (path, f"{path}.check.json"):
+            try:
+                os.remove(stale)
+                logger.info(f"删除过期的模型缓存: {stale}")
+            except FileNotFoundError:
+                pass
+
+
+def top5_agreement(reference_logits, logits):
+    """两组输出 top-5 类别集合的平均重合率（1.0 表示完全一致）"""
+    reference_top5 = torch.topk(reference_logits, 5, dim=1).indices.tolist()
+    top5 = torch.topk(logits, 5, dim=1).indices.tolist()
+    overlaps = [len(set(a) & set(b)) / 5 for a, b in zip(reference_top5, top5)]
+    return sum(overlaps) / len(overlaps)
+
+
+class OnnxRunner:
+    """把 ONNX Runtime 会话包装成与 PyTorch 模型相同的调用方式：输入输出都是张量"""
+
+    def __init__(self, path):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = int(os.getenv("PHOTOX_ONNX_THREADS", "0"))
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch_tensor):
+        outputs = self.session.run(None, {self.input_name: batch_tensor.detach().cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def _module_size(module):
+    return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+
+
+def _export_torchscript(model_name, model, weights, path):
+    example = _sample_batch(weights, 1)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model, example).eval())
+    torch.jit.save(traced, path)
+
+
+def _load_torchscript(path):
+    # optimize_for_inference 生成的图无法序列化，加载后再优化
+    return torch.jit.optimize_for_inference(torch.jit.load(path))
+
+
+def _export_int8(model_name, model, weights, path):
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    example = _sample_batch(weights, 1)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(quantized, example).eval())
+    torch.jit.save(traced, path)
+
+
+def _export_onnx(model_name, model, weights, path):
+    example = _sample_batch(weights, 1)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, example, path,
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=17, dynamo=False,
+        )
+
+
+def _export_onnx_int8(model_name, model, weights, path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # 在 FP32 的 ONNX 导出结果上量化（没有时先导出）
+    fp32_path = _artifact_path(model_name, weights, _fingerprint(model), "onnx", "onnx")
+    if not os.path.exists(fp32_path):
+        tmp_path = f"{fp32_path}.{os.getpid()}.tmp"
+        _export_onnx(model_name, model, weights, tmp_path)
+        os.replace(tmp_path, fp32_path)
+    # 只量化全连接层：卷积的动态量化（ConvInteger）在 CPU 上反而比 FP32 慢数倍
+    quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8, op_types_to_quantize=["MatMul", "Gemm"])
+
+
+# 后端 → (缓存文件扩展名, 导出函数, 加载函数)
+_EXPORTERS = {
+    "torchscript": ("pt", _export_torchscript, _load_torchscript),
+    "int8": ("pt", _export_int8, torch.jit.load),
+    "onnx": ("onnx", _export_onnx, OnnxRunner),
+    "onnx-int8": ("onnx", _export_onnx_int8, OnnxRunner),
+}
+
+
+def mmap_weights(model_name, weights, model):
+    """
+    把 eager 模型的权重另存为 state_dict 文件，再以 mmap 方式加载回模型（assign=True 直接替换参数张量）
+    权重由文件页承载：同一台机器上的多个 worker 共享页缓存，fork 之后也不会被复制；失败时保留原权重
+    """
+    try:
+        path = _artifact_path(model_name, weights, _fingerprint(model), "mmap", "pt")
+        if not os.path.exists(path):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(model.state_dict(), tmp_path)
+            os.replace(tmp_path, path)
+            _prune_artifacts(model_name, weights, "mmap", "pt", keep=path)
+        state_dict = torch.load(path, mmap=True, weights_only=True, map_location="cpu")
+        model.load_state_dict(state_dict, assign=True)
+    except Exception as e:
+        logger.error(f"权重内存映射失败，使用进程内的权重副本: {model_name} - {str(e)}")
+    return model
+
+
+def _check(model_name, backend, reference_model, runner, weights):
+    """与 FP32 模型比较 top-5 输出"""
+    batch = _sample_batch(weights)
+    with torch.no_grad():
+        agreement = top5_agreement(reference_model(batch), runner(batch))
+    logger.info(f"推理后端精度校验: {model_name}/{backend} top-5 重合率 {agreement:.3f}")
+    return agreement
+
+
+def prepare(model_name, weights, model, device="cpu", backend=None):
+    """
+    按配置把 eager 模型转换为指定后端。首次使用时导出并缓存到磁盘，同时与 FP32 输出做 top-5 校验，
+    校验结果与导出文件一起缓存；导出、加载或校验失败时回退到 eager
+    :return: (可调用的模型, 常驻内存估计字节数, 实际使用的后端)
+    """
+    backend = backend or backend_for(model_name)
+    if backend == "eager" or str(device) != "cpu":
+        return model, _module_size(model), "eager"
+    if backend not in BACKENDS:
+        logger.error(f"未知的推理后端 {backend}，使用 eager")
+        return model, _module_size(model), "eager"
+
+    try:
+        if backend == "compile":
+            runner = torch.compile(model)
+            agreement = _check(model_name, backend, model, runner, weights)
+            size_bytes = _module_size(model)
+        else:
+            extension, export, load = _EXPORTERS[backend]
+            path = _artifact_path(model_name, weights, _fingerprint(model), backend, extension)
+            check_path = f"{path}.check.json"
+            if not os.path.exists(path):
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                logger.info(f"导出推理后端: {model_name}/{backend} → {path}")
+                # 先写临时文件再改名，避免多个进程同时导出时读到不完整的文件
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                export(model_name, model, weights, tmp_path)
+                os.replace(tmp_path, path)
+                if os.path.exists(check_path):
+                    os.remove(check_path)
+                _prune_artifacts(model_name, weights, backend, extension, keep=path)
+            try:
+                runner = load(path)
+            except Exception:
+                # 缓存文件损坏或与当前版本不兼容，删除后下次重新导出
+                os.remove(path)
+                raise
+            if os.path.exists(check_path):
+                with open(check_path, "r", encoding="utf-8") as f:
+                    agreement = json.load(f)["top5_agreement"]
+            else:
+                agreement = _check(model_name, backend, model, runner, weights)
+                with open(check_path, "w", encoding="utf-8") as f:
+                    json.dump({"top5_agreement": agreement, "samples": _CHECK_SAMPLES}, f)
+            # 冻结后的权重以常量形式存放在导出文件中，按文件大小估计常驻内存
+            size_bytes = os.path.getsize(path)
+    except Exception as e:
+        logger.error(f"推理后端 {model_name}/{backend} 初始化失败，使用 eager: {str(e)}")
+        return model, _module_size(model), "eager"
+
+    if agreement < MIN_TOP5_AGREEMENT:
+        logger.error(f"推理后端 {model_name}/{backend} 精度校验未通过 ({agreement:.3f} < {MIN_TOP5_AGREEMENT})，使用 eager")
+        return model, _module_size(model), "eager"
+    return runner, size_bytes, backend
+
+
+def _benchmark(model_name="resnet50", batch_sizes=(1, 8), repeat=10):
+    """对比各后端的前向耗时、常驻大小和 top-5 重合率"""
+    from model_registry import _default_loader
+
+    model, weights = _default_loader(model_name, "DEFAULT")
+    model = model.eval()
+    for backend in BACKENDS:
+        runner, size_bytes, used = prepare(model_name, weights, model, backend=backend)
+        if used != backend:
+            print(f"{backend:12s} 不可用（已回退到 {used}）")
+            continue
+        timings = []
+        for batch_size in batch_sizes:
+            batch = _sample_batch(weights, batch_size)
+            with torch.no_grad():
+                runner(batch)  # 预热
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    runner(batch)
+            timings.append(f"batch={batch_size}: {(time.perf_counter() - start) / repeat * 1000:7.1f} ms")
+        with torch.no_grad():
+            batch = _sample_batch(weights)
+            agreement = top5_agreement(model(batch), runner(batch))
+        print(f"{backend:12s} {'  '.join(timings)}  大小 {size_bytes / 1024 / 1024:6.1f} MB  top-5 重合率 {agreement:.3f}")
+
+
+if __name__ == "__main__":
+    # 用法: python inference_backends.py [model_name]
+    logging.basicConfig(level=logging.WARNING)
+    _benchmark(sys.argv[1] if len(sys.argv) > 1 else "resnet50")
@@ -0,0 +1,184 @@
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+import torch
+
+import inference_pool
+from model_registry import registry
+
+logger = logging.getLogger(__name__)
+
+# 动态微批配置（环境变量）
+BATCHING_ENABLED = os.getenv("PHOTOX_INFERENCE_BATCHING", "1") == "1"
+MAX_BATCH_SIZE = int(os.getenv("PHOTOX_INFERENCE_MAX_BATCH", "8"))
+MAX_LATENCY_MS = float(os.getenv("PHOTOX_INFERENCE_MAX_LATENCY_MS", "10"))
+# 等待一个批次推理结果的超时时间（秒），默认与上传流水线 classify 阶段的超时一致；
+# 一次提交多张图片时按需要的批次数放宽
+RESULT_TIMEOUT = float(os.getenv("PHOTOX_INFERENCE_RESULT_TIMEOUT", "20"))
+
+
+def run_topk(model, batch_tensor, top_k):
+    """
+    对一个批次执行前向推理
+    :param batch_tensor: 形状为 (N, C, H, W) 的输入
+    :return: 每张图片的 [(类别下标, 概率), ...] 列表
+    """
+    with torch.no_grad():
+        output = model(batch_tensor)
+    probs = torch.nn.functional.softmax(output, dim=1)
+    top_probs, top_indices = torch.topk(probs, top_k, dim=1)
+    top_probs = top_probs.cpu().tolist()
+    top_indices = top_indices.cpu().tolist()
+    return [list(zip(indices, row_probs)) for indices, row_probs in zip(top_indices, top_probs)]
+
+
+class _Request:
+    __slots__ = ("tensor", "top_k", "future")
+
+    def __init__(self, tensor, top_k):
+        self.tensor = tensor
+        self.top_k = top_k
+        self.future = Future()
+
+
+class BatchingInferenceService:
+    """
+    动态微批推理服务：收集等待中的预处理张量，凑满 max_batch_size 张
+    或等待超过 max_latency_ms 后合并成一次前向推理，通过 Future 返回各自的 top-k 结果
+    """
+
+    def __init__(self, model_name="resnet50", weights="DEFAULT", device="cpu", loader=None,
+                 max_batch_size=MAX_BATCH_SIZE, max_latency_ms=MAX_LATENCY_MS):
+        self.model_name = model_name
+        self.weights = weights
+        self.device = device
+        self.loader = loader
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_latency = max(0.0, max_latency_ms) / 1000.0
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def submit(self, input_tensor, top_k=5):
+        """
+        提交一张预处理后的图片
+        :param input_tensor: 形状为 (C, H, W) 或 (1, C, H, W) 的张量
+        :return: Future，结果为 [(类别下标, 概率), ...]
+        """
+        if input_tensor.dim() == 4:
+            input_tensor = input_tensor[0]
+        request = _Request(input_tensor, top_k)
+        self._ensure_worker().put(request)
+        return request.future
+
+    def submit_many(self, input_tensors, top_k=5):
+        return [self.submit(tensor, top_k) for tensor in input_tensors]
+
+    def _ensure_worker(self):
+        # fork 之后后台线程不会被继承，按进程号重新启动；
+        # 同一进程内线程意外退出时沿用原来的队列，已排队的请求由新线程继续处理
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                if self._queue is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._run, args=(self._queue,),
+                    name=f"inference-batcher-{self.model_name}", daemon=True
+                )
+                self._thread.start()
+            return self._queue
+
+    def _run(self, requests_queue):
+        while True:
+            batch = [requests_queue.get()]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining <= 0:
+                        batch.append(requests_queue.get_nowait())
+                    else:
+                        batch.append(requests_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch):
+        # 调用方等待超时后会取消 Future，这些请求不再推理
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            entry = registry.get(self.model_name, self.weights, self.device, loader=self.loader)
+            batch_tensor = torch.stack([request.tensor for request in batch]).to(entry.device)
+            results = run_topk(entry.model, batch_tensor, max(request.top_k for request in batch))
+            logger.debug(f"批量推理完成: {self.model_name}, batch={len(batch)}")
+        except Exception as e:
+            logger.error(f"批量推理失败: {str(e)}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        for request, result in zip(batch, results):
+            request.future.set_result(result[:request.top_k])
+
+
+def wait_results(futures, timeout=RESULT_TIMEOUT, batch_size=None):
+    """
+    等待一组推理 Future，所有请求共用一个截止时间
+    :param timeout: 每个批次的超时时间
+    :param batch_size: 批大小，给出时截止时间按 ceil(请求数 / batch_size) 个批次放宽
+    :raises TimeoutError: 超时（未开始推理的请求会被取消）
+    """
+    if batch_size:
+        timeout *= max(1, math.ceil(len(futures) / batch_size))
+    deadline = time.monotonic() + timeout
+    try:
+        return [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+    except TimeoutError:
+        for future in futures:
+            future.cancel()
+        raise TimeoutError(f"微批推理超过 {timeout} 秒未返回结果")
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_batcher(model_name="resnet50", weights="DEFAULT", device="cpu", loader=None):
+    """获取（或创建）某个模型的进程级微批推理服务"""
+    key = (model_name, str(weights), str(device))
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = BatchingInferenceService(model_name, weights, device, loader=loader)
+            _services[key] = service
+        return service
+
+
+def infer(model_name, weights, device, batch_tensor, top_k=5, loader=None):
+    """
+    统一推理入口：推理进程池（manage.py runinference）可用时交给它推理，
+    否则开启微批时交给当前进程的后台服务合批，再否则直接在当前线程推理
+    :param batch_tensor: 形状为 (N, C, H, W) 的输入
+    :return: 每张图片的 [(类别下标, 概率), ...] 列表
+    """
+    if str(device) == "cpu" and inference_pool.available():
+        try:
+            return inference_pool.infer(model_name, weights, batch_tensor, top_k)
+        except inference_pool.InferencePoolError as e:
+            logger.error(f"推理进程池推理失败，在当前进程推理: {str(e)}")
+    if BATCHING_ENABLED:
+        service = get_batcher(model_name, weights, device, loader)
+        futures = service.submit_many(batch_tensor, top_k)
+        # 批量上传一次提交几十张图片，推理需要多个批次，不能与单张图片共用同一个截止时间
+        return wait_results(futures, batch_size=service.max_batch_size)
+    entry = registry.get(model_name, weights, device, loader=loader)
+    return run_topk(entry.model, batch_tensor.to(entry.device), top_k)
@@ -0,0 +1,234 @@
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from image_context import ImageContext
+
+logger = logging.getLogger(__name__)
+
+# 远程推理节点配置（环境变量）：逗号分隔的节点地址，留空表示在本机推理
+NODES = [url.strip().rstrip("/") for url in os.getenv("PHOTOX_INFERENCE_NODES", "").split(",") if url.strip()]
+TIMEOUT = float(os.getenv("PHOTOX_INFERENCE_NODE_TIMEOUT", "30"))
+HEALTH_INTERVAL = float(os.getenv("PHOTOX_INFERENCE_HEALTH_INTERVAL", "10"))
+TOKEN = os.getenv("PHOTOX_INFERENCE_TOKEN", "")
+# 发送给推理节点前把图片缩小到的最长边（分类模型的输入远小于该值）
+IMAGE_MAX_SIDE = int(os.getenv("PHOTOX_INFERENCE_IMAGE_MAX_SIDE", "1024"))
+# 单个请求最多包含的图片数，节点在 /health 中返回自己的上限前使用该值
+MAX_BATCH = int(os.getenv("PHOTOX_INFERENCE_NODE_MAX_BATCH", "32"))
+# 多张图片合并为一个请求时的 Content-Type（与 inference_server.IMAGES_CONTENT_TYPE 一致）
+IMAGES_CONTENT_TYPE = "application/x-photox-images"
+
+
+class RemoteInferenceError(Exception):
+    """所有推理节点都不可用或都请求失败"""
+
+
+class InferenceNode:
+    def __init__(self, url):
+        self.url = url
+        # 本进程发往该节点、尚未返回的请求数（最少未完成请求负载均衡的依据）
+        self.outstanding = 0
+        self.healthy = True
+        self.last_error = None
+        # 节点在 /health 中返回的单个请求最大图片数
+        self.max_batch = None
+
+
+class RemoteInferenceClient:
+    """
+    远程推理客户端：每次请求选择健康节点中未完成请求最少的一个，
+    请求失败的节点标记为不健康并换下一个节点重试；后台线程定期检查健康状态，恢复后重新加入
+    """
+
+    def __init__(self, urls, timeout=TIMEOUT, health_interval=HEALTH_INTERVAL, token=TOKEN):
+        self.nodes = [InferenceNode(url) for url in urls]
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.token = token
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._health_thread = None
+        self._pid = None
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            if self.token:
+                session.headers["X-Inference-Token"] = self.token
+            self._local.session = session
+        return session
+
+    def _ensure_health_checker(self):
+        # fork 之后后台线程不会被继承，按进程号重新启动
+        with self._lock:
+            if self._health_thread is None or self._pid != os.getpid() or not self._health_thread.is_alive():
+                self._pid = os.getpid()
+                self._health_thread = threading.Thread(
+                    target=self._health_loop, name="inference-health-check", daemon=True
+                )
+                self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            self.check_health()
+
+    def check_health(self):
+        """检查所有节点的 /health，更新健康状态"""
+        for node in self.nodes:
+            try:
+                response = self._session().get(f"{node.url}/health", timeout=min(self.timeout, 5))
+                healthy = response.status_code == 200
+                error = None if healthy else f"HTTP {response.status_code}"
+                max_batch = _max_batch(response) if healthy else None
+            except requests.RequestException as e:
+                healthy, error, max_batch = False, str(e), None
+            with self._lock:
+                if healthy != node.healthy:
+                    logger.info(f"推理节点{'恢复' if healthy else '不可用'}: {node.url}{'' if healthy else f' - {error}'}")
+                node.healthy = healthy
+                node.last_error = error
+                if max_batch:
+                    node.max_batch = max_batch
+
+    def _acquire(self, tried):
+        """选择未尝试过的健康节点中未完成请求最少的一个，并记为一个未完成请求"""
+        with self._lock:
+            candidates = [node for node in self.nodes if node.healthy and node not in tried]
+            if not candidates:
+                return None
+            node = min(candidates, key=lambda n: n.outstanding)
+            node.outstanding += 1
+            return node
+
+    def _release(self, node, error=None):
+        with self._lock:
+            node.outstanding -= 1
+            if error is not None:
+                node.healthy = False
+                node.last_error = error
+
+    def predict(self, image, model_type="resnet50", top_k=5):
+        """
+        对单张图片远程推理
+        :param image: 图片路径或 ImageContext
+        :return: [(标签, 概率), ...]
+        """
+        return self._predict_batch([image], model_type, top_k)[0]
+
+    def predict_many(self, images, model_type="resnet50", top_k=5):
+        """
+        多张图片按节点的最大批大小分块，每块作为一个请求发送，各块并发分散到健康节点
+        :return: 与输入一一对应的 [(标签, 概率), ...] 列表
+        """
+        if not images:
+            return []
+        with self._lock:
+            healthy = [node for node in self.nodes if node.healthy] or self.nodes
+            max_batch = min(node.max_batch or MAX_BATCH for node in healthy)
+        # 图片不多时也拆成与健康节点数相同的块，让每个节点都分到一部分
+        size = max(1, min(max_batch, math.ceil(len(images) / len(healthy))))
+        chunks = [images[i:i + size] for i in range(0, len(images), size)]
+        if len(chunks) == 1:
+            return self._predict_batch(chunks[0], model_type, top_k)
+        with ThreadPoolExecutor(max_workers=min(len(chunks), 2 * len(self.nodes))) as executor:
+            results = executor.map(lambda chunk: self._predict_batch(chunk, model_type, top_k), chunks)
+            return [result for chunk_results in results for result in chunk_results]
+
+    def _predict_batch(self, images, model_type, top_k):
+        """缩小并编码为 JPEG 后作为一个请求发送"""
+        self._ensure_health_checker()
+        parts = [
+            (image if isinstance(image, ImageContext) else ImageContext(image)).jpeg_bytes(
+                max_size=IMAGE_MAX_SIDE, quality=90
+            )
+            for image in images
+        ]
+        return self._post_images(parts, model_type, top_k)
+
+    def _post_images(self, parts, model_type, top_k):
+        """把一组已编码的图片合并为一个请求，失败时换节点重试"""
+        data = b"".join(parts)
+        headers = {"Content-Type": IMAGES_CONTENT_TYPE, "X-Image-Sizes": ",".join(str(len(part)) for part in parts)}
+
+        tried = []
+        while True:
+            node = self._acquire(tried)
+            if node is None:
+                raise RemoteInferenceError(f"没有可用的推理节点（已尝试 {len(tried)} 个）")
+            tried.append(node)
+            try:
+                response = self._session().post(
+                    f"{node.url}/predict", params={"model": model_type, "top_k": top_k}, data=data,
+                    headers=headers, timeout=self.timeout,
+                )
+                if response.status_code == 413:
+                    self._release(node)
+                    max_batch = _max_batch(response)
+                    if not max_batch or max_batch >= len(parts):
+                        raise RemoteInferenceError(_error_message(response))
+                    # 超过节点的批大小上限：记下节点返回的上限，拆分后重新发送
+                    with self._lock:
+                        node.max_batch = max_batch
+                    return [
+                        result for i in range(0, len(parts), max_batch)
+                        for result in self._post_images(parts[i:i + max_batch], model_type, top_k)
+                    ]
+                if response.status_code == 400:
+                    # 请求本身无效，换节点也没有用
+                    self._release(node)
+                    raise RemoteInferenceError(_error_message(response))
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.error(f"推理节点请求失败，尝试其他节点: {node.url} - {str(e)}")
+                self._release(node, error=str(e))
+                continue
+            self._release(node)
+            return [
+                [(label, float(prob)) for label, prob in results] for results in response.json()["data"]["results"]
+            ]
+
+    def status(self):
+        with self._lock:
+            return [
+                {"url": n.url, "healthy": n.healthy, "outstanding": n.outstanding, "last_error": n.last_error}
+                for n in self.nodes
+            ]
+
+
+def _error_message(response):
+    """错误响应中的 message，响应体不是 JSON 时（如代理返回的错误页）使用原始文本"""
+    try:
+        return response.json().get("message") or response.text
+    except ValueError:
+        return response.text or f"HTTP {response.status_code}"
+
+
+def _max_batch(response):
+    try:
+        return int(response.json()["data"]["max_batch"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def enabled():
+    return bool(NODES)
+
+
+def get_client():
+    """按 PHOTOX_INFERENCE_NODES 创建的进程级客户端"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RemoteInferenceClient(NODES)
+        return _client
@@ -0,0 +1,322 @@
+import fcntl
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import get_context, resource_tracker
+from multiprocessing.connection import Connection, Listener, answer_challenge, deliver_challenge
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 独立推理进程池配置（环境变量）
+#   off    不使用，始终在当前进程推理
+#   auto   推理进程池（manage.py runinference）在运行时使用，否则在当前进程推理
+#   spawn  同 auto，未运行时在后台自动启动一个
+POOL_MODE = os.getenv("PHOTOX_INFERENCE_POOL", "auto").lower()
+SOCKET_PATH = os.getenv("PHOTOX_INFERENCE_SOCKET", os.path.join(BASE_DIR, "photox-inference.sock"))
+# 连接认证密钥：连接上传输的是 pickle 数据，不使用固定的默认值；
+# 未设置时推理进程池启动时生成随机密钥，写入 socket 旁的 .key 文件（与 socket 位于同一共享卷）
+AUTHKEY = os.getenv("PHOTOX_INFERENCE_POOL_AUTHKEY", "").encode("utf-8")
+# 推理进程数，以及所有推理进程合计使用的 CPU 线程数
+PROCESSES = int(os.getenv("PHOTOX_INFERENCE_PROCESSES", "1"))
+THREADS = int(os.getenv("PHOTOX_INFERENCE_THREADS", str(os.cpu_count() or 1)))
+# 单次推理请求的超时时间（秒）
+TIMEOUT = float(os.getenv("PHOTOX_INFERENCE_POOL_TIMEOUT", "30"))
+
+# 连接失败后多久再尝试（秒），避免推理进程池未运行时每个请求都去连接
+_RETRY_INTERVAL = 5
+_CONNECT_TIMEOUT = 5
+
+
+class InferencePoolError(Exception):
+    """推理进程池不可用或推理失败，调用方应回退到当前进程推理"""
+
+
+# ---------------------------------------------------------------- 客户端（web worker 中）
+
+_local = threading.local()
+_state_lock = threading.Lock()
+_retry_after = 0.0
+
+
+def enabled():
+    return POOL_MODE in ("auto", "spawn")
+
+
+def _key_path():
+    return f"{SOCKET_PATH}.key"
+
+
+def _authkey():
+    """客户端使用的认证密钥：环境变量，否则读取推理进程池生成的密钥文件"""
+    if AUTHKEY:
+        return AUTHKEY
+    with open(_key_path(), "rb") as f:
+        return f.read()
+
+
+def _create_authkey():
+    """推理进程池启动时确定认证密钥：未配置环境变量时生成随机密钥并写入密钥文件（仅属主和同组可读）"""
+    if AUTHKEY:
+        return AUTHKEY
+    key = os.urandom(32)
+    tmp_path = f"{_key_path()}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o640)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp_path, _key_path())
+    return key
+
+
+def _connect():
+    authkey = _authkey()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(_CONNECT_TIMEOUT)
+    try:
+        sock.connect(SOCKET_PATH)
+    except OSError:
+        sock.close()
+        raise
+    sock.setblocking(True)
+    conn = Connection(sock.detach())
+    # 推理进程在忙于加载模型时可能暂时不 accept，握手前先等待
+    if not conn.poll(_CONNECT_TIMEOUT):
+        conn.close()
+        raise InferencePoolError("推理进程池握手超时")
+    answer_challenge(conn, authkey)
+    deliver_challenge(conn, authkey)
+    return conn
+
+
+def _connection():
+    """当前线程的连接（每个线程一条，fork 之后重新连接）"""
+    global _retry_after
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+
+    if time.monotonic() < _retry_after:
+        raise InferencePoolError("推理进程池未运行")
+    try:
+        conn = _connect()
+    except Exception as e:
+        with _state_lock:
+            _retry_after = time.monotonic() + _RETRY_INTERVAL
+        if POOL_MODE == "spawn":
+            _spawn_server()
+        raise InferencePoolError(f"无法连接推理进程池: {str(e)}")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _drop_connection():
+    conn = getattr(_local, "conn", None)
+    _local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+
+def available():
+    """推理进程池是否可用（连接失败的结果会缓存几秒）"""
+    if not enabled():
+        return False
+    try:
+        _connection()
+        return True
+    except InferencePoolError:
+        return False
+
+
+def infer(model_name, weights, batch_tensor, top_k=5):
+    """
+    把预处理后的批次交给推理进程池：张量写入共享内存，通过连接只发送共享内存的名称和形状
+    :param batch_tensor: 形状为 (N, C, H, W) 的输入
+    :return: 每张图片的 [(类别下标, 概率), ...] 列表
+    """
+    conn = _connection()
+    batch = batch_tensor.detach().cpu().to(torch.float32).contiguous()
+    shm = SharedMemory(create=True, size=max(1, batch.numel() * batch.element_size()))
+    try:
+        np.ndarray(tuple(batch.shape), dtype=np.float32, buffer=shm.buf)[...] = batch.numpy()
+        conn.send(("infer", model_name, str(weights), shm.name, tuple(batch.shape), top_k))
+        if not conn.poll(TIMEOUT):
+            raise InferencePoolError(f"推理进程池超过 {TIMEOUT} 秒未返回结果")
+        status, payload = conn.recv()
+    except (OSError, EOFError, InferencePoolError) as e:
+        # 连接上可能还有未读取的响应，丢弃后下次重新连接
+        _drop_connection()
+        raise InferencePoolError(f"推理进程池请求失败: {str(e)}")
+    finally:
+        shm.close()
+        shm.unlink()
+    if status != "ok":
+        raise InferencePoolError(payload)
+    return payload
+
+
+def _lock_file():
+    return open(f"{SOCKET_PATH}.lock", "w")
+
+
+def _spawn_server():
+    """spawn 模式：在后台启动 manage.py runinference；服务进程运行期间持有文件锁，不会重复启动"""
+    with _lock_file() as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # 已有推理进程池在运行（或正在启动）
+            return
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    logger.info("推理进程池未运行，在后台启动 manage.py runinference")
+    subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, "manage.py"), "runinference"],
+        cwd=BASE_DIR, stdin=subprocess.DEVNULL, start_new_session=True,
+    )
+
+
+# ---------------------------------------------------------------- 服务端（推理进程中）
+
+def _read_shared_tensor(shm_name, shape):
+    shm = SharedMemory(name=shm_name)
+    try:
+        # 共享内存由客户端删除，不让本进程的 resource_tracker 在退出时重复清理
+        resource_tracker.unregister(shm._name, "shared_memory")
+        array = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        # 拷贝出共享内存：客户端收到结果后会立即删除该段
+        tensor = torch.tensor(array)
+        del array
+    finally:
+        shm.close()
+    return tensor
+
+
+def _handle_connection(conn):
+    """处理一个客户端连接上的请求；同一进程内所有连接的请求由微批推理服务合并成批次"""
+    from inference_batcher import get_batcher, wait_results
+
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            _, model_name, weights, shm_name, shape, top_k = message
+            try:
+                tensor = _read_shared_tensor(shm_name, shape)
+                futures = get_batcher(model_name, weights, "cpu").submit_many(tensor, top_k)
+                response = ("ok", wait_results(futures, TIMEOUT))
+            except Exception as e:
+                logger.error(f"推理进程池推理失败: {str(e)}")
+                response = ("error", str(e))
+            try:
+                conn.send(response)
+            except OSError:
+                return
+
+
+def _worker_main(listener, model_names, threads):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    from model_registry import registry
+
+    try:
+        registry.warm_up(model_names)
+    except Exception as e:
+        # 预热失败时模型在首个请求到来时再加载
+        logger.error(f"推理进程预热失败: {str(e)}")
+    logger.info(f"推理进程已就绪 (pid={os.getpid()}, threads={threads})")
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            logger.error(f"推理进程池接受连接失败: {str(e)}")
+            continue
+        threading.Thread(target=_handle_connection, args=(conn,), daemon=True).start()
+
+
+def serve(socket_path=None, processes=None, threads=None, model_names=("resnet50",)):
+    """
+    运行推理进程池（阻塞直到收到 SIGTERM / SIGINT）：
+    主进程在 fork 之前加载模型权重，再启动 processes 个推理进程共享同一个 Unix socket，
+    各进程平分 threads 个 CPU 线程；推理进程异常退出时自动重启
+    """
+    global SOCKET_PATH
+    SOCKET_PATH = socket_path or SOCKET_PATH
+    processes = max(1, processes or PROCESSES)
+    threads = threads or THREADS
+    threads_per_process = max(1, threads // processes)
+
+    # 运行期间持有文件锁，保证同一个 socket 上只有一个推理进程池
+    lock_file = _lock_file()
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError(f"推理进程池已在运行: {SOCKET_PATH}")
+    if os.path.exists(SOCKET_PATH):
+        # 上次异常退出残留的 socket 文件
+        os.remove(SOCKET_PATH)
+
+    from model_registry import registry
+
+    registry.preload(model_names)
+    listener = Listener(SOCKET_PATH, family="AF_UNIX", authkey=_create_authkey())
+    os.chmod(SOCKET_PATH, 0o660)
+
+    stopping = threading.Event()
+
+    def _stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    context = get_context("fork")
+    workers = []
+
+    def _start_worker():
+        process = context.Process(
+            target=_worker_main, args=(listener, list(model_names), threads_per_process), name="photox-inference"
+        )
+        process.start()
+        return process
+
+    logger.info(
+        f"推理进程池启动: {SOCKET_PATH}, 进程数 {processes}, 每个进程 {threads_per_process} 个线程, "
+        f"模型 {', '.join(model_names)}"
+    )
+    try:
+        workers = [_start_worker() for _ in range(processes)]
+        while not stopping.wait(1):
+            for i, process in enumerate(workers):
+                if not process.is_alive():
+                    logger.error(f"推理进程异常退出 (pid={process.pid}, exitcode={process.exitcode})，重新启动")
+                    workers[i] = _start_worker()
+    finally:
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.join(timeout=10)
+        listener.close()
+        lock_file.close()
+        logger.info("推理进程池已停止")
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import torch
+
+from image_context import ImageContext
+from model_registry import DEFAULT_CLASS_FILE
+
+logger = logging.getLogger(__name__)
+
+# 远程推理服务配置（环境变量）：请求体大小上限，以及可选的共享令牌（请求头 X-Inference-Token）
+MAX_BODY_BYTES = int(os.getenv("PHOTOX_INFERENCE_MAX_BODY", str(32 * 1024 * 1024)))
+TOKEN = os.getenv("PHOTOX_INFERENCE_TOKEN", "")
+
+# 请求体为预处理后张量时的 Content-Type：float32 小端原始字节，形状由 X-Tensor-Shape 给出（如 2,3,224,224）
+TENSOR_CONTENT_TYPE = "application/x-photox-tensor"
+# 请求体为多张图片时的 Content-Type：各图片字节依次拼接，每张的字节数由 X-Image-Sizes 给出（如 10240,8192）
+IMAGES_CONTENT_TYPE = "application/x-photox-images"
+# 单个请求最多包含的图片数（通过 /health 告知客户端，客户端按此分块）
+MAX_BATCH = int(os.getenv("PHOTOX_INFERENCE_NODE_MAX_BATCH", "32"))
+
+# 与 ai_image 保持一致的标签来源：resnet50 使用本地类别文件，其余模型使用分类器默认的标签
+_CLASS_FILES = {"resnet50": DEFAULT_CLASS_FILE}
+
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_classifier(model_name):
+    """每个模型一个分类器（模型本身由注册表缓存），推理经由微批服务与并发请求合并成批次"""
+    from MultiModelClassifier import MultiModelClassifier
+
+    with _classifiers_lock:
+        classifier = _classifiers.get(model_name)
+        if classifier is None:
+            classifier = MultiModelClassifier(
+                model_name=model_name, weights="DEFAULT", device="cpu", class_file=_CLASS_FILES.get(model_name)
+            )
+            _classifiers[model_name] = classifier
+        return classifier
+
+
+class InferenceRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health                       健康检查，返回已加载的模型和正在处理的请求数
+    POST /predict?model=resnet50&top_k=5
+         请求体为图片字节（任意 Content-Type）、多张图片（application/x-photox-images，最多 MAX_BATCH 张）
+         或预处理后的张量（application/x-photox-tensor）
+         返回 data.results: 每张图片的 [[标签, 概率], ...]
+    """
+
+    server_version = "PhotoxInference/1.0"
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/health":
+            self._send(404, {"code": 1, "message": "接口不存在"})
+            return
+        self._send(200, {
+            "code": 0,
+            "message": "ok",
+            "data": {
+                "pid": os.getpid(),
+                "models": sorted(_classifiers.keys()),
+                "outstanding": self.server.outstanding,
+                "max_batch": MAX_BATCH,
+            },
+        })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self._send(404, {"code": 1, "message": "接口不存在"})
+            return
+        if TOKEN and self.headers.get("X-Inference-Token") != TOKEN:
+            self._send(403, {"code": 1, "message": "令牌无效"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_BYTES:
+            self._send(413 if length else 400, {"code": 1, "message": "请求体为空或过大"})
+            return
+
+        query = parse_qs(url.query)
+        model_name = query.get("model", ["resnet50"])[0]
+        top_k = int(query.get("top_k", ["5"])[0])
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        images = None
+        if content_type.startswith(IMAGES_CONTENT_TYPE):
+            try:
+                images = _split_images(body, self.headers.get("X-Image-Sizes", ""))
+            except ValueError as e:
+                self._send(400, {"code": 1, "message": f"请求无效: {str(e)}"})
+                return
+            if len(images) > MAX_BATCH:
+                self._send(413, {"code": 1, "message": f"单个请求最多 {MAX_BATCH} 张图片", "data": {"max_batch": MAX_BATCH}})
+                return
+
+        with self.server.outstanding_lock:
+            self.server.outstanding += 1
+        try:
+            classifier = get_classifier(model_name)
+            if images is not None:
+                results = classifier.predict_batch([ImageContext.from_bytes(data) for data in images], top_k)
+            elif content_type.startswith(TENSOR_CONTENT_TYPE):
+                shape = tuple(int(x) for x in self.headers["X-Tensor-Shape"].split(","))
+                tensor = torch.from_numpy(np.frombuffer(body, dtype="<f4").reshape(shape).copy())
+                results = classifier.predict_batch_tensor(tensor, top_k)
+            else:
+                results = [classifier.predict(ImageContext.from_bytes(body), top_k)]
+        except (ValueError, KeyError, OSError) as e:
+            # 模型名无效、张量形状不匹配或图片无法解码
+            self._send(400, {"code": 1, "message": f"请求无效: {str(e)}"})
+            return
+        except Exception as e:
+            logger.error(f"远程推理失败: {str(e)}")
+            self._send(500, {"code": 1, "message": f"推理失败: {str(e)}"})
+            return
+        finally:
+            with self.server.outstanding_lock:
+                self.server.outstanding -= 1
+
+        self._send(200, {
+            "code": 0,
+            "message": "推理成功",
+            "data": {"model": model_name, "results": [[[label, prob] for label, prob in r] for r in results]},
+        })
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def _split_images(body, sizes):
+    """按 X-Image-Sizes 把请求体拆成各张图片的字节"""
+    sizes = [int(size) for size in sizes.split(",") if size.strip()]
+    if not sizes or any(size <= 0 for size in sizes) or sum(sizes) != len(body):
+        raise ValueError("X-Image-Sizes 与请求体长度不一致")
+    images, offset = [], 0
+    for size in sizes:
+        images.append(body[offset:offset + size])
+        offset += size
+    return images
+
+
+class InferenceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, InferenceRequestHandler)
+        self.outstanding = 0
+        self.outstanding_lock = threading.Lock()
+
+
+def serve(host="0.0.0.0", port=8100, model_names=("resnet50",)):
+    """启动远程推理服务（阻塞），启动前加载并预热模型"""
+    for model_name in model_names:
+        classifier = get_classifier(model_name)
+        size = classifier.preprocess.crop_size[0]
+        classifier.predict_batch_tensor(torch.zeros(1, 3, size, size), 1)
+    server = InferenceHTTPServer((host, port))
+    logger.info(f"远程推理服务已启动: http://{host}:{port}，模型 {', '.join(model_names)}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
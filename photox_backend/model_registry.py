@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+from torchvision import models
+
+import inference_backends
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 默认 ImageNet 类别文件（与工作目录无关）
+DEFAULT_CLASS_FILE = os.path.join(BASE_DIR, "imagenet_classes.txt")
+
+# fork 之前预加载（preload）的 CPU 权重以 mmap 方式加载（环境变量），多个 worker 进程共享同一份页缓存；
+# 按需加载的模型只在本进程使用，不写 mmap 文件
+MMAP_WEIGHTS = os.getenv("PHOTOX_MODEL_MMAP", "1") == "1"
+# gunicorn 启动时在 fork 之前预加载的模型（逗号分隔，留空表示不预加载）
+PRELOAD_MODELS = [name.strip() for name in os.getenv("PHOTOX_PRELOAD_MODELS", "").split(",") if name.strip()]
+
+
+def resolve_weights(model_name, weights):
+    """把 'DEFAULT' / 'IMAGENET1K_V2' 等名称解析为 torchvision 的权重枚举（不加载模型）"""
+    weights_class = models.get_model_weights(model_name)
+    if weights == "DEFAULT":
+        return weights_class.DEFAULT
+    if isinstance(weights, str):
+        return getattr(weights_class, weights)
+    return weights
+
+
+def _default_loader(model_name, weights):
+    """按 torchvision 的注册表加载模型和权重"""
+    weights = resolve_weights(model_name, weights)
+    return models.get_model(model_name, weights=weights), weights
+
+
+def _read_class_file(class_file):
+    with open(class_file, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f.readlines()]
+
+
+class LoadedModel:
+    """已加载的模型，连同它的预处理函数一起缓存"""
+
+    def __init__(self, model_name, weights, model, device, size_bytes, backend="eager"):
+        self.model_name = model_name
+        self.weights = weights
+        # 可调用的模型：eager 模型或推理后端转换后的模型，输入输出都是张量
+        self.model = model
+        self.device = device
+        self.backend = backend
+        # 预处理函数（自动匹配权重对应的预处理）
+        self.preprocess = weights.transforms()
+        self.size_bytes = size_bytes
+
+
+class ModelRegistry:
+    """
+    进程级模型注册表：每个 (model_name, weights, device) 只加载一次，
+    总内存超过预算时按 LRU 淘汰最久未使用的模型
+    """
+
+    def __init__(self, memory_budget_mb=1024):
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._models = OrderedDict()
+        self._labels = {}
+        # fork 之前预加载的 eager 模型：key -> (model, weights)
+        self._preloaded = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, model_name="resnet50", weights="DEFAULT", device="cpu", loader=None):
+        """
+        获取已加载的模型，不存在时加载
+        :param loader: 自定义加载函数 loader(model_name, weights) -> (model, weights)
+        :return: LoadedModel
+        """
+        key = (model_name, str(weights), str(device))
+        entry = self._lookup(key)
+        if entry is not None:
+            return entry
+
+        # 同一个模型只允许一个线程加载，其余线程等待结果
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return entry
+
+            with self._lock:
+                preloaded = self._preloaded.get(key)
+            if preloaded is not None:
+                # 复用 fork 之前加载的权重（与其他 worker 共享内存页）
+                model, resolved_weights = preloaded
+            else:
+                logger.info(f"加载模型: {model_name} (weights={weights}, device={device})")
+                model, resolved_weights = self._load_eager(model_name, weights, device, loader)
+            # 按配置转换为 TorchScript / ONNX Runtime / int8 等推理后端
+            model, size_bytes, backend = inference_backends.prepare(model_name, resolved_weights, model, device)
+            entry = LoadedModel(model_name, resolved_weights, model, device, size_bytes, backend)
+            logger.info(f"模型已加载: {model_name} (backend={backend}, {size_bytes // (1024 * 1024)} MB)")
+
+            with self._lock:
+                self._models[key] = entry
+                self._evict_locked(keep=key)
+            return entry
+
+    def _load_eager(self, model_name, weights, device, loader=None, mmap=False):
+        model, resolved_weights = (loader or _default_loader)(model_name, weights)
+        model = model.to(device).eval()
+        if mmap and MMAP_WEIGHTS and str(device) == "cpu":
+            model = inference_backends.mmap_weights(model_name, resolved_weights, model)
+        return model, resolved_weights
+
+    def preload(self, model_names, weights="DEFAULT", device="cpu"):
+        """
+        在 fork 之前（gunicorn master 进程中）加载 eager 权重和类别标签，子进程通过写时复制共享。
+        这里只加载不推理：推理会启动 OpenMP / ONNX Runtime 线程池，fork 之后子进程中不可用，
+        推理后端转换和预热放到各个 worker 中执行（见 warm_up）
+        """
+        for model_name in model_names:
+            key = (model_name, str(weights), str(device))
+            with self._lock:
+                if key in self._preloaded:
+                    continue
+            logger.info(f"预加载模型: {model_name} (weights={weights}, device={device})")
+            preloaded = self._load_eager(model_name, weights, device, mmap=True)
+            with self._lock:
+                self._preloaded[key] = preloaded
+        self.get_labels(DEFAULT_CLASS_FILE)
+
+    def warm_up(self, model_names, weights="DEFAULT", device="cpu"):
+        """在 worker 中完成推理后端转换，并用一个空白批次执行一次前向推理"""
+        for model_name in model_names:
+            entry = self.get(model_name, weights, device)
+            size = entry.preprocess.crop_size[0]
+            with torch.no_grad():
+                entry.model(torch.zeros(1, 3, size, size, device=device))
+            logger.info(f"模型已预热: {model_name} (pid={os.getpid()})")
+
+    def get_labels(self, class_file=DEFAULT_CLASS_FILE, loader=None):
+        """
+        获取类别标签列表，同一来源只读取一次
+        :param loader: 自定义加载函数 loader() -> list（如从网络下载）
+        """
+        with self._lock:
+            labels = self._labels.get(class_file)
+        if labels is None:
+            labels = loader() if loader else _read_class_file(class_file)
+            with self._lock:
+                labels = self._labels.setdefault(class_file, labels)
+        return labels
+
+    def memory_usage(self):
+        """当前已加载模型占用的参数内存（字节）"""
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._models.values())
+
+    def loaded_models(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._labels.clear()
+            self._preloaded.clear()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+            return entry
+
+    def _evict_locked(self, keep):
+        total = sum(entry.size_bytes for entry in self._models.values())
+        for key in list(self._models.keys()):
+            if total <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            evicted = self._models.pop(key)
+            total -= evicted.size_bytes
+            logger.info(f"模型内存超出预算，淘汰: {key[0]} ({evicted.size_bytes // (1024 * 1024)} MB)")
+
+
+# 进程级单例
+registry = ModelRegistry(memory_budget_mb=int(os.getenv("PHOTOX_MODEL_MEMORY_MB", "1024")))
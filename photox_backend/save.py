@@ -1,209 +1,188 @@
-#
-# from qiniu import Auth, put_file, BucketManager, urlsafe_base64_encode
-# import requests
-# import time
-# import hmac
-# import hashlib
-# from urllib.parse import quote
-# import base64
-# from sympy.integrals.meijerint_doc import category
-#
-# from ai_image import ai_image
-#
-#
-# def hmac_sha1(signing_str: str, secret_key: str) -> str:
-#     """
-#     生成 HMAC-SHA1 签名
-#     :param signing_str: 待签名的字符串
-#     :param secret_key: 密钥（需与API要求一致，如七牛云的SecretKey）
-#     :return: Base64编码的签名结果
-#     """
-#     # 将密钥和字符串转换为字节（UTF-8编码）
-#     key_bytes = secret_key.encode('utf-8')
-#     msg_bytes = signing_str.encode('utf-8')
-#
-#     # 计算 HMAC-SHA1 摘要
-#     digest = hmac.new(key_bytes, msg_bytes, hashlib.sha1).digest()
-#
-#     # 将摘要转换为 Base64 字符串
-#     return base64.b64encode(digest).decode('utf-8')
-#
-# def upload_and_set_metadata(access_key, secret_key, bucket_name, file_path, key, tags, category):
-#     q = Auth(access_key, secret_key)
-#
-#     # 第一步：上传文件
-#     token = q.upload_token(bucket_name, key, 3600)
-#     ret, info = put_file(token, key, file_path)
-#
-#     if not ret or ret.get('key') != key:
-#         print("文件上传失败:", info.text_body)
-#         return None
-#
-#     # 第二步：构造双重URL编码的路径参数
-#     entry = f"{bucket_name}:{key}"
-#     encodedEntryURI = urlsafe_base64_encode(entry) # 双重编码
-#
-#     # 构造MIME占位参数
-#     encoded_mime =urlsafe_base64_encode("")  # 空字符串双重编码
-#
-#     stat_url = f"https://rs.qiniuapi.com/stat/{encodedEntryURI}"
-#     stat_token = q.token_of_request(stat_url)
-#     print(stat_url)
-#     response = requests.post(stat_url, headers={"Authorization": f"QBox {stat_token}"})
-#     print(response.text)  # 应返回文件信息，而非 401
-#
-#     # 构造元数据参数
-#     meta_parts = []
-#     metadata = {
-#         "x-qn-meta-user": "user01",
-#         "x-qn-meta-tags": ",".join(tags),
-#         "x-qn-meta-category": category
-#     }
-#     meta_key = "x-qn-meta-user"
-#     meta_value = "aaa"
-#     request_path = (f"/chgm/{encodedEntryURI}/mime/{urlsafe_base64_encode('img/jpeg')}/"
-#                   f"x-qn-meta-user/{urlsafe_base64_encode(metadata['x-qn-meta-user'])}/"
-#                     f"x-qn-meta-tags/{urlsafe_base64_encode(metadata['x-qn-meta-tags'])}/"
-#                     f"x-qn-meta-category/{urlsafe_base64_encode(metadata['x-qn-meta-category'])}")
-#     full_url = f"https://rs.qiniuapi.com{request_path}"
-#
-#     # 4. 使用SDK生成签名（推荐）
-#     token = q.token_of_request(request_path)
-#     headers = {"Authorization":f"QBox {token}"}
-#
-#     # 5. 发送请求
-#     response = requests.post(full_url, headers=headers)
-#     print(response.text)
-#     print("Request Path:", request_path)
-#     print("Full URL:", full_url)
-#     print("Token:", token)
-#     print("Status Code:", response.status_code)
-#     if response.status_code != 200:
-#         print("元数据设置失败:", response.text)
-#         return None
-#
-#     base_url = 'http://sv81ux7sp.hn-bkt.clouddn.com'
-#
-#     return f'{base_url}/{key}'
-#
-#
-# if __name__ == "__main__":
-#     access_key = "NT8GPMLylWq3_WIl9aNk1zAUWTJtoWrGGVqbvKxh"
-#     secret_key = "uNj2QCpEElzFF4ZkFkvjrBrDITB9ZpO_0ixDbfXD"
-#     bucket_name = "photoxw"
-#     local_file = "aa.png"
-#     file_key = f"images/{local_file}"
-#     tags,category=ai_image(local_file)
-#     url = upload_and_set_metadata(access_key, secret_key, bucket_name, local_file, file_key, tags, category)
-#     if url:
-#         print("文件外链:", url)
-
-from qiniu import Auth, put_file, BucketManager, urlsafe_base64_encode
-import requests
-import time
-import hmac
-import hashlib
-from urllib.parse import quote
-import base64
-from sympy.integrals.meijerint_doc import category
-from color import extract_colors_with_colorthief
-from ai_classify import image_classification
-
-
-def hmac_sha1(signing_str: str, secret_key: str) -> str:
-    """
-    生成 HMAC-SHA1 签名
-    :param signing_str: 待签名的字符串
-    :param secret_key: 密钥（需与API要求一致，如七牛云的SecretKey）
-    :return: Base64编码的签名结果
-    """
-    # 将密钥和字符串转换为字节（UTF-8编码）
-    key_bytes = secret_key.encode('utf-8')
-    msg_bytes = signing_str.encode('utf-8')
-
-    # 计算 HMAC-SHA1 摘要
-    digest = hmac.new(key_bytes, msg_bytes, hashlib.sha1).digest()
-
-    # 将摘要转换为 Base64 字符串
-    return base64.b64encode(digest).decode('utf-8')
-
-def upload_and_set_metadata(access_key, secret_key, bucket_name, file_path, key,category_id,colors):
-    q = Auth(access_key, secret_key)
-
-    # 第一步：上传文件
-    token = q.upload_token(bucket_name, key, 3600)
-    ret, info = put_file(token, key, file_path)
-
-    if not ret or ret.get('key') != key:
-        print("文件上传失败:", info.text_body)
-        return None
-
-    # 第二步：构造双重URL编码的路径参数
-    entry = f"{bucket_name}:{key}"
-    encodedEntryURI = urlsafe_base64_encode(entry) # 双重编码
-
-    # 构造MIME占位参数
-    encoded_mime =urlsafe_base64_encode("")  # 空字符串双重编码
-
-    stat_url = f"https://rs.qiniuapi.com/stat/{encodedEntryURI}"
-    stat_token = q.token_of_request(stat_url)
-    print(stat_url)
-    response = requests.post(stat_url, headers={"Authorization": f"QBox {stat_token}"})
-    print(response.text)  # 应返回文件信息，而非 401
-
-    # 构造元数据参数
-    meta_parts = []
-    metadata = {
-        "x-qn-meta-user": "user01",
-        "x-qn-meta-category": str(category_id),
-        "x-qn-meta-color": ",".join([f"({r},{g},{b})" for r, g, b in colors])
-    }
-    request_path = (
-        f"/chgm/{encodedEntryURI}/mime/{urlsafe_base64_encode('image/jpeg')}/"
-        f"x-qn-meta-user/{urlsafe_base64_encode(metadata['x-qn-meta-user'])}/"
-        f"x-qn-meta-category/{urlsafe_base64_encode(metadata['x-qn-meta-category'])}/"
-        f"x-qn-meta-color/{urlsafe_base64_encode(metadata['x-qn-meta-color'])}"  # 新增颜色字段
-    )
-    full_url = f"https://rs.qiniuapi.com{request_path}"
-
-    # 4. 使用SDK生成签名（推荐）
-    token = q.token_of_request(request_path)
-    headers = {"Authorization":f"QBox {token}"}
-
-    # 5. 发送请求
-    response = requests.post(full_url, headers=headers)
-    print(response.text)
-    print("Request Path:", request_path)
-    print("Full URL:", full_url)
-    print("Token:", token)
-    print("Status Code:", response.status_code)
-    if response.status_code != 200:
-        print("元数据设置失败:", response.text)
-        return None
-
-    base_url = 'http://swlqbhcct.hn-bkt.clouddn.com'
-    
-    return f'{base_url}/{key}'
-
-
-if __name__ == "__main__":
-    access_key = "NT8GPMLylWq3_WIl9aNk1zAUWTJtoWrGGVqbvKxh"
-    secret_key = "uNj2QCpEElzFF4ZkFkvjrBrDITB9ZpO_0ixDbfXD"
-    api_key = "sk-ff8f03a8cfbc03d7df75b7ddb6b1fb7f0bfc8116e02986306865aa9149741301"
-    bucket_name = "photoxa"
-    local_file = "abc.jpg"
-    file_key = f"images/{local_file}"
-    category_map = {
-        0: "风景", 1: "人物肖像", 2: "动物", 3: "交通工具", 4: "食品",
-        5: "建筑", 6: "电子产品", 7: "运动器材", 8: "植物花卉", 9: "医疗用品",
-        10: "办公用品", 11: "服装鞋帽", 12: "家具家居", 13: "书籍文档", 14: "艺术创作",
-        15: "工业设备", 16: "体育赛事", 17: "天文地理", 18: "儿童玩具", 19: "美妆个护",
-        20: "军事装备", 21: "宠物用品", 22: "健身器材", 23: "厨房用品", 24: "实验室器材",
-        25: "音乐器材", 26: "户外装备", 27: "珠宝首饰", 28: "虚拟场景", 29: "其他"
-    }
-    colors = extract_colors_with_colorthief(local_file, num_colors=2)
-    result=image_classification(local_file,api_key)
-    category_id=result['category_id']
-    url = upload_and_set_metadata(access_key, secret_key, bucket_name, local_file, file_key, category_id,colors)
-    if url:
-        print("文件外链:", url)
+import io
+import logging
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from qiniu import Auth, Region, put_data, put_file, BucketManager, urlsafe_base64_encode
+from qiniu.services.storage.uploaders import ResumeUploaderV2
+import requests
+from http_client import client
+
+logger = logging.getLogger(__name__)
+
+# 七牛云存储配置（环境变量）
+# 上传域名和管理域名：上传域名留空时由 SDK 按存储空间自动查询；本地开发可指向 manage.py runfakeqiniu
+QINIU_UP_HOST = os.getenv("PHOTOX_QINIU_UP_HOST", "")
+QINIU_RS_HOST = os.getenv("PHOTOX_QINIU_RS_HOST", "https://rs.qiniuapi.com").rstrip("/")
+# 客户端直传时使用的上传域名（存储空间在华南区域），默认与服务端相同
+QINIU_CLIENT_UP_HOST = (os.getenv("PHOTOX_QINIU_CLIENT_UP_HOST") or QINIU_UP_HOST or "https://up-z2.qiniup.com").rstrip("/")
+# 公开访问域名
+QINIU_PUBLIC_URL = os.getenv("PHOTOX_QINIU_PUBLIC_URL", "http://swlqbhcct.hn-bkt.clouddn.com").rstrip("/")
+# 超过该大小（字节）的文件使用分片上传，分片大小，以及同时上传的分片数
+RESUMABLE_THRESHOLD = int(os.getenv("PHOTOX_QINIU_RESUMABLE_THRESHOLD", str(8 * 1024 * 1024)))
+PART_SIZE = int(os.getenv("PHOTOX_QINIU_PART_SIZE", str(4 * 1024 * 1024)))
+PART_WORKERS = int(os.getenv("PHOTOX_QINIU_PART_WORKERS", "4"))
+
+
+def qiniu_regions():
+    """配置了上传域名时使用固定的区域，否则返回 None 由 SDK 自动查询"""
+    if not QINIU_UP_HOST:
+        return None
+    return [Region(up_host=QINIU_UP_HOST, rs_host=QINIU_RS_HOST, io_host=QINIU_PUBLIC_URL)]
+
+
+def object_metadata(category_id=None, colors=None):
+    """图片对象的自定义元数据（x-qn-meta-*），在上传时一并写入"""
+    metadata = {"x-qn-meta-user": "user01"}
+    if category_id is not None:
+        metadata["x-qn-meta-category"] = str(category_id)
+    if colors:
+        metadata["x-qn-meta-color"] = ",".join([f"({r},{g},{b})" for r, g, b in colors])
+    return metadata
+
+
+def guess_mime_type(key):
+    return mimetypes.guess_type(key)[0] or "image/jpeg"
+
+
+_part_executor = None
+_part_executor_pid = None
+_part_executor_lock = threading.Lock()
+
+
+def _get_part_executor():
+    """分片上传共享的线程池（线程不能跨进程继承，fork 之后按进程号重新创建）"""
+    global _part_executor, _part_executor_pid
+    with _part_executor_lock:
+        if _part_executor is None or _part_executor_pid != os.getpid():
+            _part_executor = ThreadPoolExecutor(max_workers=PART_WORKERS, thread_name_prefix='qiniu-part')
+            _part_executor_pid = os.getpid()
+        return _part_executor
+
+
+def _put(access_key, secret_key, bucket_name, key, file_path=None, data=None, metadata=None, mime_type=None):
+    """
+    上传文件或内存数据，MIME 和自定义元数据随上传请求一起写入；
+    超过 PHOTOX_QINIU_RESUMABLE_THRESHOLD 的使用分片上传 v2，各分片并行上传
+    """
+    q = Auth(access_key, secret_key)
+    token = q.upload_token(bucket_name, key, 3600)
+    mime_type = mime_type or guess_mime_type(key)
+    metadata = metadata or {}
+    size = os.path.getsize(file_path) if file_path else len(data)
+
+    if size > RESUMABLE_THRESHOLD:
+        uploader = ResumeUploaderV2(
+            bucket_name,
+            part_size=PART_SIZE,
+            concurrent_executor=_get_part_executor(),
+            regions=qiniu_regions(),
+        )
+        ret, info = uploader.upload(
+            key,
+            file_path=file_path,
+            data=None if file_path else io.BytesIO(data),
+            data_size=size,
+            mime_type=mime_type,
+            metadata=metadata,
+            up_token=token,
+        )
+    elif file_path:
+        ret, info = put_file(token, key, file_path, mime_type=mime_type, metadata=metadata, regions=qiniu_regions())
+    else:
+        ret, info = put_data(token, key, data, mime_type=mime_type, metadata=metadata, regions=qiniu_regions())
+
+    if not ret or ret.get('key') != key:
+        logger.error(f"文件上传失败: {key} - {info.text_body}")
+        return False
+    return True
+
+
+def upload_file(access_key, secret_key, bucket_name, file_path, key, metadata=None, mime_type=None):
+    """上传本地文件（可同时写入元数据），成功返回 True"""
+    return _put(access_key, secret_key, bucket_name, key, file_path=file_path, metadata=metadata, mime_type=mime_type)
+
+
+def upload_data(access_key, secret_key, bucket_name, data, key, metadata=None, mime_type=None):
+    """上传内存中的数据（可同时写入元数据），成功返回 True"""
+    return _put(access_key, secret_key, bucket_name, key, data=data, metadata=metadata, mime_type=mime_type)
+
+
+def set_metadata(access_key, secret_key, bucket_name, key, category_id, colors):
+    """修改已上传对象的 MIME 和自定义元数据（新上传的图片在上传时已写入，无需再调用），成功返回 True"""
+    q = Auth(access_key, secret_key)
+
+    # 构造双重URL编码的路径参数
+    entry = f"{bucket_name}:{key}"
+    encodedEntryURI = urlsafe_base64_encode(entry) # 双重编码
+
+    request_path = f"/chgm/{encodedEntryURI}/mime/{urlsafe_base64_encode(guess_mime_type(key))}"
+    for name, value in object_metadata(category_id, colors).items():
+        request_path += f"/{name}/{urlsafe_base64_encode(value)}"
+    full_url = f"{QINIU_RS_HOST}{request_path}"
+
+    # 使用SDK生成签名
+    token = q.token_of_request(request_path)
+    headers = {"Authorization":f"QBox {token}"}
+
+    # chgm 可以安全重试，经由共享的出站客户端复用连接
+    response = client.post(full_url, headers=headers, idempotent=True)
+    if response.status_code != 200:
+        logger.error(f"元数据设置失败: {key} - {response.text}")
+        return False
+    return True
+
+
+def public_url(key):
+    return f'{QINIU_PUBLIC_URL}/{key}'
+
+
+def thumbnail_url(key, max_side):
+    """七牛云实时缩略图（imageView2 模式 2：限定最长边，不放大），用于只需要小图的分析"""
+    return f'{public_url(key)}?imageView2/2/w/{max_side}/h/{max_side}/format/jpg/q/90'
+
+
+def client_upload_token(access_key, secret_key, bucket_name, key, expires, max_size, callback_url=None, callback_body=None):
+    """
+    签发给客户端直传的上传凭证：只能新建指定的 key，限制文件大小和类型；
+    配置了回调地址时，七牛云在上传完成后以 JSON 回调服务端，回调的响应原样返回给客户端
+    """
+    q = Auth(access_key, secret_key)
+    policy = {
+        'insertOnly': 1,
+        'fsizeLimit': max_size,
+        'mimeLimit': 'image/*',
+        'returnBody': '{"key":"$(key)","etag":"$(etag)","fsize":$(fsize),"mime_type":"$(mimeType)"}',
+    }
+    if callback_url:
+        policy.update({
+            'callbackUrl': callback_url,
+            'callbackBody': callback_body,
+            'callbackBodyType': 'application/json',
+        })
+    return q.upload_token(bucket_name, key, expires, policy)
+
+
+def stat_object(access_key, secret_key, bucket_name, key):
+    """查询对象的大小、MIME 等信息，对象不存在时返回 None"""
+    bucket = BucketManager(Auth(access_key, secret_key), regions=qiniu_regions())
+    ret, info = bucket.stat(bucket_name, key)
+    if info.status_code == 612:
+        return None
+    if ret is None:
+        raise requests.RequestException(f"查询七牛云对象失败: {key} - {info.text_body}")
+    return ret
+
+
+def verify_callback(access_key, secret_key, authorization, url, body, content_type):
+    """校验七牛云上传回调请求的签名"""
+    return Auth(access_key, secret_key).verify_callback(authorization, url, body, content_type, method='POST')
+
+
+def upload_and_set_metadata(access_key, secret_key, bucket_name, file_path, key,category_id,colors):
+    if not upload_file(access_key, secret_key, bucket_name, file_path, key, object_metadata(category_id, colors)):
+        return None
+    return public_url(key)
+
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from image_context import ImageContext
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# VLM 分类结果缓存配置（环境变量）
+CACHE_ENABLED = os.getenv("PHOTOX_VLM_CACHE", "1") == "1"
+CACHE_PATH = os.getenv("PHOTOX_VLM_CACHE_PATH", os.path.join(BASE_DIR, "vlm_cache.sqlite3"))
+CACHE_TTL_SECONDS = int(os.getenv("PHOTOX_VLM_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("PHOTOX_VLM_CACHE_MAX_ENTRIES", "100000"))
+
+# dHash 的尺寸：缩放为 9x8 灰度图，比较相邻像素得到 64 位哈希
+_DHASH_SIZE = 8
+# 颜色签名：缩放为 2x2 的 RGB 图，每个通道量化为 4 位。
+# dHash 只记录相邻像素的明暗关系，纯色图和从左到右变亮的渐变图哈希都是全 0，
+# 需要颜色签名区分整体亮度和色调不同的图片
+_COLOR_GRID = 2
+_COLOR_SHIFT = 4
+
+
+def perceptual_hash(source):
+    """
+    计算图片的感知哈希：差值哈希（dHash）加低分辨率颜色签名，重新编码、轻微缩放后的相同图片哈希一致
+    :param source: ImageContext、本地文件路径或 PIL 图片
+    :return: "<16 位 dHash>-<12 位颜色签名>" 形式的十六进制字符串
+    """
+    if isinstance(source, ImageContext):
+        img = source.scaled(max_side=256)
+    elif isinstance(source, Image.Image):
+        img = source
+    else:
+        img = Image.open(source)
+        img.draft('RGB', (256, 256))
+    gray = img.convert('L').resize((_DHASH_SIZE + 1, _DHASH_SIZE), Image.Resampling.BILINEAR)
+    pixels = list(gray.getdata())
+    value = 0
+    for row in range(_DHASH_SIZE):
+        offset = row * (_DHASH_SIZE + 1)
+        for col in range(_DHASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+    color = img.convert('RGB').resize((_COLOR_GRID, _COLOR_GRID), Image.Resampling.BOX)
+    signature = ''.join(f"{channel >> _COLOR_SHIFT:x}" for pixel in color.getdata() for channel in pixel)
+    return f"{value:016x}-{signature}"
+
+
+class VLMResultCache:
+    """
+    VLM 分类结果的持久化缓存：以 (感知哈希, 模型名, 提示词版本) 为键存储在本地 SQLite 中，
+    进程重启后依然有效；条目超过 ttl 秒视为过期，总数超过 max_entries 时按最近访问时间淘汰
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connection(self):
+        # SQLite 连接不能跨进程使用，fork 之后按进程号重新连接
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            # WAL 模式下多个 worker 进程可以同时读写
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS vlm_cache ("
+                " phash TEXT NOT NULL, model TEXT NOT NULL, prompt_version TEXT NOT NULL,"
+                " result TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (phash, model, prompt_version))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS vlm_cache_accessed_at ON vlm_cache (accessed_at)")
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, phash, model, prompt_version):
+        """读取缓存结果，未命中或已过期时返回 None"""
+        now = time.time()
+        key = (phash, model, prompt_version)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT result, created_at FROM vlm_cache WHERE phash=? AND model=? AND prompt_version=?", key
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM vlm_cache WHERE phash=? AND model=? AND prompt_version=?", key)
+                conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            # 更新最近访问时间（LRU 淘汰依据）
+            conn.execute(
+                "UPDATE vlm_cache SET accessed_at=? WHERE phash=? AND model=? AND prompt_version=?", (now,) + key
+            )
+            conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, phash, model, prompt_version, result):
+        """写入缓存结果，超出容量时淘汰最久未访问的条目"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO vlm_cache (phash, model, prompt_version, result, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (phash, model, prompt_version, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            conn.execute(
+                "DELETE FROM vlm_cache WHERE rowid IN ("
+                " SELECT rowid FROM vlm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+
+    def get_or_call(self, source, model, prompt_version, call):
+        """
+        缓存入口：感知哈希相同的图片直接返回缓存结果，否则执行 call() 并缓存成功的结果
+        缓存本身出错时退化为直接调用，不影响分类
+        """
+        if not CACHE_ENABLED:
+            return call()
+        try:
+            phash = perceptual_hash(source)
+            cached = self.get(phash, model, prompt_version)
+        except Exception as e:
+            logger.error(f"读取 VLM 缓存失败: {str(e)}")
+            return call()
+        if cached is not None:
+            logger.info(f"VLM 缓存命中: {phash}")
+            return cached
+
+        result = call()
+        if result is not None:
+            try:
+                self.set(phash, model, prompt_version, result)
+            except Exception as e:
+                logger.error(f"写入 VLM 缓存失败: {str(e)}")
+        return result
+
+    def stats(self):
+        """当前进程的命中/未命中计数和缓存条目数"""
+        with self._lock:
+            size = self._connection().execute("SELECT COUNT(*) FROM vlm_cache").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": size,
+            }
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM vlm_cache")
+            conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+
+# 进程级单例
+cache = VLMResultCache()